@@ -0,0 +1,195 @@
+"""
+Local stand-in for the api-studente/v1 endpoints used by Nuvola, answering with synthetic data.
+
+Usage:
+    python benchmarks/mock_server.py --port 8080 --latency 0.05 --students 2 --years 1
+
+then point Nuvola at it with NuvolaOptions().set("base_url", "http://127.0.0.1:8080").
+"""
+import argparse
+import base64
+import datetime
+import hashlib
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+from synthetic import SchoolYears
+
+
+class MockNuvola:
+    """
+    Threaded http server answering the api calls of Nuvola from a SchoolYears, every response delayed by `latency`
+    seconds. Any session token is accepted by login-from-web, and any user token by the api calls.
+
+    Usage:
+        with MockNuvola(SchoolYears(), latency=0.05) as server:
+            options.set("base_url", server.url)
+    """
+    TOKEN_LIFETIME = datetime.timedelta(hours=1)
+
+    def __init__(self, data, latency=0.0, host="127.0.0.1", port=0):
+        """
+        :param data: Data served
+        :param latency: Seconds waited before every response
+        :param host: Address to listen on
+        :param port: Port to listen on, by default a free one
+        :type data: SchoolYears
+        :type latency: float
+        """
+        self.data = data
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.requests = {}
+        self.routes = [
+            (re.compile(r"/api-studente/v1/login-from-web"), self.login),
+            (re.compile(r"/api-studente/v1/alunni"), lambda: self.data.get_students()),
+            (re.compile(r"/api-studente/v1/alunno/(\d+)/compito/elenco/([\d-]+)/([\d-]+)"),
+             lambda s, a, b: self.data.get_homeworks(int(s), self.date(a), self.date(b))),
+            (re.compile(r"/api-studente/v1/alunno/(\d+)/argomento-lezione/elenco/([\d-]+)/([\d-]+)"),
+             lambda s, a, b: self.data.get_topics(int(s), self.date(a), self.date(b))),
+            (re.compile(r"/api-studente/v1/alunno/(\d+)/eventi-classe"), lambda s: self.data.get_events(int(s))),
+            (re.compile(r"/api-studente/v1/alunno/(\d+)/assenze"), lambda s: self.data.get_absences(int(s))),
+            (re.compile(r"/api-studente/v1/assenza/(\d+)"), self.absence_detail),
+            (re.compile(r"/api-studente/v1/alunno/(\d+)/frazioni-temporali"), lambda s: self.data.get_time_windows()),
+            (re.compile(r"/api-studente/v1/alunno/(\d+)/frazione-temporale/(\d+)/voti/materie"),
+             lambda s, tw: self.data.get_subjects(int(s), int(tw))),
+            (re.compile(r"/api-studente/v1/alunno/(\d+)/frazione-temporale/(\d+)/voti/materia/(\d+)"),
+             lambda s, tw, m: self.data.get_marks(int(s), int(tw), int(m))),
+            (re.compile(r"/api-studente/v1/alunno/(\d+)/(compito|eventi-classe|argomento-lezione)/allegato/(\d+)"),
+             lambda s, kind, id_: self.data.get_attachment(kind, int(id_)))
+        ]
+        self.server = ThreadingHTTPServer((host, port), self.handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @staticmethod
+    def date(s):
+        return datetime.datetime.strptime(s, "%d-%m-%Y").date()
+
+    def login(self):
+        # an unsigned jwt, Nuvola only reads its expiration
+        exp = int((datetime.datetime.now() + self.TOKEN_LIFETIME).timestamp())
+        payload = base64.urlsafe_b64encode(json.dumps({"exp": exp}).encode()).decode().rstrip("=")
+        return {"token": f"mock.{payload}.mock"}
+
+    def absence_detail(self, id_):
+        return {"dettaglio": self.data.get_absence_detail(int(id_))}
+
+    def answer(self, path):
+        """
+        :return: Http status and body of the response
+        :rtype: (int, object)
+        """
+        for pattern, f in self.routes:
+            m = pattern.fullmatch(path)
+            if m:
+                with self.lock:
+                    self.requests[pattern.pattern] = self.requests.get(pattern.pattern, 0) + 1
+                r = f(*m.groups())
+                # the api wraps the lists in "valori", login, details and attachments are returned as they are
+                return 200, r if type(r) in (dict, bytes) else {"valori": r}
+        return 404, {"code": 404, "message": "Not Found"}
+
+    def handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # headers and body are written separately, Nagle would hold the body for a delayed ack
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                if server.latency:
+                    time.sleep(server.latency)
+                status, body = server.answer(urlparse(self.path).path.replace("//", "/"))
+                etag = None
+                if type(body) is bytes:
+                    content_type = "application/octet-stream"
+                    etag = '"{}"'.format(hashlib.sha1(body).hexdigest())
+                    m = re.fullmatch(r"bytes=(\d+)-", self.headers.get("Range", ""))
+                    # a range of another version of the file is ignored, the whole file is sent
+                    if m and self.headers.get("If-Range", etag) == etag:
+                        start = int(m[1])
+                        if start >= len(body):
+                            status, self.range, body = 416, f"bytes */{len(body)}", b""
+                        else:
+                            status = 206
+                            self.range = f"bytes {start}-{len(body) - 1}/{len(body)}"
+                            body = body[start:]
+                else:
+                    content_type = "application/json"
+                    body = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                if etag is not None:
+                    self.send_header("ETag", etag)
+                if status in (206, 416):
+                    self.send_header("Content-Range", self.range)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *_):
+                pass
+
+        return Handler
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name="mock-nuvola", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *_):
+        self.stop()
+
+
+def add_data_arguments(parser):
+    parser.add_argument("--students", type=int, default=1)
+    parser.add_argument("--subjects", type=int, default=10)
+    parser.add_argument("--years", type=int, default=1)
+    parser.add_argument("--marks", type=int, default=8, help="marks per subject in every time window")
+    parser.add_argument("--homeworks", type=int, default=2, help="homeworks per school day")
+    parser.add_argument("--hours", type=int, default=5, help="lesson hours per school day")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds waited before every response")
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def data_from_arguments(args):
+    return SchoolYears(students=args.students, subjects=args.subjects, years=args.years,
+                       marks_per_subject=args.marks, homeworks_per_day=args.homeworks, hours_per_day=args.hours,
+                       seed=args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serves synthetic data through the api of Nuvola")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    add_data_arguments(parser)
+    args = parser.parse_args()
+    server = MockNuvola(data_from_arguments(args), args.latency, args.host, args.port)
+    print(f"Serving on {server.url}, first school day {server.data.start}")
+    try:
+        server.server.serve_forever()
+    except KeyboardInterrupt:
+        server.server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Benchmarks of Nuvola against the local mock server: cold init, refresh, dump_to_dict, import, the query getters and
+the attachment downloads.
+
+Usage:
+    python benchmarks/run.py --students 1 --years 2 --latency 0.02 --repeat 3
+
+Every benchmark runs `repeat` times and reports the best and the median time, with the requests it sent.
+"""
+import argparse
+import datetime
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from mock_server import MockNuvola, add_data_arguments, data_from_arguments  # noqa: E402
+from nuvola import Nuvola, NuvolaOptions  # noqa: E402
+
+
+def make_options(args, server):
+    o = NuvolaOptions()
+    o.set("base_url", server.url)
+    o.set("use_token_files", False)
+    o.set("start_date", server.data.start - datetime.timedelta(days=1))
+    if args.students > 1:
+        o.set("student_id", 1)
+    o.set("homeworks", {"scan_workers": args.workers, "adaptive_scan": args.adaptive})
+    o.set("topics", {"scan_workers": args.workers, "adaptive_scan": args.adaptive})
+    o.set("timeWindows", {"subject_workers": args.workers})
+    return o
+
+
+def queries(n):
+    """
+    Runs the getters over every day of the register
+    """
+    count = 0
+    start, end = n.options.get("start_date"), max(i.date_expired for i in n.homeworks.data)
+    day = start
+    while day <= end:
+        count += sum(1 for _ in n.homeworks.get_by_expiration_date(day))
+        count += sum(1 for _ in n.homeworks.get_by_assignment_date(day, datetime.timedelta(days=6)))
+        count += sum(1 for _ in n.topics.get_by_date(day))
+        count += sum(1 for _ in n.events.get_by_date(day))
+        day += datetime.timedelta(days=1)
+    for s in n.active_time_window.get_all_subjects():
+        count += sum(1 for _ in n.homeworks.get_by_subject(s.name))
+        count += sum(1 for _ in n.topics.get_by_subject(s.name))
+        count += sum(1 for _ in s.get_all())
+    return count
+
+
+def measure(name, f, repeat, server):
+    """
+    :return: Last result of f
+    """
+    times = []
+    result = None
+    before = sum(server.requests.values())
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = f()
+        times.append(time.perf_counter() - start)
+    requests_ = (sum(server.requests.values()) - before) / repeat
+    print(f"{name:<14} best {min(times):9.4f}s   median {statistics.median(times):9.4f}s   "
+          f"requests {requests_:7.1f}")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks Nuvola against a local mock server")
+    add_data_arguments(parser)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=1, help="scan and subject workers")
+    parser.add_argument("--adaptive", action="store_true", help="use the adaptive window scans")
+    args = parser.parse_args()
+
+    with MockNuvola(data_from_arguments(args), args.latency) as server:
+        data = server.data
+        print(f"{args.students} students, {args.subjects} subjects, {args.years} years "
+              f"({len(data.days)} school days), {args.marks} marks per subject, latency {args.latency}s")
+        options = make_options(args, server)
+        # the data of the students is generated before the timers start
+        data.student(1)
+
+        n = measure("cold init", lambda: Nuvola(options), args.repeat, server)
+        measure("refresh", lambda: n.check_and_update_all(force=True), args.repeat, server)
+        exported = measure("dump_to_dict", n.dump_to_dict, args.repeat, server)
+        print(f"{'':<14} export size {len(json.dumps(exported)) / 1024:.0f} KiB")
+        measure("import", lambda: Nuvola(options, exported), args.repeat, server)
+        count = measure("queries", lambda: queries(n), args.repeat, server)
+        print(f"{'':<14} {count} records returned")
+        with tempfile.TemporaryDirectory() as d:
+            files = measure("attachments", lambda: n.download_attachments(directory=d), args.repeat, server)
+            print(f"{'':<14} {len(files)} files, {sum(os.path.getsize(i) for i in files) / 1024:.0f} KiB")
+        n.close()
+
+
+if __name__ == "__main__":
+    main()
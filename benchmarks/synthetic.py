@@ -0,0 +1,175 @@
+import datetime
+import random
+
+
+class SchoolYears:
+    """
+    Synthetic register data, generated deterministically from a seed, in the format of the api-studente/v1
+    responses. Every student has its own homeworks, topics, events, absences and marks.
+
+    Holidays are kept shorter than the max_empty_days of the default options, so that the window scans of
+    Homeworks and Topics cover every year instead of stopping at the first summer.
+    """
+    TIME_WINDOWS = ("PRIMO QUADRIMESTRE", "SECONDO QUADRIMESTRE", "INTERO ANNO")
+    ABSENCE_TYPES = ("ASSENZA", "RITARDO", "USCITA", "RITARDO/USCITA")
+
+    def __init__(self, students=1, subjects=10, years=1, marks_per_subject=8, homeworks_per_day=2, hours_per_day=5,
+                 events=40, absences=30, attachment_size=256 * 1024, start=datetime.date(2020, 9, 14), seed=0):
+        """
+        :param students: Students associated with the account
+        :param subjects: Subjects of every time window
+        :param years: Length of the register, in school years of 200 school days
+        :param marks_per_subject: Marks of every subject in every time window
+        :param homeworks_per_day: Homeworks assigned every school day
+        :param hours_per_day: Lesson hours with a topic every school day
+        :param events: Class events of every student
+        :param absences: Absences, delays and exits of every student
+        :param attachment_size: Bytes of every attachment
+        :param start: First school day
+        :param seed: Seed of the generator, the same seed always gives the same data
+        """
+        self.students = students
+        self.subjects = subjects
+        self.years = years
+        self.marks_per_subject = marks_per_subject
+        self.homeworks_per_day = homeworks_per_day
+        self.hours_per_day = hours_per_day
+        self.events = events
+        self.absences = absences
+        self.attachment_size = attachment_size
+        self.start = start
+        self.seed = seed
+        self.days = self.school_days()
+        self.cache = {}
+
+    def school_days(self):
+        # weekdays, with two weeks of holidays after every 100 school days
+        days = []
+        d = self.start
+        while len(days) < 200 * self.years:
+            if d.weekday() < 5:
+                days.append(d)
+                if len(days) % 100 == 0:
+                    d += datetime.timedelta(days=14)
+            d += datetime.timedelta(days=1)
+        return days
+
+    @property
+    def end(self):
+        return self.days[-1]
+
+    @staticmethod
+    def date(d):
+        return d.isoformat() + "T00:00:00+02:00"
+
+    def student(self, id_):
+        """
+        :return: Collections of a student, generated when first asked
+        :rtype: dict
+        """
+        if id_ not in self.cache:
+            self.cache[id_] = self.generate(id_)
+        return self.cache[id_]
+
+    def generate(self, id_):
+        r = random.Random(f"{self.seed}/{id_}")
+        subjects = [f"MATERIA {i}" for i in range(self.subjects)]
+        teachers = [f"DOCENTE {i}" for i in range(max(self.subjects // 2, 1))]
+        homeworks, topics = [], {}
+        for n, day in enumerate(self.days):
+            for k in range(self.homeworks_per_day):
+                due = self.days[min(n + r.randrange(1, 6), len(self.days) - 1)]
+                hid = n * self.homeworks_per_day + k
+                homeworks.append({
+                    "id": hid, "docente": r.choice(teachers), "materia": r.choice(subjects), "classe": "3A",
+                    "classeId": 1, "dataAssegnazione": self.date(day), "dataConsegna": self.date(due),
+                    "descrizioneCompito": [f"Esercizi da pagina {r.randrange(1, 300)} a {r.randrange(300, 400)}"],
+                    "allegati": [{"id": hid, "nome": f"scheda{hid}.pdf", "mimeType": "application/pdf"}]
+                    if hid % 10 == 0 else []
+                })
+            topics[day] = [{
+                "numeroOra": h + 1, "giorno": self.date(day),
+                "inizioOra": f"{8 + h:02d}:00", "fineOra": f"{9 + h:02d}:00",
+                "argomenti": [{
+                    "id": n * self.hours_per_day + h, "tipo": "Lezione", "materia": r.choice(subjects),
+                    "nomeArgomento": f"Argomento {n}.{h}", "descrizioneEstesa": f"Spiegazione e esercizi {n}.{h}",
+                    "compresenza": False, "docente": r.choice(teachers), "annotazioni": "", "allegati": [],
+                    "video_youtube": None
+                }]
+            } for h in range(self.hours_per_day)]
+        events = []
+        for k in range(self.events):
+            day = r.choice(self.days)
+            events.append({
+                "id": k, "tipo": r.choice(("Gita", "Uscita didattica", "Assemblea")), "nome": f"Evento {k}",
+                "descrizione": f"Descrizione dell'evento {k}", "docente": r.choice(teachers), "annotazioni": "",
+                "visto": r.random() < 0.5, "allegati": [], "linkVideo": None, "coloreSfondo": "#ffffff",
+                "coloreTesto": "#000000", "coloreBordo": "#000000", "idNotifica": k,
+                "dataInizio": self.date(day), "oraInizio": "08:00",
+                "dataFine": self.date(day + datetime.timedelta(days=r.randrange(0, 3))), "oraFine": "13:00"
+            })
+        absences = [{
+            "id": k, "tipo": self.ABSENCE_TYPES[k % len(self.ABSENCE_TYPES)], "tipoAssenza": "Salute", "turno": "M",
+            "ora": None if k % 4 == 0 else {"numeroOra": r.randrange(1, 6)},
+            "data": self.date(r.choice(self.days)), "giustificata": r.random() < 0.8
+        } for k in range(self.absences)]
+        # the whole year window holds the marks of both halves
+        half = len(self.days) // 2
+        marks = {}
+        for tw, days in ((1, self.days[:half]), (2, self.days[half:])):
+            for s in range(self.subjects):
+                marks[tw, s] = [{
+                    "id": (tw * self.subjects + s) * self.marks_per_subject + k, "data": self.date(r.choice(days)),
+                    "docente": teachers[s % len(teachers)], "tipologia": r.choice(("Scritto", "Orale", "Pratico")),
+                    "valutazione": "", "valutazioneMatematica": str(r.choice((4, 5, 5.5, 6, 6.5, 7, 7.5, 8, 9, 10))),
+                    "faMedia": r.random() < 0.9, "peso": r.choice(("100%", "50%")), "descrizione": "",
+                    "nomeObiettivo": None, "obiettivi": []
+                } for k in range(self.marks_per_subject)]
+        for s in range(self.subjects):
+            marks[3, s] = marks[1, s] + marks[2, s]
+        return {
+            "subjects": subjects,
+            "homeworks": homeworks,
+            "topics": topics,
+            "events": events,
+            "absences": absences,
+            "marks": marks
+        }
+
+    def get_students(self):
+        return [{"id": i, "nome": f"NOME{i}", "cognome": f"COGNOME{i}"} for i in range(1, self.students + 1)]
+
+    def get_homeworks(self, id_, start, end):
+        return [i for i in self.student(id_)["homeworks"]
+                if start <= datetime.date.fromisoformat(i["dataConsegna"][:10]) <= end]
+
+    def get_topics(self, id_, start, end):
+        topics = self.student(id_)["topics"]
+        return [{"classe": "3A", "classeId": 1, "ore": topics[d]} for d in sorted(topics) if start <= d <= end]
+
+    def get_events(self, id_):
+        return self.student(id_)["events"]
+
+    def get_absences(self, id_):
+        return self.student(id_)["absences"]
+
+    def get_absence_detail(self, id_):
+        return {"turno": "M", "orarioIngresso": f"09:{id_ % 60:02d}", "orarioUscita": None}
+
+    def get_attachment(self, kind, id_):
+        """
+        :param kind: Path of the records, e.g. "compito"
+        :param id_: Id of the attachment
+        :rtype: bytes
+        """
+        line = f"{kind} {id_}\n".encode()
+        return (line * (self.attachment_size // len(line) + 1))[:self.attachment_size]
+
+    def get_time_windows(self):
+        return [{"id": i + 1, "nome": n, "corrente": i == 1} for i, n in enumerate(self.TIME_WINDOWS)]
+
+    def get_subjects(self, id_, tw):
+        return [{"id": i, "materia": n, "tipo": "N"} for i, n in enumerate(self.student(id_)["subjects"])]
+
+    def get_marks(self, id_, tw, subject):
+        return [{"voti": self.student(id_)["marks"].get((tw, subject), [])}]
@@ -1 +1,3 @@
 from .nuvola import Nuvola, NuvolaOptions
+from .async_nuvola import AsyncNuvola
+from .orchestrator import NuvolaOrchestrator
@@ -0,0 +1,572 @@
+import asyncio
+import contextvars
+import datetime
+import os
+import time
+from abc import abstractmethod
+from collections import deque
+from heapq import heapify, heappop, heappush
+from urllib.parse import urlparse
+from .nuvola import Nuvola, NuvolaOptions
+from .version import VERSION
+
+
+class AsyncNuvola(Nuvola):
+    """
+    asyncio counterpart of Nuvola.
+
+    The api calls and the loaders are coroutines, while the records (Homework, Event, Topic, Mark, ...) and the
+    getters are the same of Nuvola. Getters never fetch anything: expired collections are refreshed by awaiting
+    check_and_update() or check_and_update_all().
+
+    Usage:
+        nuvola = await AsyncNuvola.create(options, client=client)
+    """
+    def __init__(self, options=NuvolaOptions(), client=None, loop=None):
+        """
+        :param options: User defined options
+        :param client: HTTP client, an httpx.AsyncClient or an aiohttp.ClientSession. When omitted an
+            httpx.AsyncClient is created and owned by this object
+        :param loop: Event loop, by default the running one
+        :type options: NuvolaOptions
+        :type loop: asyncio.AbstractEventLoop
+        """
+        self.options = options
+        self.loop = loop
+        self.URL = self.options.get("base_url")
+        self.metrics = self.Metrics()
+        self.grade_table = None
+        self.text_index = self.TextIndex()
+        self.db = None if self.options.get("store_path") is None else self.Database(self.options.get("store_path"))
+        c = self.options.get("attachments")["cache_path"]
+        self.attachment_cache = None if c is None else self.AttachmentCache(c)
+        self.conn = self.Connection(self, self.options, client)
+        self.homeworks, self.events, self.topics, self.time_windows, self.active_time_window, self.id_student = (
+            None, None, None, None, None, None)
+        self.irregularities = None
+
+    @classmethod
+    async def create(cls, options=NuvolaOptions(), old_data=None, client=None, loop=None):
+        """
+        Creates and initializes an AsyncNuvola
+
+        :param options: User defined options
+        :param old_data: Data previously exported
+        :param client: HTTP client, see __init__
+        :param loop: Event loop, by default the running one
+        :rtype: AsyncNuvola
+        """
+        self = cls(options, client, loop)
+        await self.init(old_data)
+        return self
+
+    def get_loop(self):
+        return self.loop if self.loop is not None else asyncio.get_running_loop()
+
+    async def init(self, old_data=None):
+        """
+        Gets the tokens and loads, or imports, every collection
+
+        :param old_data: Data previously exported
+        :type old_data: dict
+        """
+        self.print(":: Init :: Connection...")
+        with self.metrics.timer("init", "Connection"):
+            await self.conn.open()
+        obj = {
+            "homeworks": None,
+            "events": None,
+            "topics": None,
+            "timeWindows": None
+        }
+        if isinstance(old_data, self.Snapshot):
+            old_data = old_data.blocks()
+        if type(old_data) is dict:
+            if not all([i in self.EXPORT_KEYS for i in old_data.keys()]):
+                self.print(":: Import :: Import object format is not accepted, skipping import")
+            elif not self.options.get("force_import") and old_data["version"] != VERSION:
+                # there is no one to ask, unlike Nuvola
+                self.print(":: Import :: Data exported from another version of nuvola, skipping import")
+            else:
+                obj = old_data
+        if self.db is not None:
+            obj = self.db.complete_import(obj)
+        if obj.get("textIndex") is not None:
+            self.text_index = self.TextIndex(obj["textIndex"])
+
+        if self.options.get("student_id") is None:
+            self.print(":: Init :: Retriving Student Id")
+            self.id_student = self.pick_student_id((await self.get_custom(self.STUDENTS_CALL))["valori"])
+        else:
+            self.id_student = self.options.get("student_id")
+
+        self.print(":: Init :: Homeworks, Events, Topics, TimeWindows, Irregularities...")
+        self.homeworks = self.Homeworks(self, self.options, obj["homeworks"], fetch=False)
+        self.events = self.Events(self, self.options, obj["events"], fetch=False)
+        self.topics = self.Topics(self, self.options, obj["topics"], fetch=False)
+        self.irregularities = self.Irregularities(self, self.options, obj.get("irregularities"), fetch=False)
+        to_load = [i.load() for i, o in ((self.homeworks, obj["homeworks"]), (self.events, obj["events"]),
+                                         (self.topics, obj["topics"]),
+                                         (self.irregularities, obj.get("irregularities")))
+                   if type(o) is not dict and not isinstance(o, self.Snapshot.Block) and not i.stored]
+        to_load.append(self.__load_time_windows(obj["timeWindows"]))
+        await asyncio.gather(*to_load)
+        self.active_time_window = self.select_best_time_window()
+
+    async def __load_time_windows(self, old_data=None):
+        if type(old_data) is list:
+            self.time_windows = [self.TimeWindow(self, i["raw"], self.options, i) for i in old_data]
+            return
+        if isinstance(old_data, self.Snapshot.Block):
+            self.time_windows = old_data.time_windows(self)
+            return
+        time_windows = [self.TimeWindow(self, i, self.options, fetch=False)
+                        for i in await self.get("frazioni-temporali")]
+        await self.SubjectLoader(self, self.options.get("timeWindows")["subject_workers"]).load(time_windows)
+        self.time_windows = time_windows
+
+    async def get(self, call, priority=None):
+        """
+        Formats api request and sends it to /api-studente/v1/alunno/[call]
+
+        :param call: API call
+        :param priority: Priority class of the request, see Connection.INTERACTIVE
+        :type call: str
+        :type priority: int
+        :return: dict
+        """
+        url = "{}/api-studente/v1/alunno/{}/{}".format(self.URL, self.id_student, call)
+        d = await self.conn.get_data(url, priority)
+        return d["valori"]
+
+    async def get_custom(self, custom_url, priority=None):
+        """
+        Send raw call to connection.get_data without formatting to nuvola.madisoft.it/[custom_url].
+
+        :param custom_url: URL
+        :param priority: Priority class of the request, see Connection.INTERACTIVE
+        :type custom_url: str
+        :type priority: int
+        :return: dict
+        """
+        return await self.conn.get_data(f"{self.URL}/{custom_url}", priority)
+
+    @staticmethod
+    async def map_concurrently(f, it, workers=1):
+        """
+        Awaits f on every item with at most `workers` calls running at the same time, keeping the order
+
+        :type workers: int
+        :rtype: list
+        """
+        semaphore = asyncio.Semaphore(max(workers, 1))
+
+        async def run(i):
+            async with semaphore:
+                return await f(i)
+
+        return await asyncio.gather(*(run(i) for i in it))
+
+    async def download_attachment(self, file, path=None):
+        """
+        Downloads an attachment, see Nuvola.download_attachment. The transfer and the cache are blocking, they
+        are run in the executor
+
+        :type file: Nuvola.File
+        :type path: str
+        :return: Path of the downloaded file, the one in the cache when path is None
+        :rtype: str
+        """
+        return await self.get_loop().run_in_executor(None, super().download_attachment, file, path)
+
+    async def download_attachments(self, files=None, directory=None, workers=None):
+        """
+        Downloads many attachments concurrently, see Nuvola.download_attachments
+
+        :type files: list[Nuvola.File]
+        :type directory: str
+        :type workers: int
+        :return: Paths of the downloaded files, in the order of files
+        :rtype: list[str]
+        """
+        if files is None:
+            files = [f for c in (self.homeworks, self.events, self.topics) for r in c.get_all() for f in r.attachments]
+        if workers is None:
+            workers = self.options.get("attachments")["workers"]
+
+        async def download(f):
+            if directory is None:
+                return await self.download_attachment(f)
+            return await self.download_attachment(f, os.path.join(directory, f"{f.id_} {os.path.basename(f.name)}"))
+
+        return await self.map_concurrently(download, files, workers)
+
+    async def check_and_update_all(self, force=False):
+        await asyncio.gather(*(i.check_and_update(force)
+                               for i in (self.homeworks, self.events, self.topics, self.irregularities)))
+        expired = [i for i in self.time_windows if force or i.is_expired()]
+        if expired:
+            self.print(":: Fetch :: TimeWindows...")
+            with self.metrics.timer("load", "TimeWindow"):
+                await self.SubjectLoader(self, self.options.get("timeWindows")["subject_workers"]).load(expired)
+
+    async def dump_to_dict(self, update_first=False):
+        await self.check_and_update_all(update_first)
+        return self.export()
+
+    async def dump_to_snapshot(self, path, update_first=False):
+        await self.check_and_update_all(update_first)
+        await self.get_loop().run_in_executor(None, self.Snapshot.write, self, path)
+
+    async def close(self):
+        """
+        Releases the HTTP client, when it is owned by this object, and the store
+        """
+        await self.conn.close()
+        if self.db is not None:
+            self.db.close()
+
+    class Connection:
+        """
+        Requests of AsyncNuvola. They go through a rate limiter of their host, with the "rate_limit" options, and
+        back off while the host throttles them, as the ones of Nuvola.Connection.
+        """
+        RequestErrorException = Nuvola.Connection.RequestErrorException
+        InvalidResponseException = Nuvola.Connection.InvalidResponseException
+        INTERACTIVE = Nuvola.Connection.INTERACTIVE
+        BACKGROUND = Nuvola.Connection.BACKGROUND
+        THROTTLE_STATUSES = Nuvola.Connection.THROTTLE_STATUSES
+
+        class RateLimiter(Nuvola.Connection.RateLimiter):
+            """
+            asyncio counterpart of Nuvola.Connection.RateLimiter, used from one event loop
+            """
+            def __init__(self, rate, burst, max_concurrency):
+                super().__init__(rate, burst, max_concurrency)
+                self.condition = asyncio.Condition()
+
+            async def acquire(self, priority):
+                async with self.condition:
+                    me = (priority, next(self.arrivals))
+                    heappush(self.waiting, me)
+                    try:
+                        while True:
+                            now = time.monotonic()
+                            self.__refill(now)
+                            wait = self.__wait_time(now) if self.waiting[0] == me else None
+                            if wait == 0:
+                                break
+                            try:
+                                await asyncio.wait_for(self.condition.wait(), wait)
+                            except asyncio.TimeoutError:
+                                pass
+                    except BaseException:
+                        self.waiting.remove(me)
+                        heapify(self.waiting)
+                        self.condition.notify_all()
+                        raise
+                    heappop(self.waiting)
+                    if self.rate > 0:
+                        self.tokens -= 1
+                    self.running += 1
+                    # the next request in line checks its own wait time
+                    self.condition.notify_all()
+
+            async def release(self):
+                async with self.condition:
+                    self.running -= 1
+                    self.condition.notify_all()
+
+            async def pause(self, seconds):
+                async with self.condition:
+                    self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+                    self.condition.notify_all()
+
+        def __init__(self, parent, options, client=None):
+            """
+            :param parent: Parent nuvola object
+            :param options: User defined options
+            :param client: HTTP client, see AsyncNuvola
+            :type parent: AsyncNuvola
+            :type options: NuvolaOptions
+            """
+            self.parent = parent
+            self.options = options
+            self.client = client
+            self.own_client = client is None
+            self.tokens = None
+            self.refreshing = None
+            # rate limiters by host
+            self.limiters = {}
+            # a task inherits the priority of the one which created it
+            self.priority = contextvars.ContextVar("priority", default=self.INTERACTIVE)
+
+        async def open(self):
+            if self.client is None:
+                try:
+                    import httpx
+                except ImportError:
+                    raise ImportError("AsyncNuvola needs an HTTP client: install httpx or pass a client") from None
+                c = self.options.get("connection")
+                self.client = httpx.AsyncClient(
+                    limits=httpx.Limits(max_connections=c["pool_size"],
+                                        max_keepalive_connections=c["pool_size"] if c["keep_alive"] else 0),
+                    transport=httpx.AsyncHTTPTransport(retries=c["max_retries"]))
+            # the token files and the login scraper are blocking, they are run once in the executor; the sync
+            # connection is used for its tokens and for the attachments
+            self.tokens = await self.parent.get_loop().run_in_executor(
+                None, Nuvola.Connection, self.parent, self.options)
+
+        async def refresh_tokens(self, stale):
+            # callers which find an expired token while a refresh is running wait for that refresh
+            if self.refreshing is None:
+                self.refreshing = asyncio.ensure_future(
+                    self.parent.get_loop().run_in_executor(None, self.tokens.refresh_tokens_once, stale))
+                self.refreshing.add_done_callback(lambda _: setattr(self, "refreshing", None))
+            await asyncio.shield(self.refreshing)
+
+        def set_priority(self, priority):
+            """
+            Sets the default priority class of the requests sent by the current task, and by the tasks it creates
+            """
+            self.priority.set(priority)
+
+        def get_priority(self):
+            """
+            :return: Default priority class of the requests sent by the current task
+            :rtype: int
+            """
+            return self.priority.get()
+
+        def limiter(self, url):
+            """
+            :rtype: AsyncNuvola.Connection.RateLimiter
+            """
+            host = urlparse(url).netloc
+            if host not in self.limiters:
+                o = self.options.get("rate_limit")
+                self.limiters[host] = self.RateLimiter(o["rate"], o["burst"], o["max_concurrency"])
+            return self.limiters[host]
+
+        async def send(self, url, token, priority=None):
+            """
+            Sends a request through the rate limiter of its host, backing off and retrying while it's throttled
+
+            :return: Body of the response
+            :rtype: str
+            """
+            if priority is None:
+                priority = self.get_priority()
+            limiter = self.limiter(url)
+            o = self.options.get("rate_limit")
+            for attempt in range(o["max_retries"] + 1):
+                await limiter.acquire(priority)
+                start = time.perf_counter()
+                try:
+                    r = await self.client.get(url, headers={"Authorization": "Bearer " + token})
+                    # httpx exposes the body as an attribute, aiohttp as a coroutine
+                    j_s = r.text() if callable(r.text) else r.text
+                    if asyncio.iscoroutine(j_s):
+                        j_s = await j_s
+                finally:
+                    await limiter.release()
+                status = r.status_code if hasattr(r, "status_code") else r.status
+                throttled = status in self.THROTTLE_STATUSES
+                self.parent.metrics.request(url, status, time.perf_counter() - start, len(j_s.encode()),
+                                            retry=throttled and attempt < o["max_retries"])
+                if not throttled:
+                    return j_s
+                if attempt == o["max_retries"]:
+                    break
+                delay = Nuvola.Connection.retry_after(r.headers.get("Retry-After"))
+                if delay is None:
+                    delay = o["backoff_factor"] * 2 ** attempt
+                delay = min(delay, o["max_backoff"].total_seconds())
+                self.parent.print(f":: Connection :: Throttled ({status}), retrying in {delay} seconds...")
+                await limiter.pause(delay)
+            raise self.RequestErrorException(f"Throttled ({status}) after {o['max_retries']} retries")
+
+        async def get_data(self, url, priority=None):
+            """
+            :param url: Url of the api call
+            :param priority: Priority class of the request, by default the one of the current task
+            :type url: str
+            :type priority: int
+            """
+            token = self.tokens.u_token
+            if self.tokens.is_expiring(token):
+                await self.refresh_tokens(token)
+                token = self.tokens.u_token
+            j_s = await self.send(url, token, priority)
+            with self.parent.metrics.timer("parse", self.parent.metrics.endpoint(url)):
+                j = Nuvola.Connection.decode(j_s)
+            if j is None:
+                self.parent.print(":: Connection :: Token expired, getting a new one...")
+                if token == self.tokens.u_token:
+                    await self.refresh_tokens(token)
+                return await self.get_data(url, priority)
+            return j
+
+        def download(self, file, path):
+            """
+            Blocking, see Nuvola.Connection.download. Called in the executor by AsyncNuvola.download_attachment
+            """
+            return self.tokens.download(file, path)
+
+        async def iter_file(self, file, offset=0, chunk_size=None):
+            """
+            Streams an attachment, see Nuvola.Connection.iter_file. Every chunk is read in the executor
+
+            :type file: Nuvola.File
+            :type offset: int
+            :type chunk_size: int
+            :rtype: typing.AsyncIterator[bytes]
+            """
+            loop = self.parent.get_loop()
+            chunks = self.tokens.iter_file(file, offset, chunk_size)
+            try:
+                while True:
+                    chunk = await loop.run_in_executor(None, next, chunks, None)
+                    if chunk is None:
+                        return
+                    yield chunk
+            finally:
+                await loop.run_in_executor(None, chunks.close)
+
+        async def makefile(self, file):
+            """
+            Opens an attachment, see Nuvola.Connection.makefile
+
+            :type file: Nuvola.File
+            :rtype: typing.BinaryIO
+            """
+            if self.parent.attachment_cache is not None:
+                return open(await self.parent.download_attachment(file), "rb")
+            return await self.parent.get_loop().run_in_executor(None, self.tokens.makefile, file)
+
+        async def close(self):
+            if self.tokens is not None:
+                self.tokens.close()
+            if self.own_client and self.client is not None:
+                await self.client.aclose()
+
+    class Collection(Nuvola.Collection):
+        """
+        Refresh logic of the async collections, mixed in before the sync collection
+        """
+        @abstractmethod
+        async def load(self):
+            """
+            (Re)loads the collection from the api
+            """
+
+        async def check_and_update(self, force=False):
+            if force or self.is_expired():
+                self.parent.print(f":: Fetch :: {self.NAME}...")
+                with self.parent.metrics.timer("load", self.NAME):
+                    await self.load()
+
+        def update_if_expired(self):
+            pass
+
+    class WindowScan(Nuvola.WindowScan):
+        async def fetch(self, window):
+            return await self.parent.get(self.call.format(window[0].strftime("%d-%m-%Y"),
+                                                          window[1].strftime("%d-%m-%Y")))
+
+        async def run(self):
+            """
+            Fetches the windows, with at most `workers` requests in flight, and yields them in date order
+
+            :rtype: collections.AsyncIterable[((datetime.date, datetime.date), list)]
+            """
+            self.empty_count = 0
+            windows = self.windows()
+            pending = deque()
+            try:
+                while True:
+                    while len(pending) < max(self.workers, 1):
+                        w = next(windows)
+                        self.requests += 1
+                        pending.append((w, asyncio.ensure_future(self.fetch(w))))
+                    w, f = pending.popleft()
+                    c = await f
+                    yield w, c
+                    if self.stop(c):
+                        return
+            finally:
+                for _, f in pending:
+                    f.cancel()
+
+    class SubjectLoader(Nuvola.SubjectLoader):
+        async def map(self, f, it):
+            return await AsyncNuvola.map_concurrently(f, it, self.workers)
+
+        async def load(self, time_windows):
+            """
+            :param time_windows: Time windows to be (re)loaded
+            :type time_windows: list[AsyncNuvola.TimeWindow]
+            """
+            responses = await self.map(lambda tw: self.parent.get(tw.SUBJECTS_CALL.format(tw.id_)), time_windows)
+            subjects = [self.subjects(tw, s) for tw, s in zip(time_windows, responses)]
+            flat = [i for s in subjects for i in s]
+            responses = await self.map(lambda s_: self.parent.get(s_.MARKS_CALL.format(s_.parent.id_, s_.id_)), flat)
+            for s, m in zip(flat, responses):
+                s.load(m[0]["voti"])
+            now = datetime.datetime.now()
+            for tw, s in zip(time_windows, subjects):
+                tw.set_subjects(s)
+                tw.mod_time = now
+                tw.save()
+
+    class AdaptiveWindowScan(WindowScan, Nuvola.AdaptiveWindowScan):
+        pass
+
+    class Homeworks(Collection, Nuvola.Homeworks):
+        async def load(self):
+            scan = self.new_scan()
+            async for w, c in scan.run():
+                self.add(c, w)
+            self.end_load(scan)
+
+    class Events(Collection, Nuvola.Events):
+        async def load(self):
+            self.set(await self.parent.get(self.CALL))
+
+    class Topics(Collection, Nuvola.Topics):
+        async def load(self):
+            scan = self.new_scan()
+            async for w, c in scan.run():
+                self.add(c, w)
+            self.end_load(scan)
+
+    class TimeWindow(Collection, Nuvola.TimeWindow):
+        async def load(self):
+            await AsyncNuvola.SubjectLoader(
+                self.parent, self.options.get("timeWindows")["subject_workers"]).load([self])
+
+    class Irregularities(Collection, Nuvola.Irregularities):
+        """
+        Details are never fetched on access: they are available once fetch_details() has been awaited, or with
+        prefetch_details set, and are None otherwise.
+        """
+        async def load(self):
+            self.set(await self.parent.get(self.CALL))
+            if self.options.get("irregularities")["prefetch_details"]:
+                await self.fetch_details()
+
+        async def fetch_detail(self, id_):
+            d = (await self.parent.get_custom(self.DETAILS_CALL.format(id_)))["dettaglio"]
+            self.details[id_] = d
+            return d
+
+        async def fetch_details(self, irregularities=None):
+            missing = {i.id for i in (self.data if irregularities is None else irregularities)
+                       if i.id not in self.details}
+            await AsyncNuvola.map_concurrently(self.fetch_detail, missing,
+                                               self.options.get("irregularities")["detail_workers"])
+            if missing:
+                self.save()
+
+        def get_details(self, id_):
+            return self.details.get(id_)
@@ -1,11 +1,45 @@
+import base64
 import datetime
+import hashlib
 import json
+import math
+import mmap
+import os
+import re
 import requests
+import shutil
+import sqlite3
+import struct
+import sys
+import threading
+import time
+import unicodedata
+import zlib
+from abc import ABC, abstractmethod
+from array import array
+from contextlib import contextmanager
 from copy import deepcopy
+from email.utils import parsedate_to_datetime
+from heapq import heappush, heappop, heapify, merge, nlargest
+from itertools import count
+from tempfile import mkstemp, SpooledTemporaryFile
+from bisect import bisect_left, bisect_right
+from collections import deque, Counter
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from getpass import getpass
+from http.cookiejar import DefaultCookiePolicy
 from .version import VERSION
 from os import access as os_access, W_OK
 from os.path import isdir
+from urllib.parse import urlparse
+
+try:
+    import numpy
+except ImportError:
+    # grade analytics fall back to the array module
+    numpy = None
 
 
 class NuvolaOptions:
@@ -18,44 +52,140 @@ class NuvolaOptions:
         "use_token_files": bool,
         "token_files_path": str,
         "student_id": int,
+        "lazy": bool,
+        "keep_raw": bool,
+        "lazy_records": bool,
+        "store_path": (str, type(None)),
+        "base_url": str,
+        "connection": {
+            "pool_size": int,
+            "keep_alive": bool,
+            "max_retries": int,
+            "backoff_factor": float,
+            "token_refresh_margin": datetime.timedelta
+        },
         "homeworks": {
             "max_empty_days": int,
-            "backwards_refresh_date": datetime.timedelta
+            "backwards_refresh_date": datetime.timedelta,
+            "scan_workers": int,
+            "adaptive_scan": bool
         },
         "timeWindows": {
-            "backwards_refresh_date": datetime.timedelta
+            "backwards_refresh_date": datetime.timedelta,
+            "subject_workers": int
         },
         "events": {
             "backwards_refresh_date": datetime.timedelta
         },
         "topics": {
             "max_empty_days": int,
-            "backwards_refresh_date": datetime.timedelta
+            "backwards_refresh_date": datetime.timedelta,
+            "scan_workers": int,
+            "adaptive_scan": bool
+        },
+        "irregularities": {
+            "prefetch_details": bool,
+            "detail_workers": int
+        },
+        "background_refresh": {
+            "enabled": bool,
+            "max_staleness": datetime.timedelta,
+            "workers": int
+        },
+        "rate_limit": {
+            "rate": float,
+            "burst": int,
+            "max_concurrency": int,
+            "max_retries": int,
+            "backoff_factor": float,
+            "max_backoff": datetime.timedelta
+        },
+        "attachments": {
+            "cache_path": (str, type(None)),
+            "chunk_size": int,
+            "workers": int
+        }
+    }
+
+    DEFAULTS = {
+        "credentials": None,
+        "verbose": False,
+        "force_import": False,
+        "refresh_interval": datetime.timedelta(hours=6),
+        "start_date": datetime.date(year=2020, month=9, day=1),
+        "use_token_files": True,
+        "token_files_path": "",
+        "student_id": None,
+        "lazy": False,
+        "keep_raw": True,
+        # fields which aren't indexed are parsed when they are first read
+        "lazy_records": False,
+        "store_path": None,
+        # scheme and host of the api, e.g. of a local server for the benchmarks
+        "base_url": "https://nuvola.madisoft.it",
+        "connection": {
+            "pool_size": 10,
+            "keep_alive": True,
+            "max_retries": 3,
+            "backoff_factor": 0.5,
+            "token_refresh_margin": datetime.timedelta(minutes=5)
+        },
+        "homeworks": {
+            "max_empty_days": 15 * 4,
+            "backwards_refresh_date": datetime.timedelta(hours=24),
+            "scan_workers": 1,
+            "adaptive_scan": False
+        },
+        "timeWindows": {
+            "subject_workers": 1
+        },
+        "topics": {
+            "max_empty_days": 15 * 4,
+            "backwards_refresh_date": datetime.timedelta(days=7),
+            "scan_workers": 1,
+            "adaptive_scan": False
+        },
+        "irregularities": {
+            "prefetch_details": False,
+            "detail_workers": 4
+        },
+        "background_refresh": {
+            "enabled": False,
+            "max_staleness": datetime.timedelta(hours=24),
+            "workers": 1
+        },
+        # rate 0 and max_concurrency 0 mean no limit
+        "rate_limit": {
+            "rate": 0.0,
+            "burst": 10,
+            "max_concurrency": 0,
+            "max_retries": 3,
+            "backoff_factor": 1.0,
+            "max_backoff": datetime.timedelta(minutes=1)
+        },
+        # downloaded attachments are kept in cache_path, when it's set
+        "attachments": {
+            "cache_path": None,
+            "chunk_size": 64 * 1024,
+            "workers": 4
         }
     }
 
     def __init__(self, data=None):
+        """
+        :param data: Options, the keys which are missing are taken from DEFAULTS
+        :type data: dict
+        """
+        self.data = deepcopy(self.DEFAULTS)
         if data:
+            # the keys added after data was saved get their default value
+            for k, v in self.data.items():
+                if k not in data:
+                    data[k] = v
+                elif type(v) is dict and type(data[k]) is dict:
+                    for i in v:
+                        data[k].setdefault(i, v[i])
             self.data = data
-        else:
-            self.data = {
-                "credentials": None,
-                "verbose": False,
-                "force_import": False,
-                "refresh_interval": datetime.timedelta(hours=6),
-                "start_date": datetime.date(year=2020, month=9, day=1),
-                "use_token_files": True,
-                "token_files_path": "",
-                "student_id": None,
-                "homeworks": {
-                    "max_empty_days": 15 * 4,
-                    "backwards_refresh_date": datetime.timedelta(hours=24)
-                },
-                "topics": {
-                    "max_empty_days": 15 * 4,
-                    "backwards_refresh_date": datetime.timedelta(days=7)
-                }
-            }
 
     def set(self, key, value):
         if key == "token_files_path":
@@ -66,18 +196,31 @@ class NuvolaOptions:
             if value and value[-1] != "/":
                 value += "/"
 
-        if type(value) is self.DATA_TYPES[key]:
+        if self.__matches(value, self.DATA_TYPES[key]):
             self.data[key] = value
         elif type(value) is dict:
             for i in value:
-                if type(value[i]) is self.DATA_TYPES[key][i]:
-                    self.data[key] = value
-                else:
+                if not self.__matches(value[i], self.DATA_TYPES[key][i]):
                     raise TypeError(f"Invalid type: \"{type(value[i]).__name__}\" provided, "
-                                    f"\"{self.DATA_TYPES[key][i].__name__}\" required")
+                                    f"\"{self.__name(self.DATA_TYPES[key][i])}\" required")
+            # merge into the existing group so that setting one key doesn't drop the others
+            self.data.setdefault(key, {}).update(value)
         else:
             raise TypeError(f"Invalid type: \"{type(value).__name__}\" provided, "
-                            f"\"{self.DATA_TYPES[key].__name__}\" required")
+                            f"\"{self.__name(self.DATA_TYPES[key])}\" required")
+
+    @staticmethod
+    def __matches(value, required):
+        # a tuple allows any of its types, e.g. None for the paths which are optional
+        if type(required) is tuple:
+            return type(value) in required
+        return type(value) is required
+
+    @staticmethod
+    def __name(required):
+        if type(required) is tuple:
+            return " or ".join(i.__name__ for i in required)
+        return required.__name__
 
     def get(self, key):
         try:
@@ -92,13 +235,53 @@ class NuvolaOptions:
         pass
 
 
+class LazyField:
+    """
+    Field of a record parsed from its api payload when it's first read, with the lazy_records option. The parsed
+    value is kept in the slot "_" + name of the record, which eager records set in __init__.
+    """
+    def __init__(self, decode, source="raw"):
+        """
+        :param decode: Function parsing the field from the payload
+        :param source: Property of the record returning the payload
+        :type source: str
+        """
+        self.decode = decode
+        self.source = source
+        self.member = None
+
+    def __set_name__(self, owner, name):
+        self.member = owner.__dict__["_" + name]
+
+    def __get__(self, obj, owner=None):
+        if obj is None:
+            return self
+        try:
+            return self.member.__get__(obj, owner)
+        except AttributeError:
+            v = self.decode(getattr(obj, self.source))
+            self.member.__set__(obj, v)
+            return v
+
+    def __set__(self, obj, value):
+        self.member.__set__(obj, value)
+
+
 class Nuvola:
-    def __init__(self, options=NuvolaOptions(), old_data=None):
+    URL = "https://nuvola.madisoft.it"
+    STUDENTS_CALL = "/api-studente/v1/alunni"
+    # record types of the timeline, in the order they take on the same day
+    TIMELINE_TYPES = ("event", "homework", "topic", "mark")
+    EXPORT_KEYS = ("homeworks", "events", "timeWindows", "version", "topics", "irregularities", "textIndex")
+
+    def __init__(self, options=NuvolaOptions(), old_data=None, session=None):
         """
         :param options: User defined options
-        :param old_data: Data previously exported
+        :param old_data: Data previously exported, by dump_to_dict or by dump_to_snapshot
+        :param session: Session shared with other Nuvola objects, see Connection.make_session
         :type options: NuvolaOptions
-        :type old_data: dict
+        :type old_data: dict | Nuvola.Snapshot
+        :type session: requests.Session
         """
 
         def __init(self_, obj=None):
@@ -109,38 +292,57 @@ class Nuvola:
                     "topics": None,
                     "timeWindows": None
                 }
+            if self_.db is not None:
+                obj = self_.db.complete_import(obj)
+            if obj.get("textIndex") is not None:
+                self_.text_index = self_.TextIndex(obj["textIndex"])
 
-            if options.get("student_id") is None:
-                self_.print(":: Init :: Retriving Student Id")
-                self_.id_student = self.__get_student_id()
-            self_.print(":: Init :: Homeworks...", end="")
-            timer_ = datetime.datetime.now()
-            self_.homeworks = self_.Homeworks(self_, self_.options, obj["homeworks"])
-            self_.print(" OK ({} seconds)".format((datetime.datetime.now() - timer_).total_seconds()))
-            self_.print(":: Init :: Events...", end="")
-            timer_ = datetime.datetime.now()
-            self_.events = self_.Events(self_, self_.options, obj["events"])
-            self_.print(" OK ({} seconds)".format((datetime.datetime.now() - timer_).total_seconds()))
-            self_.print(":: Init :: Topics...", end="")
-            timer_ = datetime.datetime.now()
-            self_.topics = self_.Topics(self_, self_.options, obj["topics"])
-            self_.print(" OK ({} seconds)".format((datetime.datetime.now() - timer_).total_seconds()))
-            self_.print(":: Init :: TimeWindows...", end="")
-            timer_ = datetime.datetime.now()
-            self_.time_windows = self_.__load_time_windows(obj["timeWindows"])
-            self_.print(" OK ({} seconds)".format((datetime.datetime.now() - timer_).total_seconds()))
-            self_.active_time_window = self_.__select_best_time_window()
+            # attribute: (name printed while loading, loader)
+            loaders = {
+                "id_student": ("Student Id", self_.__load_student_id),
+                "homeworks": ("Homeworks", lambda: self_.Homeworks(self_, self_.options, obj["homeworks"])),
+                "events": ("Events", lambda: self_.Events(self_, self_.options, obj["events"])),
+                "topics": ("Topics", lambda: self_.Topics(self_, self_.options, obj["topics"])),
+                "time_windows": ("TimeWindows", lambda: self_.__load_time_windows(obj["timeWindows"])),
+                # exports of older versions have no irregularities
+                "irregularities": ("Irregularities", lambda: self_.Irregularities(
+                    self_, self_.options, obj.get("irregularities"))),
+                "active_time_window": (None, self_.select_best_time_window)
+            }
+            if self_.options.get("lazy"):
+                # every attribute is loaded by __getattr__ when it's first accessed
+                self_.lazy_loaders = loaders
+                self_.lazy_locks = {i: threading.Lock() for i in loaders}
+            else:
+                for i in loaders:
+                    self_.__init_attribute(i, *loaders[i])
 
         self.options = options
-        timer = datetime.datetime.now()
+        self.URL = self.options.get("base_url")
+        self.metrics = self.Metrics()
+        # built by get_grades, dropped when the marks change
+        self.grade_table = None
+        # built by the first search, then kept up to date by the refreshes
+        self.text_index = self.TextIndex()
+        # collections saved by a previous run are read from the store instead of being fetched again
+        self.db = None if self.options.get("store_path") is None else self.Database(self.options.get("store_path"))
+        # refreshes running in background, by collection
+        self.background, self.refreshing, self.background_lock = None, {}, threading.Lock()
+        c = self.options.get("attachments")["cache_path"]
+        self.attachment_cache = None if c is None else self.AttachmentCache(c)
         self.print(":: Init :: Connection...", end="")
-        self.conn = self.Connection(self, self.options)
-        self.print(" OK ({} seconds)".format((datetime.datetime.now() - timer).total_seconds()))
-        self.homeworks, self.events, self.topics, self.time_windows, self.active_time_window, self.id_student = (
-            None, None, None, None, None, None)
+        with self.metrics.timer("init", "Connection") as t:
+            self.conn = self.Connection(self, self.options, session)
+        self.print(" OK ({} seconds)".format(t.seconds))
+        if not self.options.get("lazy"):
+            self.homeworks, self.events, self.topics, self.time_windows, self.active_time_window, self.id_student = (
+                None, None, None, None, None, None)
+            self.irregularities = None
 
+        if isinstance(old_data, self.Snapshot):
+            old_data = old_data.blocks()
         if type(old_data) is dict:
-            if all([i in ("homeworks", "events", "timeWindows", "version", "topics") for i in old_data.keys()]):
+            if all([i in self.EXPORT_KEYS for i in old_data.keys()]):
                 if self.options.get("force_import") or old_data["version"] == VERSION or input(
                         "Trying to import data from another version of nuvola, continue? (y,N) ") == "y":
                     __init(self, old_data)
@@ -149,6 +351,35 @@ class Nuvola:
                 self.print(":: Import :: Import object format is not accepted, skipping import")
         __init(self)
 
+    def __init_attribute(self, name, label, loader):
+        if label is not None:
+            self.print(f":: Init :: {label}...", end="")
+        with self.metrics.timer("init", name) as t:
+            setattr(self, name, loader())
+        if label is not None:
+            self.print(" OK ({} seconds)".format(t.seconds))
+
+    def __getattr__(self, name):
+        # only called when the attribute doesn't exist: in lazy mode, for the collections not loaded yet
+        loaders = self.__dict__.get("lazy_loaders")
+        if loaders is None or name not in loaders:
+            raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+        with self.lazy_locks[name]:
+            if name not in self.__dict__:
+                self.__init_attribute(name, *loaders[name])
+        return self.__dict__[name]
+
+    def prefetch(self, collections=None):
+        """
+        In lazy mode, loads concurrently the collections which haven't been accessed yet
+
+        :param collections: Attributes to be loaded, e.g. ["homeworks", "time_windows"], default: all
+        :type collections: list
+        """
+        loaders = self.__dict__.get("lazy_loaders", {})
+        names = [i for i in (loaders if collections is None else collections) if i not in self.__dict__]
+        Nuvola.map_concurrently(lambda i: getattr(self, i), names, len(names))
+
     def print(self, data, end="\n"):
         """
         Prints data only when verbose is active
@@ -159,27 +390,31 @@ class Nuvola:
         if self.options.get("verbose"):
             print(data, end=end)
 
-    def get(self, call):
+    def get(self, call, priority=None):
         """
         Formats api request and sends it to /api-studente/v1/alunno/[call]
 
         :param call: API call
+        :param priority: Priority class of the request, see Connection.INTERACTIVE
         :type call: str
+        :type priority: int
         :return: dict
         """
-        url = "https://nuvola.madisoft.it/api-studente/v1/alunno/{}/{}".format(self.id_student, call)
-        d = self.conn.get_data(url)
+        url = "{}/api-studente/v1/alunno/{}/{}".format(self.URL, self.id_student, call)
+        d = self.conn.get_data(url, priority)
         return d["valori"]
 
-    def get_custom(self, custom_url):
+    def get_custom(self, custom_url, priority=None):
         """
         Send raw call to connection.get_data without formatting to nuvola.madisoft.it/[custom_url].
 
         :param custom_url: URL
+        :param priority: Priority class of the request, see Connection.INTERACTIVE
         :type custom_url: str
+        :type priority: int
         :return: dict
         """
-        d = self.conn.get_data(f"https://nuvola.madisoft.it/{custom_url}")
+        d = self.conn.get_data(f"{self.URL}/{custom_url}", priority)
         return d
 
     def __load_time_windows(self, old_data=None):
@@ -190,16 +425,23 @@ class Nuvola:
         """
         if type(old_data) is list:
             return [self.TimeWindow(self, i["raw"], self.options, i) for i in old_data]
-        return [self.TimeWindow(self, i, self.options) for i in self.get("frazioni-temporali")]
+        if isinstance(old_data, self.Snapshot.Block):
+            return old_data.time_windows(self)
+        time_windows = [self.TimeWindow(self, i, self.options, fetch=False) for i in self.get("frazioni-temporali")]
+        self.SubjectLoader(self, self.options.get("timeWindows")["subject_workers"]).load(time_windows)
+        return time_windows
+
+    def __load_student_id(self):
+        if self.options.get("student_id") is not None:
+            return self.options.get("student_id")
+        return self.pick_student_id(self.get_custom(self.STUDENTS_CALL)["valori"])
 
-    def __load_irregularities(self):
+    def pick_student_id(self, d):
         """
-        :rtype: list
+        :param d: Students associated with the account
+        :type d: list
+        :rtype: int
         """
-        return [self.Irregularity(i, self) for i in self.get("assenze")]
-
-    def __get_student_id(self):
-        d = self.get_custom("/api-studente/v1/alunni")["valori"]
         if len(d) > 1:
             if self.options.get("student_id") is None:
                 raise self.AmbiguousIDException(f"There are more than one student associated with this account, please "
@@ -223,44 +465,583 @@ class Nuvola:
         for i in self.time_windows:
             yield i
 
-    def check_and_update_all(self, force=False):
-        h = [self.homeworks, self.events, self.topics, self.events]
+    def get_timeline(self, start, end, types=None, cursor=None, time_window=None):
+        """
+        Events, homeworks (by assignment date), topics and marks between start and end, merged in date order. The
+        collections are checked for a refresh once, when the first entry is asked, and read lazily: each one is a
+        date-sorted stream of its index, merged through a heap.
+
+        :param start: First day
+        :param end: Last day
+        :param types: Record types to be read, as in TIMELINE_TYPES, default: all
+        :param cursor: Cursor returned by get_timeline_page, to resume after the entries already read
+        :param time_window: Time window of the marks, default: the active one
+        :type start: datetime.date
+        :type end: datetime.date
+        :type types: list[str]
+        :type cursor: str
+        :type time_window: Nuvola.TimeWindow
+        :return: (date, type, record) tuples; events which started before start are dated start
+        :rtype: collections.Iterable[(datetime.date, str, object)]
+        """
+        if type(start) is not datetime.date or type(end) is not datetime.date:
+            raise TypeError((start, end))
+        types = self.TIMELINE_TYPES if types is None else types
+        for i in types:
+            if i not in self.TIMELINE_TYPES:
+                raise ValueError(f"Unknown timeline type: {i}")
+        after, skip = (None, 0) if cursor is None else self.__parse_cursor(cursor)
+        # nothing before the cursor is read again
+        lo = start if after is None else max(start, after[0])
+        if time_window is None:
+            time_window = self.active_time_window
+        collections = {"event": self.events, "homework": self.homeworks, "topic": self.topics,
+                       "mark": time_window}
+        for i in types:
+            collections[i].update_if_expired()
+
+        streams = []
+        if "event" in types:
+            events = sorted(((max(e.date_start.date(), start), e) for e in self.events.intervals.overlap(lo, end)),
+                            key=lambda i: i[0])
+            streams.append((d, 0, e) for d, e in events)
+        if "homework" in types:
+            streams.append((h.date_assigned, 1, h) for h in self.homeworks.index.range("assigned", lo, end))
+        if "topic" in types:
+            streams.append((t.date, 2, t) for t in self.topics.index.range("date", lo, end))
+        if "mark" in types:
+            streams += [((m.date, 3, m) for m in s.index.range("date", lo, end)) for s in time_window.subjects]
+
+        for d, rank, r in merge(*streams, key=lambda i: (i[0], i[1])):
+            if after is not None:
+                if (d, rank) < after:
+                    continue
+                if (d, rank) == after and skip:
+                    skip -= 1
+                    continue
+                after = None
+            yield d, self.TIMELINE_TYPES[rank], r
+
+    def get_timeline_page(self, start, end, limit, cursor=None, types=None, time_window=None):
+        """
+        Page of get_timeline
+
+        :param limit: Maximum number of entries
+        :param cursor: Cursor of the previous page, None for the first one
+        :type limit: int
+        :return: Entries, and the cursor of the next page, None after the last one
+        :rtype: (list, str)
+        """
+        entries = []
+        last, seen = (None, 0) if cursor is None else self.__parse_cursor(cursor)
+        for d, t, r in self.get_timeline(start, end, types, cursor, time_window):
+            if len(entries) == limit:
+                return entries, f"{last[0].toordinal()}:{last[1]}:{seen}"
+            key = (d, self.TIMELINE_TYPES.index(t))
+            # entries of the same day and type already read, also in the previous pages
+            seen = seen + 1 if key == last else 1
+            last = key
+            entries.append((d, t, r))
+        return entries, None
+
+    @staticmethod
+    def __parse_cursor(cursor):
+        """
+        :return: Day and type rank of the last entry read, and number of entries read with them
+        :rtype: ((datetime.date, int), int)
+        """
+        try:
+            ordinal, rank, seen = (int(i) for i in cursor.split(":"))
+            return (datetime.date.fromordinal(ordinal), rank), seen
+        except (AttributeError, ValueError):
+            raise ValueError(f"Invalid timeline cursor: {cursor}") from None
+
+    def search(self, query, limit=10, types=None, start=None, end=None):
+        """
+        Ranked full-text search of homework descriptions, topic names and descriptions, event names, descriptions
+        and notes. Accents and case are ignored, records matching more of the words rank higher.
+
+        :param query: Words to be searched
+        :param limit: Maximum number of results
+        :param types: Record types to be searched, as in TextIndex.TYPES, default: all
+        :param start: First day of the records, homeworks by assignment date, default: no limit
+        :param end: Last day of the records, default: no limit
+        :type query: str
+        :type limit: int
+        :type types: list[str]
+        :type start: datetime.date
+        :type end: datetime.date
+        :return: (score, type, record) tuples, best first
+        :rtype: list
+        """
+        types = self.TextIndex.TYPES if types is None else types
+        collections = {"homework": self.homeworks, "topic": self.topics, "event": self.events}
+        for i in types:
+            if i not in collections:
+                raise ValueError(f"Unknown search type: {i}")
+            collections[i].update_if_expired()
+            self.text_index.sync(i, collections[i])
+        return self.text_index.search(query, limit, types, start, end)
+
+    def get_grades(self):
+        """
+        Columnar table of the marks of every time window, rebuilt after the marks change
+
+        :rtype: Nuvola.Grades
+        """
         for i in self.time_windows:
-            h.append(i)
-        for i in h:
-            i.check_and_update(force)
+            i.update_if_expired()
+        grades = self.grade_table
+        if grades is None:
+            grades = self.grade_table = self.Grades(self.time_windows)
+        return grades
+
+    def close(self):
+        """
+        Releases the pooled connections and the store
+        """
+        # the refreshes still running need the connection
+        if self.background is not None:
+            self.background.shutdown(wait=True)
+        self.conn.close()
+        if self.db is not None:
+            self.db.close()
+
+    @staticmethod
+    def map_concurrently(f, it, workers=1):
+        """
+        Applies f to every item with at most `workers` calls running at the same time, keeping the order
+
+        :type workers: int
+        :rtype: list
+        """
+        it = list(it)
+        if workers <= 1 or len(it) <= 1:
+            return [f(i) for i in it]
+        with ThreadPoolExecutor(min(workers, len(it))) as executor:
+            return list(executor.map(f, it))
+
+    def download_attachment(self, file, path=None):
+        """
+        Downloads an attachment, resuming a partial download. With an attachment cache the file is read from the
+        cache, or downloaded into it
+
+        :param file: Attachment of a Homework, Event or Topic
+        :param path: Destination, needed when there is no cache
+        :type file: Nuvola.File
+        :type path: str
+        :return: Path of the downloaded file, the one in the cache when path is None
+        :rtype: str
+        """
+        if self.attachment_cache is None:
+            if path is None:
+                raise TypeError("A path is needed when there is no attachment cache")
+            return self.conn.download(file, path)
+        cache = self.attachment_cache
+        with cache.lock(file):
+            cached = cache.get(file)
+            self.metrics.cache_access("attachments", cached is not None)
+            if cached is None:
+                cached = cache.put(file, self.conn.download(file, cache.partial_path(file)))
+        if path is None:
+            return cached
+        shutil.copyfile(cached, path)
+        return path
+
+    def download_attachments(self, files=None, directory=None, workers=None):
+        """
+        Downloads many attachments concurrently, only streaming each file to disk
+
+        :param files: Attachments to be downloaded, default: the ones of every homework, event and topic
+        :param directory: Directory where the files are saved as "[id] [name]", default: only the cache
+        :param workers: Downloads running at the same time, default: the "workers" of the attachments options
+        :type files: list[Nuvola.File]
+        :type directory: str
+        :type workers: int
+        :return: Paths of the downloaded files, in the order of files
+        :rtype: list[str]
+        """
+        if files is None:
+            files = [f for c in (self.homeworks, self.events, self.topics) for r in c.get_all() for f in r.attachments]
+        if workers is None:
+            workers = self.options.get("attachments")["workers"]
+
+        def download(f):
+            if directory is None:
+                return self.download_attachment(f)
+            # the id keeps apart the attachments with the same name
+            return self.download_attachment(f, os.path.join(directory, f"{f.id_} {os.path.basename(f.name)}"))
+
+        return self.map_concurrently(download, files, workers)
+
+    def refresh_in_background(self, collection):
+        """
+        Refreshes an expired collection on a worker thread, unless it's already being refreshed
+
+        :type collection: Nuvola.Collection
+        :return: Future of the refresh
+        :rtype: concurrent.futures.Future
+        """
+        with self.background_lock:
+            f = self.refreshing.get(collection)
+            if f is None or f.done():
+                if self.background is None:
+                    self.background = ThreadPoolExecutor(self.options.get("background_refresh")["workers"],
+                                                         thread_name_prefix="nuvola-refresh")
+                f = self.refreshing[collection] = self.background.submit(self.__refresh_in_background, collection)
+            return f
+
+    def __refresh_in_background(self, collection):
+        # requests of background refreshes wait for the interactive ones
+        self.conn.set_priority(self.conn.BACKGROUND)
+        collection.check_and_update()
+
+    def check_and_update_all(self, force=False, before=None):
+        """
+        Refreshes the expired collections
+
+        :param force: Refreshes every collection
+        :param before: Also refreshes the collections loaded before this time, even if they haven't expired yet
+        :type force: bool
+        :type before: datetime.datetime
+        """
+        for i in (self.homeworks, self.events, self.topics, self.irregularities):
+            i.check_and_update(force or before is not None and i.mod_time < before)
+        # expired time windows are refreshed together, so that all their subjects are fetched concurrently
+        expired = [i for i in self.time_windows
+                   if force or before is not None and i.mod_time < before or i.is_expired()]
+        if expired:
+            self.print(":: Fetch :: TimeWindows...", end="")
+            with self.metrics.timer("load", "TimeWindow"):
+                self.SubjectLoader(self, self.options.get("timeWindows")["subject_workers"]).load(expired)
+            self.print(" OK")
+
+    class Metrics:
+        """
+        Counters and timings of a Nuvola object: requests by endpoint (count, errors, retries, bytes and a latency
+        histogram), token refreshes, cache hits and misses, and the durations of the init, load and parse phases
+        of each collection. Hooks receive every event as it happens, snapshot() returns the totals.
+        """
+        # upper bounds of the latency buckets, in seconds
+        BUCKETS = (0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float("inf"))
+        # path segments which change between calls of the same endpoint: ids and dates
+        VARIABLE = re.compile(r"(?<=/)(\d+|\d{2}-\d{2}-\d{4})(?=/|$)")
+
+        def __init__(self):
+            self.lock = threading.Lock()
+            self.hooks = []
+            self.requests = {}
+            self.token_refreshes = 0
+            self.cache = {}
+            self.durations = {}
+
+        def add_hook(self, hook):
+            """
+            :param hook: Function called with every event, a dict with its "type" ("request", "retry",
+                "token_refresh", "cache", "init", "load" or "parse") and its values
+            """
+            self.hooks.append(hook)
+
+        def remove_hook(self, hook):
+            self.hooks.remove(hook)
+
+        def emit(self, event):
+            for i in self.hooks:
+                i(event)
+
+        @classmethod
+        def endpoint(cls, url):
+            """
+            :return: Url without host, api prefix, student id, ids and dates, e.g. "compito/elenco/{}/{}"
+            :rtype: str
+            """
+            path = cls.VARIABLE.sub("{}", re.sub("/+", "/", urlparse(url).path))
+            for i in ("/api-studente/v1/alunno/{}/", "/api-studente/v1/"):
+                if path.startswith(i):
+                    return path[len(i):]
+            return path
+
+        def request(self, url, status, seconds, size, retry=False):
+            """
+            :param url: Url of the request
+            :param status: Http status of the response
+            :param seconds: Latency of the request
+            :param size: Bytes of the response body
+            :param retry: Whether the response is going to be retried
+            """
+            endpoint = self.endpoint(url)
+            with self.lock:
+                e = self.requests.get(endpoint)
+                if e is None:
+                    e = self.requests[endpoint] = {"count": 0, "errors": 0, "retries": 0, "bytes": 0, "seconds": 0,
+                                                   "latency": [0] * len(self.BUCKETS)}
+                e["count"] += 1
+                e["errors"] += status >= 400
+                e["retries"] += retry
+                e["bytes"] += size
+                e["seconds"] += seconds
+                e["latency"][bisect_left(self.BUCKETS, seconds)] += 1
+            self.emit({"type": "retry" if retry else "request", "endpoint": endpoint, "status": status,
+                       "seconds": seconds, "bytes": size})
+
+        def token_refresh(self, seconds):
+            with self.lock:
+                self.token_refreshes += 1
+            self.emit({"type": "token_refresh", "seconds": seconds})
+
+        def cache_access(self, name, hit):
+            with self.lock:
+                c = self.cache.setdefault(name, {"hits": 0, "misses": 0})
+                c["hits" if hit else "misses"] += 1
+            self.emit({"type": "cache", "name": name, "hit": hit})
+
+        def duration(self, phase, name, seconds):
+            with self.lock:
+                d = self.durations.setdefault(phase, {}).setdefault(name, {"count": 0, "seconds": 0, "last": 0})
+                d["count"] += 1
+                d["seconds"] += seconds
+                d["last"] = seconds
+            self.emit({"type": phase, "name": name, "seconds": seconds})
+
+        def timer(self, phase, name):
+            """
+            Context manager measuring a phase ("init", "load" or "parse") of a collection
+
+            :rtype: Nuvola.Metrics.Timer
+            """
+            return self.Timer(self, phase, name)
+
+        class Timer:
+            def __init__(self, metrics, phase, name):
+                self.metrics = metrics
+                self.phase = phase
+                self.name = name
+                self.seconds = None
+
+            def __enter__(self):
+                self.start = time.perf_counter()
+                return self
+
+            def __exit__(self, *_):
+                self.seconds = time.perf_counter() - self.start
+                self.metrics.duration(self.phase, self.name, self.seconds)
+
+        def snapshot(self):
+            """
+            :return: Totals since the creation of the object, latencies as {upper bound: count}
+            :rtype: dict
+            """
+            with self.lock:
+                return {
+                    "requests": {k: dict(v, latency=dict(zip(self.BUCKETS, v["latency"])))
+                                 for k, v in self.requests.items()},
+                    "token_refreshes": self.token_refreshes,
+                    "cache": deepcopy(self.cache),
+                    "durations": deepcopy(self.durations)
+                }
 
     class Connection:
+        # priority classes of the requests, lower goes first
+        INTERACTIVE = 0
+        BACKGROUND = 1
+        # responses retried after a backoff
+        THROTTLE_STATUSES = (429, 503)
+        # "bytes start-end/total" of a 206 response, "bytes */total" of a 416 one
+        CONTENT_RANGE = re.compile(r"bytes (?:(\d+)-\d+|\*)/(\d+)")
+
         class RequestErrorException(Exception):
             pass
 
+        class InvalidRangeException(Exception):
+            """
+            The bytes already downloaded of an attachment aren't the start of the file on the server
+            """
+            pass
+
         class InvalidResponseException(Exception):
             pass
 
-        def __init__(self, parent, options):
+        class PooledAdapter(HTTPAdapter):
+            """
+            HTTPAdapter which counts the requests sent and the connections opened by its pools
+            """
+            def __init__(self, *args, **kwargs):
+                self.lock = threading.Lock()
+                self.requests = 0
+                self.connections = 0
+                self.limiters, self.limiters_lock = {}, threading.Lock()
+                super().__init__(*args, **kwargs)
+
+            def init_poolmanager(self, *args, **kwargs):
+                super().init_poolmanager(*args, **kwargs)
+                adapter = self
+                classes = {}
+                for scheme, pool_cls in self.poolmanager.pool_classes_by_scheme.items():
+                    class CountingConnection(pool_cls.ConnectionCls):
+                        def connect(self_):
+                            with adapter.lock:
+                                adapter.connections += 1
+                            return super().connect()
+
+                        def request(self_, *args_, **kwargs_):
+                            with adapter.lock:
+                                adapter.requests += 1
+                            return super().request(*args_, **kwargs_)
+
+                    classes[scheme] = type(pool_cls.__name__, (pool_cls,), {"ConnectionCls": CountingConnection})
+                # the default mapping is shared at module level by urllib3, never edit it in place
+                self.poolmanager.pool_classes_by_scheme = classes
+
+        class RateLimiter:
+            """
+            Token bucket and concurrency cap of a host. Waiting requests go by priority class, then in order of
+            arrival, and nobody starts while the host asked to back off.
+            """
+            def __init__(self, rate, burst, max_concurrency):
+                """
+                :param rate: Requests per second, 0 for no limit
+                :param burst: Requests which can be sent at once after an idle period
+                :param max_concurrency: Requests running at the same time, 0 for no limit
+                :type rate: float
+                :type burst: int
+                :type max_concurrency: int
+                """
+                self.rate = rate
+                self.burst = burst
+                self.max_concurrency = max_concurrency
+                self.tokens = burst
+                self.updated = time.monotonic()
+                self.running = 0
+                self.paused_until = 0
+                # (priority, arrival) of the waiting requests
+                self.waiting = []
+                self.arrivals = count()
+                self.condition = threading.Condition()
+
+            def __refill(self, now):
+                if self.rate > 0:
+                    self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+            def __wait_time(self, now):
+                """
+                Seconds before the first waiting request can start, None while it waits for a running request
+                """
+                if self.max_concurrency and self.running >= self.max_concurrency:
+                    return None
+                if self.paused_until > now:
+                    return self.paused_until - now
+                if self.rate > 0 and self.tokens < 1:
+                    return (1 - self.tokens) / self.rate
+                return 0
+
+            def acquire(self, priority):
+                with self.condition:
+                    me = (priority, next(self.arrivals))
+                    heappush(self.waiting, me)
+                    try:
+                        while True:
+                            now = time.monotonic()
+                            self.__refill(now)
+                            wait = self.__wait_time(now) if self.waiting[0] == me else None
+                            if wait == 0:
+                                break
+                            self.condition.wait(wait)
+                    except BaseException:
+                        self.waiting.remove(me)
+                        heapify(self.waiting)
+                        self.condition.notify_all()
+                        raise
+                    heappop(self.waiting)
+                    if self.rate > 0:
+                        self.tokens -= 1
+                    self.running += 1
+                    # the next request in line checks its own wait time
+                    self.condition.notify_all()
+
+            def release(self):
+                with self.condition:
+                    self.running -= 1
+                    self.condition.notify_all()
+
+            def pause(self, seconds):
+                """
+                Stops every request to the host for some seconds
+                """
+                with self.condition:
+                    self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+                    self.condition.notify_all()
+
+        def __init__(self, parent, options, session=None):
             """
             :param parent: Parent nuvola object
+            :param session: Session shared with other connections, by default one is created and owned by this
             :type parent: Nuvola
+            :type session: requests.Session
             """
             self.parent = parent
             self.options = options
             self.s_token = None
-            self.s_token = None
+            self.u_token = None
+            # when this connection logged in for its user token, None for tokens read from the token files
+            self.u_token_time = None
+            self.own_session = session is None
+            self.session = self.make_session(self.options.get("connection")) if session is None else session
+            self.adapter = self.session.get_adapter(parent.URL)
+            # rate limiters by host, shared by the connections using the same session when it's pooled
+            self.limiters, self.limiters_lock = {}, threading.Lock()
+            self.local = threading.local()
+            # held by the thread refreshing the tokens, see refresh_tokens_once
+            self.token_lock = threading.Lock()
             if self.options.get("use_token_files"):
-                try:
-                    with open(f"{self.options.get('token_files_path')}s.tok", "r") as f:
-                        self.s_token = f.read()
-                except FileNotFoundError:
-                    self.refresh_tokens()
-                    return
-                try:
-                    with open(f"{self.options.get('token_files_path')}u.tok", "r") as f:
-                        self.u_token = f.read()
-                except FileNotFoundError:
-                    self.refresh_tokens()
+                self.s_token, self.u_token = self.read_token_files()
+            if self.s_token is None or self.u_token is None:
+                self.refresh_tokens_once()
 
-            else:
-                self.refresh_tokens()
+        @classmethod
+        def make_session(cls, c):
+            """
+            Creates the long-lived session used for every api call, so that connections are kept alive and
+            reused from a pool instead of paying a new TCP+TLS handshake for each request.
+            Requests' sessions can be shared between threads, as long as they are only used to send requests.
+            The session keeps no cookies: it can be shared by many accounts, whose calls carry their own tokens.
+
+            :param c: Connection options, as the "connection" group of NuvolaOptions
+            :type c: dict
+            :rtype: requests.Session
+            """
+            s = requests.Session()
+            # cookies set by the login of an account would be sent with the calls of every other account
+            s.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+            retries = Retry(total=c["max_retries"], backoff_factor=c["backoff_factor"],
+                            allowed_methods=frozenset(["GET"]))
+            # one host only, but the pool must hold a connection for each thread issuing requests
+            adapter = cls.PooledAdapter(pool_connections=1, pool_maxsize=c["pool_size"], max_retries=retries,
+                                        pool_block=True)
+            s.mount("https://", adapter)
+            s.mount("http://", adapter)
+            if not c["keep_alive"]:
+                s.headers["Connection"] = "close"
+            return s
+
+        def pool_stats(self):
+            """
+            Connection pool usage: a hit is a request sent over an already open connection, a miss is a request
+            which had to open a new one.
+
+            :rtype: dict
+            """
+            with self.adapter.lock:
+                requests_, connections = self.adapter.requests, self.adapter.connections
+            return {
+                "requests": requests_,
+                "hits": max(requests_ - connections, 0),
+                "misses": connections
+            }
+
+        def close(self):
+            if self.own_session:
+                self.session.close()
 
         def refresh_tokens(self):
             from simplejson.errors import JSONDecodeError
@@ -280,11 +1061,11 @@ class Nuvola:
                 s = requests.Session()
 
                 self.parent.print(":: Scraper :: Getting login page...")
-                login_page = s.get("https://nuvola.madisoft.it")
+                login_page = s.get(self.parent.URL)
                 csrf_token = Bs(login_page.text, features="lxml").find_all("input")[0].attrs["value"]
 
                 self.parent.print(":: Scraper :: Logging in...")
-                login_response = s.post("https://nuvola.madisoft.it/login_check",
+                login_response = s.post(f"{self.parent.URL}/login_check",
                                         data={"_username": user, "_password": pwd,
                                               "_csrf_token": csrf_token})
 
@@ -296,11 +1077,11 @@ class Nuvola:
                 self.parent.print(":: Scraper :: Authentication successful.")
                 try:
                     self.parent.print(":: Scraper :: Trying to get auth_token...")
-                    r = s.get("https://nuvola.madisoft.it/api-studente/v1/login-from-web",
+                    r = s.get(f"{self.parent.URL}/api-studente/v1/login-from-web",
                               cookies={"nuvola": str(session_token)})
 
                     self.parent.print(":: Scraper :: Too early, retrying...")
-                    r = s.get("https://nuvola.madisoft.it/api-studente/v1/login-from-web",
+                    r = s.get(f"{self.parent.URL}/api-studente/v1/login-from-web",
                               cookies={"nuvola": str(session_token)})
                     return session_token, r.json()["token"]
                 except JSONDecodeError:
@@ -311,8 +1092,8 @@ class Nuvola:
                 try:
                     if verb:
                         print("\n:: Scraper :: Trying to get auth_token...")
-                    r = requests.get("https://nuvola.madisoft.it/api-studente/v1/login-from-web",
-                                     cookies={"nuvola": str(session_token)})
+                    r = self.session.get(f"{self.parent.URL}/api-studente/v1/login-from-web",
+                                         cookies={"nuvola": str(session_token)})
                     return r.json()["token"]
                 except JSONDecodeError:
                     if verb:
@@ -330,41 +1111,418 @@ class Nuvola:
                     self.s_token, self.u_token = scrape_from_credentials(
                         input("Username: "), getpass("Password: "))
             if self.options.get("use_token_files"):
-                with open(f"{self.options.get('token_files_path')}s.tok", "w") as fs, \
-                        open(f"{self.options.get('token_files_path')}u.tok", "w") as fu:
-                    fs.write(self.s_token)
-                    fu.write(self.u_token)
+                self.write_token_files()
+
+        def read_token_files(self):
+            """
+            :return: Session token and user token, None when their file is missing
+            :rtype: (str, str)
+            """
+            tokens = []
+            for i in ("s.tok", "u.tok"):
+                try:
+                    with open(f"{self.options.get('token_files_path')}{i}", "r") as f:
+                        tokens.append(f.read())
+                except FileNotFoundError:
+                    tokens.append(None)
+            return tuple(tokens)
+
+        def write_token_files(self):
+            # each file is written to a temporary one which replaces it, so readers never find half a token
+            path = self.options.get("token_files_path")
+            for name, token in (("s.tok", self.s_token), ("u.tok", self.u_token)):
+                fd, tmp = mkstemp(dir=path or ".", prefix=f".{name}.")
+                try:
+                    with os.fdopen(fd, "w") as f:
+                        f.write(token)
+                    os.replace(tmp, f"{path}{name}")
+                except BaseException:
+                    os.unlink(tmp)
+                    raise
+
+        @contextmanager
+        def token_files_lock(self):
+            """
+            Lock of the token files shared with the other processes, where fcntl is available
+            """
+            if not self.options.get("use_token_files"):
+                yield
+                return
+            try:
+                import fcntl
+            except ImportError:
+                yield
+                return
+            with open(f"{self.options.get('token_files_path')}tok.lock", "a") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+        @staticmethod
+        def token_expiry(token):
+            """
+            :return: Expiration time of a jwt user token, None when it's unknown
+            :rtype: datetime.datetime
+            """
+            try:
+                payload = token.split(".")[1]
+                return datetime.datetime.fromtimestamp(
+                    json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))["exp"])
+            except (AttributeError, IndexError, KeyError, TypeError, ValueError):
+                return None
+
+        def is_expiring(self, token):
+            expiry = self.token_expiry(token)
+            if expiry is None:
+                return False
+            margin = self.options.get("connection")["token_refresh_margin"]
+            if token == self.u_token and self.u_token_time is not None:
+                # tokens living less than the margin are refreshed halfway through their life, not by every request
+                margin = min(margin, (expiry - self.u_token_time) / 2)
+            return datetime.datetime.now() >= expiry - margin
+
+        def refresh_tokens_once(self, stale=None):
+            """
+            Single-flight token refresh: one thread, and with token files one process, logs in at a time while the
+            others wait and then use the token it got
+
+            :param stale: User token found expired, None when there is no token yet
+            :type stale: str
+            """
+            called = datetime.datetime.now()
+            with self.token_lock:
+                # the token got by another thread is used even when it's within the refresh margin, otherwise tokens
+                # living less than the margin would make every waiting thread log in again. The login can return the
+                # same token, so the time of the last login is checked too
+                if self.u_token is not None and (
+                        self.u_token != stale or self.u_token_time is not None and self.u_token_time >= called):
+                    # refreshed by another thread while waiting
+                    return
+                with self.token_files_lock():
+                    if self.options.get("use_token_files"):
+                        s_token, u_token = self.read_token_files()
+                        if s_token is not None and u_token is not None and u_token != stale:
+                            # refreshed by another process
+                            self.s_token, self.u_token, self.u_token_time = s_token, u_token, None
+                            return
+                        self.s_token = s_token if s_token is not None else self.s_token
+                    start = time.perf_counter()
+                    self.refresh_tokens()
+                    self.u_token_time = datetime.datetime.now()
+                    self.parent.metrics.token_refresh(time.perf_counter() - start)
 
-        def get_data(self, url):
-            j_s = requests.get(url, headers={"Authorization": "Bearer " + self.u_token}).text
+        @classmethod
+        def decode(cls, j_s):
+            """
+            :param j_s: Body of an api response
+            :type j_s: str
+            :return: Decoded response, None if the token has expired
+            """
             try:
                 j = json.loads(j_s)
             except json.decoder.JSONDecodeError:
-                raise self.InvalidResponseException()
+                raise cls.InvalidResponseException()
             if j == "Errore":
-                raise self.RequestErrorException(j)
+                raise cls.RequestErrorException(j)
             if "code" in j and j["code"] == 401:
+                return None
+            return j
+
+        def set_priority(self, priority):
+            """
+            Sets the default priority class of the requests sent by the current thread
+            """
+            self.local.priority = priority
+
+        def get_priority(self):
+            """
+            :return: Default priority class of the requests sent by the current thread
+            :rtype: int
+            """
+            return getattr(self.local, "priority", self.INTERACTIVE)
+
+        def limiter(self, url):
+            """
+            :rtype: Nuvola.Connection.RateLimiter
+            """
+            owner = self.adapter if isinstance(self.adapter, self.PooledAdapter) else self
+            host = urlparse(url).netloc
+            with owner.limiters_lock:
+                if host not in owner.limiters:
+                    o = self.options.get("rate_limit")
+                    owner.limiters[host] = self.RateLimiter(o["rate"], o["burst"], o["max_concurrency"])
+                return owner.limiters[host]
+
+        @staticmethod
+        def retry_after(value):
+            """
+            :param value: Retry-After header, in seconds or as an http date
+            :return: Seconds to wait, None when the header is missing or invalid
+            :rtype: float
+            """
+            if value is None:
+                return None
+            try:
+                return max(float(value), 0)
+            except ValueError:
+                pass
+            try:
+                return max((parsedate_to_datetime(value) - datetime.datetime.now(datetime.timezone.utc))
+                           .total_seconds(), 0)
+            except (TypeError, ValueError):
+                return None
+
+        def send(self, url, token, priority=None, headers=None, stream=False):
+            """
+            Sends a request through the rate limiter of its host, backing off and retrying while it's throttled
+
+            :param headers: Headers sent together with the authorization
+            :param stream: Whether the body is read by the caller, after the slot of the request has been released
+            :rtype: requests.Response
+            """
+            if priority is None:
+                priority = self.get_priority()
+            limiter = self.limiter(url)
+            o = self.options.get("rate_limit")
+            headers = dict(headers or {}, Authorization="Bearer " + token)
+            for attempt in range(o["max_retries"] + 1):
+                limiter.acquire(priority)
+                start = time.perf_counter()
+                try:
+                    r = self.session.get(url, headers=headers, stream=stream)
+                finally:
+                    limiter.release()
+                throttled = r.status_code in self.THROTTLE_STATUSES
+                # a streamed body isn't read yet, its size is the announced one
+                size = int(r.headers.get("Content-Length") or 0) if stream else len(r.content)
+                self.parent.metrics.request(url, r.status_code, time.perf_counter() - start, size,
+                                            retry=throttled and attempt < o["max_retries"])
+                if not throttled:
+                    return r
+                if stream:
+                    r.close()
+                if attempt == o["max_retries"]:
+                    break
+                delay = self.retry_after(r.headers.get("Retry-After"))
+                if delay is None:
+                    delay = o["backoff_factor"] * 2 ** attempt
+                delay = min(delay, o["max_backoff"].total_seconds())
+                self.parent.print(f":: Connection :: Throttled ({r.status_code}), retrying in {delay} seconds...")
+                limiter.pause(delay)
+            raise self.RequestErrorException(f"Throttled ({r.status_code}) after {o['max_retries']} retries")
+
+        def get_data(self, url, priority=None):
+            """
+            :param url: Url of the api call
+            :param priority: Priority class of the request, by default the one of the current thread
+            :type url: str
+            :type priority: int
+            """
+            token = self.u_token
+            if self.is_expiring(token):
+                # refreshed before it expires, so that the requests in flight don't get a 401 all together
+                self.refresh_tokens_once(token)
+                token = self.u_token
+            r = self.send(url, token, priority)
+            with self.parent.metrics.timer("parse", self.parent.metrics.endpoint(url)):
+                j = self.decode(r.text)
+            if j is None:
                 self.parent.print(":: Connection :: Token expired, getting a new one...")
-                self.refresh_tokens()
-                return self.get_data(url)
+                self.refresh_tokens_once(token)
+                return self.get_data(url, priority)
             else:
                 return j
 
-        def makefile(self, file):
+        def attachment_url(self, file):
+            if type(file) is not Nuvola.File:
+                raise TypeError(file)
+            return f"{self.parent.URL}{file.parent.ATTACHMENT_LINK.format(self.parent.id_student, file.id_)}"
+
+        def request_file(self, file, offset=0, validator=None, priority=None):
             """
+            Sends the request of an attachment, through the rate limiter, asking only the bytes after offset.
+            InvalidRangeException is raised when the file on the server doesn't continue from offset, i.e. the bytes
+            before it are of another file, or of another version of it
 
             :param file: File to be read
-            :return: Seekable file-type object
-            :rtype: Nuvola.File
+            :param offset: Bytes already downloaded
+            :param validator: ETag or Last-Modified of the response of the bytes already downloaded, sent as If-Range
+            :param priority: Priority class of the request, by default the one of the current thread
+            :type file: Nuvola.File
+            :type offset: int
+            :type validator: str
+            :return: Response, whose body is read by the caller, None when offset is already the end of the file
+            :rtype: requests.Response
             """
-            if type(file) is not Nuvola.File:
-                raise TypeError(file)
+            url = self.attachment_url(file)
+            headers = {}
+            if offset:
+                headers["Range"] = f"bytes={offset}-"
+                if validator is not None:
+                    headers["If-Range"] = validator
+            while True:
+                token = self.u_token
+                if self.is_expiring(token):
+                    self.refresh_tokens_once(token)
+                    token = self.u_token
+                # the body is read after the slot of the request has been released
+                r = self.send(url, token, priority, headers, stream=True)
+                if r.status_code != 401:
+                    break
+                r.close()
+                self.parent.print(":: Connection :: Token expired, getting a new one...")
+                self.refresh_tokens_once(token)
+            status = r.status_code
+            m = self.CONTENT_RANGE.fullmatch(r.headers.get("Content-Range", ""))
+            if status == 416:
+                r.close()
+                # offset is already the whole file, unless the file is shorter
+                if m is None or int(m[2]) != offset:
+                    raise self.InvalidRangeException(f"{file.name} is not longer than {offset} bytes")
+                return None
+            if status >= 400:
+                r.close()
+                raise self.RequestErrorException(f"Download of {file.name} failed ({status})")
+            if status == 206 and (m is None or m[1] is None or int(m[1]) != offset):
+                r.close()
+                raise self.InvalidRangeException(f"{file.name} was not sent from byte {offset}")
+            if status == 200 and offset and validator is not None:
+                r.close()
+                # If-Range didn't match, the whole file is sent again because it has changed
+                raise self.InvalidRangeException(f"{file.name} has changed")
+            if status == 200 and offset and int(r.headers.get("Content-Length") or offset) < offset:
+                r.close()
+                raise self.InvalidRangeException(f"{file.name} is shorter than {offset} bytes")
+            return r
+
+        @staticmethod
+        def validator(r):
+            """
+            :return: Validator of a response which can be sent as If-Range: a strong ETag, or Last-Modified
+            :rtype: str
+            """
+            etag = r.headers.get("ETag")
+            if etag is not None and not etag.startswith("W/"):
+                return etag
+            return r.headers.get("Last-Modified")
+
+        def iter_file(self, file, offset=0, chunk_size=None, priority=None, validator=None):
+            """
+            Streams an attachment, asking the server only the bytes after offset, see request_file
+
+            :param file: File to be read
+            :param offset: Bytes already downloaded
+            :param chunk_size: Bytes of each chunk, default: the "chunk_size" of the attachments options
+            :param priority: Priority class of the request, by default the one of the current thread
+            :param validator: ETag or Last-Modified of the response of the bytes already downloaded
+            :type file: Nuvola.File
+            :type offset: int
+            :return: Chunks of the file
+            :rtype: collections.Iterable[bytes]
+            """
+            if chunk_size is None:
+                chunk_size = self.options.get("attachments")["chunk_size"]
+            r = self.request_file(file, offset, validator, priority)
+            if r is None:
+                return
+            with r:
+                yield from self.iter_body(r, offset, chunk_size)
+
+        @staticmethod
+        def iter_body(r, offset, chunk_size):
+            # a server ignoring the range sends the whole file again
+            skip = offset if r.status_code == 200 else 0
+            for chunk in r.iter_content(chunk_size):
+                if skip:
+                    chunk, skip = chunk[skip:], max(skip - len(chunk), 0)
+                if chunk:
+                    yield chunk
+
+        def download(self, file, path):
+            """
+            Streams an attachment to path through path + ".part", which is resumed when the download is
+            interrupted, now or by a previous run. A partial file is resumed only when the server gave a validator
+            of its content, saved in path + ".part.etag", otherwise it's downloaded again from the start
+
+            :param file: File to be downloaded
+            :param path: Destination
+            :type file: Nuvola.File
+            :type path: str
+            :return: path
+            :rtype: str
+            """
+            part = path + ".part"
+            validator_path = part + ".etag"
+            try:
+                with open(validator_path) as f:
+                    validator = f.read()
+            except FileNotFoundError:
+                validator = None
+            max_retries = self.options.get("connection")["max_retries"]
+            chunk_size = self.options.get("attachments")["chunk_size"]
+            attempt = 0
+            while True:
+                offset = os.path.getsize(part) if os.path.exists(part) else 0
+                if offset and validator is None:
+                    # there is no way to tell whether the partial file is of the same file
+                    os.remove(part)
+                    offset = 0
+                try:
+                    r = self.request_file(file, offset, validator)
+                    if r is None:
+                        break
+                    with r, open(part, "ab" if offset else "wb") as f:
+                        if not offset:
+                            validator = self.validator(r)
+                            self.write_validator(validator_path, validator)
+                        for chunk in self.iter_body(r, offset, chunk_size):
+                            f.write(chunk)
+                    break
+                except self.InvalidRangeException:
+                    self.parent.print(f":: Connection :: Partial download of {file.name} is stale, restarting...")
+                    validator = None
+                except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError):
+                    if attempt == max_retries:
+                        raise
+                    attempt += 1
+                    self.parent.print(f":: Connection :: Download of {file.name} interrupted, resuming...")
+            os.replace(part, path)
+            self.write_validator(validator_path, None)
+            return path
+
+        @staticmethod
+        def write_validator(path, validator):
+            if validator is None:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                return
+            fd, tmp = mkstemp(dir=os.path.dirname(path) or ".", prefix=".etag.")
+            with os.fdopen(fd, "w") as f:
+                f.write(validator)
+            os.replace(tmp, path)
+
+        def makefile(self, file):
+            """
+            Opens an attachment
 
-            return requests.get(f"https://nuvola.madisoft.it/"
-                                f"{file.parent.ATTACHMENT_LINK.format(self.parent.id_student, file.id_)}",
-                                headers={"Authorization": "Bearer " + self.u_token}).content
+            :param file: File to be read
+            :return: Seekable file-type object, the file in the attachment cache when there is one, otherwise a
+                temporary file which is kept in memory while it's small
+            :rtype: typing.BinaryIO
+            """
+            if self.parent.attachment_cache is not None:
+                return open(self.parent.download_attachment(file), "rb")
+            f = SpooledTemporaryFile(max_size=self.options.get("attachments")["chunk_size"] * 16)
+            for chunk in self.iter_file(file):
+                f.write(chunk)
+            f.seek(0)
+            return f
 
-    def __select_best_time_window(self):
+    def select_best_time_window(self):
         # Try to get entire year, else try to get current window
         for i in self.get_time_windows():
             if i.name == "INTERO ANNO":
@@ -380,343 +1538,2000 @@ class Nuvola:
         else:
             raise self.IncompatibleTimeWindowException(tw)
 
-    class Homeworks:
-        def __init__(self, parent, options, old_data=None):
-            """
-            :param parent: Parent nuvola object
+    class Collection(ABC):
+        """
+        Base of the collections refreshed every refresh_interval: Homeworks, Events, Topics and TimeWindow
+        """
+        NAME = None
+        stored = False
+
+        @abstractmethod
+        def load(self):
+            """
+            (Re)loads the collection from the api
+            """
+
+        def store_key(self):
+            return self.NAME
+
+        def restore(self):
+            """
+            Reads the mod_time of the collection from the store, if any
+
+            :return: Whether the collection was found in the store
+            :rtype: bool
+            """
+            t = None if self.parent.db is None else self.parent.db.get_mod_time(self.store_key())
+            self.mod_time = datetime.datetime.fromtimestamp(0) if t is None else t
+            self.stored = t is not None
+            return self.stored
+
+        def save(self):
+            """
+            Writes the collection to the store, if any, after it has been (re)loaded
+            """
+            if self.parent.db is not None:
+                self.parent.db.save_snapshot(self.store_key(), self.mod_time, self.dump_to_dict())
+
+        def is_expired(self):
+            return datetime.datetime.now() > self.mod_time + self.options.get("refresh_interval")
+
+        def check_and_update(self, force=False):
+            if force or self.is_expired():
+                self.parent.print(f":: Fetch :: {self.NAME}...", end="")
+                with self.parent.metrics.timer("load", self.NAME):
+                    self.load()
+                self.parent.print(" OK")
+
+        def update_if_expired(self):
+            """
+            Called by every getter before reading the collection. With background_refresh the getters answer with
+            the current data and an expired collection is refreshed on a worker thread, unless it's been expired
+            for more than max_staleness: then the getter waits for the refresh.
+            """
+            o = self.options.get("background_refresh")
+            if not o["enabled"]:
+                self.check_and_update()
+                return
+            if not self.is_expired():
+                return
+            f = self.parent.refresh_in_background(self)
+            if datetime.datetime.now() > self.mod_time + self.options.get("refresh_interval") + o["max_staleness"]:
+                f.result()
+
+    class Index:
+        """
+        Secondary indexes over a collection: sorted keys searched with bisect, for range queries, and hash maps
+        from a key to its records, for equality queries. Records are indexed by identity.
+        """
+        def __init__(self, sorted_by=None, grouped_by=None, unique_by=None):
+            """
+            :param sorted_by: Key functions of the range queries, by name
+            :param grouped_by: Key functions of the equality queries, by name
+            :param unique_by: Key functions of the unique keys (ids), by name
+            :type sorted_by: dict
+            :type grouped_by: dict
+            :type unique_by: dict
+            """
+            self.sorted_by = sorted_by or {}
+            self.grouped_by = grouped_by or {}
+            self.unique_by = unique_by or {}
+            self.sorted, self.groups, self.unique = {}, {}, {}
+            self.build([])
+
+        def build(self, records):
+            # the indexes are built aside and swapped in, so that the readers of a collection refreshed in
+            # background never find them half built
+            records = list(records)
+            sorted_, groups, unique = {}, {}, {}
+            for name, key in self.sorted_by.items():
+                pairs = sorted(((key(r), r) for r in records), key=lambda p: p[0])
+                sorted_[name] = ([k for k, _ in pairs], [r for _, r in pairs])
+            for name, key in self.grouped_by.items():
+                groups[name] = {}
+                for r in records:
+                    groups[name].setdefault(key(r), {})[id(r)] = r
+            for name, key in self.unique_by.items():
+                unique[name] = {key(r): r for r in records}
+            self.sorted, self.groups, self.unique = sorted_, groups, unique
+
+        def update(self, removed=(), added=()):
+            """
+            Removes and adds records in one step. The structures which change are copied, updated and swapped in,
+            so that every reader finds them either before or after the update.
+
+            :type removed: collections.Iterable
+            :type added: collections.Iterable
+            """
+            removed, added = {id(r): r for r in removed}, list(added)
+            if not removed and not added:
+                return
+            for name, key in self.sorted_by.items():
+                keys, records = self.sorted[name]
+                if removed:
+                    kept = [(k, r) for k, r in zip(keys, records) if id(r) not in removed]
+                else:
+                    kept = list(zip(keys, records))
+                new = sorted(((key(r), r) for r in added), key=lambda p: p[0])
+                # merge keeps the records already indexed before the new ones with the same key
+                pairs = list(merge(kept, new, key=lambda p: p[0]))
+                self.sorted[name] = ([k for k, _ in pairs], [r for _, r in pairs])
+            for name, key in self.grouped_by.items():
+                groups = dict(self.groups[name])
+                changed = {}
+                for r in removed.values():
+                    k = key(r)
+                    g = changed.get(k)
+                    if g is None:
+                        g = changed[k] = dict(groups.get(k, {}))
+                    g.pop(id(r), None)
+                for r in added:
+                    k = key(r)
+                    g = changed.get(k)
+                    if g is None:
+                        g = changed[k] = dict(groups.get(k, {}))
+                    g[id(r)] = r
+                for k, g in changed.items():
+                    if g:
+                        groups[k] = g
+                    else:
+                        groups.pop(k, None)
+                self.groups[name] = groups
+            for name, key in self.unique_by.items():
+                unique = dict(self.unique[name])
+                for r in removed.values():
+                    k = key(r)
+                    if unique.get(k) is r:
+                        del unique[k]
+                for r in added:
+                    unique[key(r)] = r
+                self.unique[name] = unique
+
+        def add(self, r):
+            self.update(added=(r,))
+
+        def remove(self, r):
+            self.update(removed=(r,))
+
+        def range(self, name, lo, hi):
+            """
+            Records with lo <= key <= hi, sorted by key
+            """
+            keys, records = self.sorted[name]
+            return records[bisect_left(keys, lo):bisect_right(keys, hi)]
+
+        def group(self, name, k):
+            g = self.groups[name].get(k)
+            return list(g.values()) if g else []
+
+        def keys(self, name):
+            return list(self.groups[name].keys())
+
+        def get(self, name, k):
+            return self.unique[name].get(k)
+
+        def last(self, name):
+            """
+            Record with the greatest key, None when there are no records
+            """
+            records = self.sorted[name][1]
+            return records[-1] if records else None
+
+    class Store:
+        """
+        Records by id, in insertion order, together with their secondary indexes. A refreshed window is upserted
+        and the records of the window which are missing from the new response are deleted, so that a refresh only
+        touches the records of the refreshed windows.
+        """
+        def __init__(self, key, window_by, index):
+            """
+            :param key: Function returning the id of a record
+            :param window_by: Name of the sorted index holding the date the api filters the windows by
+            :param index: Secondary indexes of the records
+            :type index: Nuvola.Index
+            """
+            self.key = key
+            self.window_by = window_by
+            self.index = index
+            self.records = {}
+
+        def __iter__(self):
+            # a copy, the records can be refreshed in background while they are read
+            return iter(list(self.records.values()))
+
+        def __len__(self):
+            return len(self.records)
+
+        def build(self, records):
+            records = {self.key(r): r for r in records}
+            self.index.build(records.values())
+            self.records = records
+
+        def get(self, k):
+            return self.records.get(k)
+
+        def apply(self, deleted=(), upserted=()):
+            """
+            Deletes and upserts records in one step: the records and the indexes are updated aside and swapped in,
+            so that the collection can be refreshed in background while it's read
+
+            :param deleted: Ids of the records to be deleted
+            :param upserted: Records to be added or replaced
+            :return: Deleted records and records replaced by the upserted ones
+            :rtype: (list, list)
+            """
+            records = dict(self.records)
+            removed = [records.pop(k) for k in deleted if k in records]
+            upserted = list(upserted)
+            replaced = []
+            for r in upserted:
+                old = records.get(self.key(r))
+                if old is not None:
+                    replaced.append(old)
+                records[self.key(r)] = r
+            self.index.update(removed + replaced, upserted)
+            self.records = records
+            return removed, replaced
+
+        def upsert(self, r):
+            """
+            :return: Record replaced by r, if any
+            """
+            replaced = self.apply(upserted=(r,))[1]
+            return replaced[0] if replaced else None
+
+        def delete(self, k):
+            removed = self.apply(deleted=(k,))[0]
+            return removed[0] if removed else None
+
+        def delete_range(self, lo, hi):
+            """
+            Deletes the records with lo <= date <= hi
+
+            :rtype: list
+            """
+            return self.apply([self.key(r) for r in self.index.range(self.window_by, lo, hi)])[0]
+
+        def replace_window(self, lo, hi, records):
+            """
+            Replaces the records with lo <= date <= hi with the ones of a new response of the window
+
+            :return: Deleted records
+            :rtype: list
+            """
+            new = {self.key(r): r for r in records}
+            return self.apply([k for k in [self.key(r) for r in self.index.range(self.window_by, lo, hi)]
+                               if k not in new], new.values())[0]
+
+    class AttachmentCache:
+        """
+        Content-addressed cache of the attachments: files are saved once by the sha256 of their content, in
+        objects/, and refs/ maps the id of every attachment to its content. Partial downloads are kept in partial/
+        so that they're resumed by the next download of the same attachment.
+        """
+        def __init__(self, path):
+            """
+            :param path: Directory of the cache, created when missing
+            :type path: str
+            """
+            self.path = path
+            for i in ("objects", "refs", "partial"):
+                os.makedirs(os.path.join(path, i), exist_ok=True)
+            self.locks, self.locks_lock = {}, threading.Lock()
+
+        @staticmethod
+        def key(file):
+            # ids are unique only within the attachments of the same kind of record
+            return f"{file.parent.__name__}-{file.id_}"
+
+        def lock(self, file):
+            """
+            :return: Lock held while the attachment is being downloaded, so that it's downloaded once
+            :rtype: threading.Lock
+            """
+            with self.locks_lock:
+                return self.locks.setdefault(self.key(file), threading.Lock())
+
+        def object_path(self, digest):
+            return os.path.join(self.path, "objects", digest[:2], digest)
+
+        def partial_path(self, file):
+            return os.path.join(self.path, "partial", self.key(file))
+
+        def get(self, file):
+            """
+            :return: Path of the cached attachment, None when it's not cached
+            :rtype: str
+            """
+            try:
+                with open(os.path.join(self.path, "refs", self.key(file))) as f:
+                    path = self.object_path(f.read())
+            except FileNotFoundError:
+                return None
+            return path if os.path.exists(path) else None
+
+        def put(self, file, path):
+            """
+            Moves a downloaded attachment into the cache
+
+            :param file: Attachment
+            :param path: Downloaded file, removed when the same content is already cached
+            :type file: Nuvola.File
+            :type path: str
+            :return: Path of the cached attachment
+            :rtype: str
+            """
+            h = hashlib.sha256()
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    h.update(chunk)
+            digest = h.hexdigest()
+            target = self.object_path(digest)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            if os.path.exists(target):
+                os.remove(path)
+            else:
+                os.replace(path, target)
+            ref = os.path.join(self.path, "refs", self.key(file))
+            fd, tmp = mkstemp(dir=os.path.dirname(ref), prefix=".ref.")
+            with os.fdopen(fd, "w") as f:
+                f.write(digest)
+            os.replace(tmp, ref)
+            return target
+
+    class Database:
+        """
+        SQLite store of the collections. Homeworks and topics are kept one row per record, in tables with an SQL
+        index for each of their secondary indexes, and are read only when a getter asks for them. The smaller
+        collections (events, irregularities and each time window) are kept as one snapshot each.
+        """
+        def __init__(self, path):
+            """
+            :param path: Path of the database file, ":memory:" for a database which isn't saved
+            :type path: str
+            """
+            # collections can be loaded from many threads, every access goes through the lock
+            self.conn = sqlite3.connect(path, check_same_thread=False)
+            self.lock = threading.Lock()
+            with self.lock, self.conn:
+                self.conn.executescript("""
+                    CREATE TABLE IF NOT EXISTS mod_times (name TEXT PRIMARY KEY, mod_time REAL NOT NULL);
+                    CREATE TABLE IF NOT EXISTS snapshots (name TEXT PRIMARY KEY, data TEXT NOT NULL);
+                """)
+
+        def execute(self, sql, parameters=()):
+            with self.lock:
+                return self.conn.execute(sql, parameters).fetchall()
+
+        def get_mod_time(self, name):
+            r = self.execute("SELECT mod_time FROM mod_times WHERE name = ?", (name,))
+            return datetime.datetime.fromtimestamp(r[0][0]) if r else None
+
+        def set_mod_time(self, name, mod_time):
+            with self.lock, self.conn:
+                self.conn.execute("INSERT OR REPLACE INTO mod_times VALUES (?, ?)", (name, mod_time.timestamp()))
+
+        def load_snapshot(self, name):
+            r = self.execute("SELECT data FROM snapshots WHERE name = ?", (name,))
+            return json.loads(r[0][0]) if r else None
+
+        def save_snapshot(self, name, mod_time, data):
+            with self.lock, self.conn:
+                self.conn.execute("INSERT OR REPLACE INTO snapshots VALUES (?, ?)", (name, json.dumps(data)))
+                self.conn.execute("INSERT OR REPLACE INTO mod_times VALUES (?, ?)", (name, mod_time.timestamp()))
+
+        def complete_import(self, obj):
+            """
+            Fills the collections missing from imported data with their snapshots
+
+            :param obj: Data previously exported
+            :type obj: dict
+            :rtype: dict
+            """
+            obj = dict(obj)
+            for i, name in (("events", Nuvola.Events.NAME), ("irregularities", Nuvola.Irregularities.NAME)):
+                if obj.get(i) is None:
+                    obj[i] = self.load_snapshot(name)
+            if obj.get("timeWindows") is None:
+                r = self.execute("SELECT data FROM snapshots WHERE name LIKE ? ORDER BY name",
+                                 (Nuvola.TimeWindow.NAME + ":%",))
+                obj["timeWindows"] = [json.loads(i[0]) for i in r] or None
+            return obj
+
+        def table(self, name, key, columns, encode, decode, window_by):
+            return self.Table(self, name, key, columns, encode, decode, window_by)
+
+        def close(self):
+            with self.lock:
+                self.conn.close()
+
+        class Table:
+            """
+            Table of records, with the interface of both Nuvola.Store and Nuvola.Index. Records are rebuilt from
+            their rows by each query.
+            """
+            def __init__(self, db, name, key, columns, encode, decode, window_by):
+                """
+                :param db: Database of the table
+                :param name: Name of the table
+                :param key: Function returning the id of a record
+                :param columns: Functions of the indexed columns, by name, which are the names of the queries
+                :param encode: Function returning the payload saved for a record
+                :param decode: Function rebuilding a record from its payload
+                :param window_by: Column holding the date the api filters the windows by
+                :type db: Nuvola.Database
+                :type columns: dict
+                """
+                self.db = db
+                self.name = name
+                self.key = key
+                self.columns = columns
+                self.encode = encode
+                self.decode = decode
+                self.window_by = window_by
+                with db.lock, db.conn:
+                    db.conn.execute("CREATE TABLE IF NOT EXISTS {} (key TEXT PRIMARY KEY, raw TEXT NOT NULL, {})"
+                                    .format(name, ", ".join(columns)))
+                    for i in columns:
+                        db.conn.execute(f"CREATE INDEX IF NOT EXISTS {name}_{i} ON {name} ({i})")
+
+            @staticmethod
+            def value(v):
+                # dates are saved in iso format, which keeps them in order
+                return v.isoformat() if isinstance(v, datetime.date) else v
+
+            def encode_key(self, k):
+                return json.dumps(k, default=str)
+
+            def row(self, r):
+                return ((self.encode_key(self.key(r)), json.dumps(self.encode(r)))
+                        + tuple(self.value(f(r)) for f in self.columns.values()))
+
+            def query(self, where="", parameters=(), order="rowid"):
+                rows = self.db.execute(f"SELECT raw FROM {self.name} {where} ORDER BY {order}", parameters)
+                return [self.decode(json.loads(i[0])) for i in rows]
+
+            def __iter__(self):
+                return iter(self.query())
+
+            def __len__(self):
+                return self.db.execute(f"SELECT COUNT(*) FROM {self.name}")[0][0]
+
+            def __upsert(self, rows):
+                names = ", ".join(self.columns)
+                self.db.conn.executemany(
+                    "INSERT INTO {0} (key, raw, {1}) VALUES ({2}) ON CONFLICT (key) DO UPDATE SET raw = excluded.raw, "
+                    "{3}".format(self.name, names, ", ".join("?" * (len(self.columns) + 2)),
+                                 ", ".join(f"{i} = excluded.{i}" for i in self.columns)), rows)
+
+            def build(self, records):
+                rows = [self.row(r) for r in records]
+                with self.db.lock, self.db.conn:
+                    self.db.conn.execute(f"DELETE FROM {self.name}")
+                    self.__upsert(rows)
+
+            def get(self, k):
+                r = self.query("WHERE key = ?", (self.encode_key(k),))
+                return r[0] if r else None
+
+            def upsert(self, r):
+                old = self.get(self.key(r))
+                with self.db.lock, self.db.conn:
+                    self.__upsert([self.row(r)])
+                return old
+
+            def delete(self, k):
+                old = self.get(k)
+                with self.db.lock, self.db.conn:
+                    self.db.conn.execute(f"DELETE FROM {self.name} WHERE key = ?", (self.encode_key(k),))
+                return old
+
+            def delete_range(self, lo, hi):
+                deleted = self.range(self.window_by, lo, hi)
+                with self.db.lock, self.db.conn:
+                    self.db.conn.execute(f"DELETE FROM {self.name} WHERE {self.window_by} BETWEEN ? AND ?",
+                                         (self.value(lo), self.value(hi)))
+                return deleted
+
+            def replace_window(self, lo, hi, records):
+                rows = [self.row(r) for r in records]
+                keys = [i[0] for i in rows]
+                with self.db.lock, self.db.conn:
+                    deleted = [json.loads(i[0]) for i in self.db.conn.execute(
+                        "SELECT raw FROM {0} WHERE {1} BETWEEN ? AND ? AND key NOT IN ({2})".format(
+                            self.name, self.window_by, ", ".join("?" * len(keys))),
+                        (self.value(lo), self.value(hi), *keys))]
+                    self.db.conn.execute(
+                        "DELETE FROM {0} WHERE {1} BETWEEN ? AND ? AND key NOT IN ({2})".format(
+                            self.name, self.window_by, ", ".join("?" * len(keys))),
+                        (self.value(lo), self.value(hi), *keys))
+                    self.__upsert(rows)
+                return [self.decode(i) for i in deleted]
+
+            def range(self, name, lo, hi):
+                return self.query(f"WHERE {name} BETWEEN ? AND ?", (self.value(lo), self.value(hi)),
+                                  f"{name}, rowid")
+
+            def group(self, name, k):
+                return self.query(f"WHERE {name} = ?", (self.value(k),))
+
+            def keys(self, name):
+                return [i[0] for i in self.db.execute(f"SELECT DISTINCT {name} FROM {self.name}")]
+
+            def last(self, name):
+                r = self.query("", (), f"{name} DESC, rowid DESC LIMIT 1")
+                return r[0] if r else None
+
+    class IntervalTree:
+        """
+        Static centered interval tree, answering which intervals overlap a range in O(log n + k)
+        """
+        def __init__(self, intervals):
+            """
+            :param intervals: (start, end, record) tuples
+            :type intervals: list
+            """
+            self.root = self.__build(list(intervals))
+
+        def __build(self, intervals):
+            if not intervals:
+                return None
+            points = sorted(p for i in intervals for p in i[:2])
+            center = points[len(points) // 2]
+            left, right, here = [], [], []
+            for i in intervals:
+                if i[1] < center:
+                    left.append(i)
+                elif i[0] > center:
+                    right.append(i)
+                else:
+                    here.append(i)
+            # node: center, intervals by start ascending, intervals by end descending, left child, right child
+            return (center, sorted(here, key=lambda i: i[0]), sorted(here, key=lambda i: i[1], reverse=True),
+                    self.__build(left), self.__build(right))
+
+        def overlap(self, lo, hi):
+            """
+            Records whose interval has at least one point in [lo, hi]
+            """
+            out = []
+            stack = [self.root]
+            while stack:
+                node = stack.pop()
+                if node is None:
+                    continue
+                center, by_start, by_end, left, right = node
+                if hi < center:
+                    for i in by_start:
+                        if i[0] > hi:
+                            break
+                        out.append(i[2])
+                    stack.append(left)
+                elif lo > center:
+                    for i in by_end:
+                        if i[1] < lo:
+                            break
+                        out.append(i[2])
+                    stack.append(right)
+                else:
+                    out += [i[2] for i in by_start]
+                    stack.append(left)
+                    stack.append(right)
+            return out
+
+    class WindowScan:
+        """
+        Range scan over consecutive windows of 15 days, used by the endpoints which take a date interval
+        (compito/elenco, argomento-lezione/elenco).
+        The scan stops when the number of empty windows reaches max_empty_days / 15.
+        """
+        WINDOW = datetime.timedelta(days=15)
+
+        def __init__(self, parent, call, date_s, max_empty_days, is_empty=None, reset_on_data=True,
+                     workers=1):
+            """
+            :param parent: Parent nuvola object
+            :param call: API call, formatted with the start and end date of each window
+            :param date_s: Start date of the first window
+            :param max_empty_days: Days without data after which the scan stops
+            :param is_empty: Function telling whether a response has no data, default: empty list
+            :param reset_on_data: Whether a window with data resets the count of empty windows
+            :param workers: Number of windows fetched concurrently, 1 for a sequential scan
+            :type parent: Nuvola
+            :type call: str
+            :type date_s: datetime.date
+            :type max_empty_days: int
+            :type reset_on_data: bool
+            :type workers: int
+            """
+            self.parent = parent
+            self.call = call
+            self.date_s = date_s
+            self.max_empty = max_empty_days / self.WINDOW.days
+            self.is_empty = is_empty if is_empty is not None else (lambda c: len(c) == 0)
+            self.reset_on_data = reset_on_data
+            self.workers = workers
+            self.requests = 0
+            self.empty_count = 0
+            self.priority = None
+
+        def windows(self):
+            date_s = self.date_s
+            date_e = date_s + self.WINDOW
+            while True:
+                yield date_s, date_e
+                date_s = date_e + datetime.timedelta(days=1)
+                date_e += self.WINDOW
+
+        def fetch(self, window):
+            # the windows fetched by the workers keep the priority of the thread which runs the scan
+            return self.parent.get(self.call.format(window[0].strftime("%d-%m-%Y"), window[1].strftime("%d-%m-%Y")),
+                                   self.priority)
+
+        def stop(self, c):
+            if self.is_empty(c):
+                self.empty_count += 1
+            elif self.reset_on_data:
+                self.empty_count = 0
+            return self.empty_count >= self.max_empty
+
+        def run(self):
+            """
+            Fetches the windows and yields them in date order, together with their response
+
+            :rtype: collections.Iterable[((datetime.date, datetime.date), list)]
+            """
+            self.empty_count = 0
+            self.priority = self.parent.conn.get_priority()
+            if self.workers <= 1:
+                for w in self.windows():
+                    self.requests += 1
+                    c = self.fetch(w)
+                    yield w, c
+                    if self.stop(c):
+                        return
+            else:
+                yield from self.__run_parallel()
+
+        def __run_parallel(self):
+            # windows are requested speculatively ahead of the stop condition, the responses are consumed in
+            # date order, so the result is the same of the sequential scan; the speculative requests sent
+            # after the last window are discarded
+            windows = self.windows()
+            pending = deque()
+            with ThreadPoolExecutor(self.workers) as executor:
+                try:
+                    while True:
+                        while len(pending) < self.workers:
+                            w = next(windows)
+                            self.requests += 1
+                            pending.append((w, executor.submit(self.fetch, w)))
+                        w, f = pending.popleft()
+                        c = f.result()
+                        yield w, c
+                        if self.stop(c):
+                            return
+                finally:
+                    for _, f in pending:
+                        f.cancel()
+
+    class AdaptiveWindowScan(WindowScan):
+        """
+        Range scan whose windows follow the density of the data: windows grow while the responses are empty or
+        small and shrink when they are large. After an empty window the next one probes twice as many days, up to
+        the days left before max_empty_days, so the end of the data is found with a few growing probes instead
+        of counting empty windows of 15 days.
+        Every window depends on the previous response, so the scan is always sequential.
+        """
+        MIN_DAYS = 5
+        MAX_DAYS = 120
+        # items per response the window size aims for
+        TARGET = 100
+
+        def __init__(self, parent, call, date_s, max_empty_days, is_empty=None, reset_on_data=True,
+                     workers=1, count=None):
+            """
+            :param count: Function counting the items of a response, default: length of the response
+            :type count: collections.Callable
+            """
+            super().__init__(parent, call, date_s, max_empty_days, is_empty, reset_on_data, 1)
+            self.max_empty_days = max_empty_days
+            self.count = count if count is not None else len
+            self.size = self.WINDOW.days
+            self.empty_days = 0
+            self.current = None
+
+        def windows(self):
+            date_s = self.date_s
+            while True:
+                self.current = (date_s, date_s + datetime.timedelta(days=self.size))
+                yield self.current
+                date_s = self.current[1] + datetime.timedelta(days=1)
+
+        def stop(self, c):
+            n = 0 if self.is_empty(c) else self.count(c)
+            if n == 0:
+                # windows include both of their ends
+                self.empty_days += (self.current[1] - self.current[0]).days + 1
+                if self.empty_days >= self.max_empty_days:
+                    return True
+                size = min(self.size * 2, self.max_empty_days - self.empty_days)
+            else:
+                if self.reset_on_data:
+                    self.empty_days = 0
+                if n > self.TARGET:
+                    size = self.size * self.TARGET // n
+                elif n < self.TARGET // 2:
+                    size = self.size * 2
+                else:
+                    size = self.size
+            self.size = max(1, min(max(size, self.MIN_DAYS), self.MAX_DAYS, self.size * 2))
+            if n == 0:
+                # a probe never looks past the stop condition, a window of size days covers size + 1 days
+                self.size = min(self.size, self.max_empty_days - self.empty_days - 1)
+            return False
+
+    class Homeworks(Collection):
+        NAME = "Homeworks"
+        TEXT_TYPE = "homework"
+        CALL = "compito/elenco/{}/{}"
+
+        def __init__(self, parent, options, old_data=None, fetch=True):
+            """
+            :param parent: Parent nuvola object
             :param options: Options object
+            :param old_data: Data previously exported
+            :param fetch: Whether to load the homeworks now, when there is no data to import
             :type parent: Nuvola
             :type options: NuvolaOptions
+            :type old_data: dict
+            :type fetch: bool
             """
             self.parent = parent
             self.options = options
-            self.data = []
-            self.furthest_homework = None
+            # the api filters the homeworks by expiration date
+            if self.parent.db is None:
+                self.index = Nuvola.Index({"assigned": lambda h: h.date_assigned, "expired": lambda h: h.date_expired},
+                                          {"subject": lambda h: h.subject})
+                self.store = Nuvola.Store(self.key, "expired", self.index)
+            else:
+                self.index = self.store = self.parent.db.table(
+                    "homeworks", self.key,
+                    {"assigned": lambda h: h.date_assigned, "expired": lambda h: h.date_expired,
+                     "subject": lambda h: h.subject},
+                    lambda h: h.raw, self.record, "expired")
+            self.scan_requests = 0
+            self.scanned_until, self.refresh_until = None, None
             if type(old_data) is dict:
                 self.__init_from_dict(old_data)
                 return
-            self.mod_time = datetime.datetime.fromtimestamp(0)
-            self.load()
+            if isinstance(old_data, Nuvola.Snapshot.Block):
+                self.__init_from_snapshot(old_data)
+                return
+            if not self.restore() and fetch:
+                self.load()
 
         def __init_from_dict(self, obj):
-            for i in obj["data"]:
-                self.data.append(Nuvola.Homework(i))
+            self.store.build(self.number_duplicates([self.record(i) for i in obj["data"]]))
             self.mod_time = datetime.datetime.fromtimestamp(obj["mod_time"])
-            for i in self.data:
-                if self.furthest_homework is None or i.date_expired > self.furthest_homework.date_expired:
-                    self.furthest_homework = i
+            self.save()
 
-        def load(self):
-            empty_count = 0
-            if self.data:
-                expired = list(self.get_by_expiration_date(
-                    datetime.date.today() - self.options.get("homeworks")["backwards_refresh_date"],
-                    self.options.get("homeworks")["backwards_refresh_date"] + (
-                            self.furthest_homework.date_expired - datetime.date.today()), True))
-                for i in expired:
-                    self.data.remove(i)
+        def __init_from_snapshot(self, block):
+            self.store.build(self.number_duplicates(block.records()))
+            self.mod_time = block.mod_time
+            self.save()
+
+        @property
+        def data(self):
+            """
+            Homeworks, as a tuple: the collection itself is kept in store, so data is a copy which can't be changed in
+            place. Records are replaced by assigning to data, or through store.
+            """
+            return tuple(self.store)
+
+        @data.setter
+        def data(self, homeworks):
+            self.store.build(self.number_duplicates(list(homeworks)))
+
+        def save(self):
+            # the records are written to the store while they are added
+            if self.parent.db is not None:
+                self.parent.db.set_mod_time(self.store_key(), self.mod_time)
+
+        def record(self, h):
+            """
+            :param h: Homework as returned by the api
+            :rtype: Nuvola.Homework
+            """
+            return Nuvola.Homework(h, self.options.get("keep_raw"), self.options.get("lazy_records"))
+
+        @staticmethod
+        def key(h):
+            # homeworks without an id are told apart by their content, and by their position among the homeworks
+            # with the same content
+            if h.id_ is not None:
+                return h.id_
+            return h.date_assigned, h.date_expired, h.subject, h.description, h.duplicate
+
+        @staticmethod
+        def number_duplicates(homeworks):
+            """
+            Numbers the homeworks without an id which have the same content, in their order, so that their keys
+            differ. Homeworks with the same content expire on the same day, so they're always in the same window.
+
+            :type homeworks: list[Nuvola.Homework]
+            :rtype: list[Nuvola.Homework]
+            """
+            seen = Counter()
+            for h in homeworks:
+                if h.id_ is None:
+                    k = h.date_assigned, h.date_expired, h.subject, h.description
+                    h.duplicate = seen[k]
+                    seen[k] += 1
+            return homeworks
+
+        @property
+        def furthest_homework(self):
+            return self.index.last("expired")
+
+        def prepare_load(self):
+            """
+            Sets the range of expiration dates to be refreshed
+
+            :return: Start date of the scan
+            :rtype: datetime.date
+            """
+            if len(self.store):
                 date_s = datetime.date.today() - self.options.get("homeworks")["backwards_refresh_date"]
+                self.refresh_until = self.furthest_homework.date_expired
             else:
                 date_s = self.options.get("start_date") + datetime.timedelta(days=1)
+                self.refresh_until = None
+            self.scanned_until = None
+            return date_s
 
-            date_e = date_s + datetime.timedelta(days=15)
-            while True:
-                # for each iteration we ask nuvola homeworks in a period of time of 15 days
-                # the iteration stops when the number of consequent days without homeworks reaches max_empty_days
-                c = self.parent.get("compito/elenco/{}/{}".format(
-                    date_s.strftime("%d-%m-%Y"), date_e.strftime("%d-%m-%Y")))
-                if len(c) == 0:
-                    empty_count += 1
-                else:
-                    to_add = [Nuvola.Homework(i) for i in c]
-                    self.data += to_add
-                    for i in to_add:
-                        if self.furthest_homework is None or i.date_expired > self.furthest_homework.date_expired:
-                            self.furthest_homework = i
-                    empty_count = 0
-                if empty_count >= self.options.get("homeworks")["max_empty_days"] / 15:
-                    break
-                date_s = date_e + datetime.timedelta(days=1)
-                date_e += datetime.timedelta(days=15)
+        def add(self, c, window):
+            """
+            :param c: Homeworks of a window of the scan
+            :param window: Start and end date of the window
+            :type c: list
+            :type window: (datetime.date, datetime.date)
+            """
+            records = self.number_duplicates([self.record(i) for i in c])
+            removed = self.store.replace_window(window[0], window[1], records)
+            self.parent.text_index.update(self.TEXT_TYPE, removed, records)
+            self.scanned_until = window[1]
+
+        def end_load(self, scan):
+            """
+            Deletes the homeworks of the refreshed range which are past the last window of the scan
+            """
+            if self.refresh_until is not None and self.scanned_until is not None and \
+                    self.scanned_until < self.refresh_until:
+                removed = self.store.delete_range(self.scanned_until + datetime.timedelta(days=1), self.refresh_until)
+            else:
+                removed = []
+            # requests sent by the last scan, to compare the scan strategies
+            self.scan_requests = scan.requests
             self.mod_time = datetime.datetime.now()
+            self.save()
+            self.parent.text_index.update(self.TEXT_TYPE, removed, mod_time=self.mod_time)
 
-        def check_and_update(self, force=False):
-            if force or datetime.datetime.now() > self.mod_time + self.options.get("refresh_interval"):
-                self.parent.print(":: Fetch :: Homeworks...", end="")
-                self.load()
-                self.parent.print(" OK")
+        def new_scan(self):
+            # we ask nuvola homeworks in periods of time of 15 days, or adaptive ones, the scan stops when the number
+            # of consequent days without homeworks reaches max_empty_days
+            o = self.options.get("homeworks")
+            scan = self.parent.AdaptiveWindowScan if o["adaptive_scan"] else self.parent.WindowScan
+            return scan(self.parent, self.CALL, self.prepare_load(), o["max_empty_days"], workers=o["scan_workers"])
+
+        def load(self):
+            scan = self.new_scan()
+            for w, c in scan.run():
+                self.add(c, w)
+            self.end_load(scan)
 
         def get_by_assignment_date(self, date, interval=datetime.timedelta(days=0)):
-            self.check_and_update()
+            self.update_if_expired()
             if type(date) is not datetime.date:
                 raise TypeError(date)
-            for i in self.data:
-                if date + interval >= i.date_assigned >= date:
-                    yield i
+            yield from self.index.range("assigned", date, date + interval)
 
         def get_by_expiration_date(self, date, interval=datetime.timedelta(days=0), skip_check=False):
             if not skip_check:
-                self.check_and_update()
+                self.update_if_expired()
             if type(date) is not datetime.date:
                 raise TypeError(date)
-            for i in self.data:
-                if date + interval >= i.date_expired >= date:
-                    yield i
+            yield from self.index.range("expired", date, date + interval)
 
         def get_by_subject(self, subject, search=False):
-            self.check_and_update()
-            for i in self.data:
-                if i.subject == subject or search and subject in i.subject:
-                    yield i
+            self.update_if_expired()
+            # a search only scans the distinct subjects
+            for k in self.index.keys("subject") if search else [subject]:
+                if k == subject or search and subject in k:
+                    yield from self.index.group("subject", k)
 
         def get_all(self):
-            self.check_and_update()
-            for i in self.data:
+            self.update_if_expired()
+            for i in self.store:
                 yield i
 
     class Homework:
         ATTACHMENT_LINK = "/api-studente/v1/alunno/{}/compito/allegato/{}"
+        __slots__ = ("id_", "_teacher", "subject", "_attachments", "_class_", "_class_id", "date_assigned",
+                     "date_expired", "_description", "duplicate", "__raw")
+        teacher = LazyField(lambda h: h["docente"])
+        attachments = LazyField(lambda h: [Nuvola.File(i, Nuvola.Homework) for i in h["allegati"]])
+        class_ = LazyField(lambda h: h["classe"])
+        class_id = LazyField(lambda h: h["classeId"])
+        description = LazyField(lambda h: h["descrizioneCompito"][0])
 
-        def __init__(self, h):
-            self.teacher = h["docente"]
+        def __init__(self, h, keep_raw=True, lazy=False):
+            """
+            :param h: Homework as returned by the api
+            :param keep_raw: Whether to keep h, otherwise raw is rebuilt from the fields when needed
+            :param lazy: Whether to parse the fields which aren't indexed only when they are read, h is kept
+            :type h: dict
+            :type keep_raw: bool
+            :type lazy: bool
+            """
+            self.id_ = h.get("id")
             self.subject = h["materia"]
-            self.attachments = [Nuvola.File(i, self.__class__) for i in h["allegati"]]
-            self.class_ = h["classe"]
-            self.class_id = h["classeId"]
             self.date_assigned = datetime.date.fromisoformat(h["dataAssegnazione"][:10])
             self.date_expired = datetime.date.fromisoformat(h["dataConsegna"][:10])
-            self.description = h["descrizioneCompito"][0]
-            self.raw = h
+            # homeworks without an id and with the same content are numbered by Homeworks.number_duplicates
+            self.duplicate = 0
+            self.__raw = h if keep_raw or lazy else None
+            if lazy:
+                return
+            # the same as the LazyFields, without a call for each field
+            self._teacher = h["docente"]
+            self._attachments = [Nuvola.File(i, Nuvola.Homework) for i in h["allegati"]]
+            self._class_ = h["classe"]
+            self._class_id = h["classeId"]
+            self._description = h["descrizioneCompito"][0]
+
+        @property
+        def raw(self):
+            # records imported from a snapshot keep their payload encoded until it's read
+            if type(self.__raw) is memoryview:
+                self.__raw = json.loads(bytes(self.__raw))
+            if self.__raw is not None:
+                return self.__raw
+            r = {
+                "docente": self.teacher,
+                "materia": self.subject,
+                "allegati": [i.raw for i in self.attachments],
+                "classe": self.class_,
+                "classeId": self.class_id,
+                "dataAssegnazione": self.date_assigned.isoformat() + "T00:00:00",
+                "dataConsegna": self.date_expired.isoformat() + "T00:00:00",
+                "descrizioneCompito": [self.description]
+            }
+            if self.id_ is not None:
+                r["id"] = self.id_
+            return r
 
-    class Events:
-        def __init__(self, parent, options, old_data=None):
+    class Events(Collection):
+        NAME = "Events"
+        CALL = "eventi-classe"
+
+        def __init__(self, parent, options, old_data=None, fetch=True):
             self.parent = parent
             self.options = options
             self.data = []
+            self.index = Nuvola.Index(grouped_by={"teacher": lambda e: e.teacher, "type": lambda e: e.type,
+                                                  "seen": lambda e: bool(e.seen)},
+                                      unique_by={"id": lambda e: e.id_event})
+            self.intervals = Nuvola.IntervalTree([])
             if type(old_data) is dict:
                 self.__init_from_dict(old_data)
                 return
+            if isinstance(old_data, Nuvola.Snapshot.Block):
+                self.data = old_data.records()
+                self.build_index()
+                self.mod_time = old_data.mod_time
+                return
             self.mod_time = datetime.datetime.fromtimestamp(0)
-            self.load()
+            if fetch:
+                self.load()
 
         def __init_from_dict(self, obj):
             for i in obj["data"]:
-                self.data.append(Nuvola.Event(i))
+                self.data.append(self.record(i))
+            self.build_index()
             self.mod_time = datetime.datetime.fromtimestamp(obj["mod_time"])
 
-        def load(self):
-            e = self.parent.get("eventi-classe")
-            self.data = []
-            for i in e:
-                self.data.append(Nuvola.Event(i))
+        def record(self, e):
+            """
+            :param e: Event as returned by the api
+            :rtype: Nuvola.Event
+            """
+            return Nuvola.Event(e, self.options.get("keep_raw"), self.options.get("lazy_records"))
+
+        def build_index(self):
+            # events are always replaced all together, so the interval tree is built once per load, aside and
+            # then swapped in
+            self.index.build(self.data)
+            self.intervals = Nuvola.IntervalTree([(i.date_start.date(), i.date_end.date(), i) for i in self.data])
+
+        def set(self, e):
+            """
+            :param e: Events as returned by the api
+            :type e: list
+            """
+            self.data = [self.record(i) for i in e]
+            self.build_index()
             self.mod_time = datetime.datetime.now()
+            self.save()
 
-        def check_and_update(self, force=False):
-            if force or datetime.datetime.now() > self.mod_time + self.options.get("refresh_interval"):
-                self.parent.print(":: Fetch :: Events...", end="")
-                self.load()
-                self.parent.print(" OK")
+        def load(self):
+            self.set(self.parent.get(self.CALL))
+
+        def dump_to_dict(self):
+            return {
+                "mod_time": self.mod_time.timestamp(),
+                "data": [i.raw for i in self.data]
+            }
 
         def get_all(self):
-            self.check_and_update()
+            self.update_if_expired()
             for i in self.data:
                 yield i
 
         def get_by_date(self, date, interval=datetime.timedelta(days=0)):
+            """
+            Events taking place, at least partly, between date and date + interval
+            """
             if type(date) is not datetime.date:
                 raise TypeError(date)
-            self.check_and_update()
-            for i in self.data:
-                if i.date_start <= date <= i.date_end or i.date_start <= date + interval <= i.date_end:
-                    yield i
+            self.update_if_expired()
+            yield from self.intervals.overlap(date, date + interval)
 
         def get_if_occurring(self, date):
             if type(date) is not datetime.date:
                 raise TypeError(date)
-            self.check_and_update()
-            for i in self.data:
-                if i.date_start <= date <= i.date_end:
-                    yield i
+            self.update_if_expired()
+            yield from self.intervals.overlap(date, date)
 
         def get_by_teacher(self, teacher):
-            self.check_and_update()
-            for i in self.data:
-                if i.teacher == teacher:
-                    yield i
+            self.update_if_expired()
+            yield from self.index.group("teacher", teacher)
 
         def get_unseen(self):
-            self.check_and_update()
-            for i in self.data:
-                if not i.seen:
-                    yield i
+            self.update_if_expired()
+            yield from self.index.group("seen", False)
 
         def get_by_type(self, type_):
-            self.check_and_update()
-            for i in self.data:
-                if not i.type == type_:
+            self.update_if_expired()
+            yield from self.index.group("type", type_)
+
+        def get_by_id(self, id_):
+            self.update_if_expired()
+            return self.index.get("id", id_)
+
+    class Event:
+        ATTACHMENT_LINK = "/api-studente/v1/alunno/{}/eventi-classe/allegato/{}"
+        __slots__ = ("id_event", "type", "_name", "_description", "teacher", "_notes", "seen", "_attachments",
+                     "_video_link", "_background_color", "_text_color", "_border_color", "_id_notification",
+                     "date_start", "date_end", "__raw")
+        name = LazyField(lambda e: e["nome"])
+        description = LazyField(lambda e: e["descrizione"])
+        notes = LazyField(lambda e: e["annotazioni"])
+        attachments = LazyField(lambda e: [Nuvola.File(i, Nuvola.Event) for i in e["allegati"]])
+        video_link = LazyField(lambda e: e["linkVideo"])
+        background_color = LazyField(lambda e: e["coloreSfondo"])
+        text_color = LazyField(lambda e: e["coloreTesto"])
+        border_color = LazyField(lambda e: e["coloreBordo"])
+        id_notification = LazyField(lambda e: e["idNotifica"])
+
+        def __init__(self, e, keep_raw=True, lazy=False):
+            """
+            :param e: Event as returned by the api
+            :param keep_raw: Whether to keep e, otherwise raw is rebuilt from the fields when needed
+            :param lazy: Whether to parse the fields which aren't indexed only when they are read, e is kept
+            :type e: dict
+            :type keep_raw: bool
+            :type lazy: bool
+            """
+            self.id_event = e["id"]
+            self.type = e["tipo"]
+            self.teacher = e["docente"]
+            self.seen = e["visto"]
+            self.date_start = datetime.datetime.fromisoformat(
+                e["dataInizio"].replace("00:00:00", e["oraInizio"] + ":00"))
+            self.date_end = datetime.datetime.fromisoformat(
+                e["dataFine"].replace("00:00:00", e["oraFine"] + ":00"))
+            self.__raw = e if keep_raw or lazy else None
+            if lazy:
+                return
+            self._name = e["nome"]
+            self._description = e["descrizione"]
+            self._notes = e["annotazioni"]
+            self._attachments = [Nuvola.File(i, Nuvola.Event) for i in e["allegati"]]
+            self._video_link = e["linkVideo"]
+            self._background_color = e["coloreSfondo"]
+            self._text_color = e["coloreTesto"]
+            self._border_color = e["coloreBordo"]
+            self._id_notification = e["idNotifica"]
+
+        @property
+        def raw(self):
+            if type(self.__raw) is memoryview:
+                self.__raw = json.loads(bytes(self.__raw))
+            if self.__raw is not None:
+                return self.__raw
+            return {
+                "id": self.id_event,
+                "tipo": self.type,
+                "nome": self.name,
+                "descrizione": self.description,
+                "docente": self.teacher,
+                "annotazioni": self.notes,
+                "visto": self.seen,
+                "allegati": [i.raw for i in self.attachments],
+                "linkVideo": self.video_link,
+                "coloreSfondo": self.background_color,
+                "coloreTesto": self.text_color,
+                "coloreBordo": self.border_color,
+                "idNotifica": self.id_notification,
+                "dataInizio": self.date_start.replace(hour=0, minute=0, second=0).isoformat(),
+                "oraInizio": self.date_start.strftime("%H:%M"),
+                "dataFine": self.date_end.replace(hour=0, minute=0, second=0).isoformat(),
+                "oraFine": self.date_end.strftime("%H:%M")
+            }
+
+    class SubjectLoader:
+        """
+        Loads the subjects of many time windows and the marks of every subject, with at most `workers` requests
+        running concurrently.
+        """
+        def __init__(self, parent, workers=1):
+            """
+            :param parent: Parent nuvola object
+            :param workers: Maximum number of concurrent requests, 1 to load everything sequentially
+            :type parent: Nuvola
+            :type workers: int
+            """
+            self.parent = parent
+            self.workers = workers
+
+        def map(self, f, it):
+            return Nuvola.map_concurrently(f, it, self.workers)
+
+        @staticmethod
+        def subjects(tw, s):
+            """
+            :param tw: Time window being loaded
+            :param s: Subjects of tw as returned by the api
+            :return: New subjects, starting from the marks and the aggregates of the subjects they replace
+            :rtype: list[Nuvola.TimeWindow.Subject]
+            """
+            subjects = [tw.Subject(tw, i, fetch=False) for i in s]
+            for i in subjects:
+                previous = tw.index.get("id", i.id_)
+                if previous is not None:
+                    i.inherit(previous)
+            return subjects
+
+        def load(self, time_windows):
+            """
+            :param time_windows: Time windows to be (re)loaded
+            :type time_windows: list[Nuvola.TimeWindow]
+            """
+            subjects = [self.subjects(tw, s)
+                        for tw, s in zip(time_windows, self.map(lambda tw: tw.fetch_subjects(), time_windows))]
+            flat = [i for s in subjects for i in s]
+            for s, m in zip(flat, self.map(lambda s_: s_.fetch(), flat)):
+                s.load(m)
+            # windows are swapped only when all of their subjects are ready
+            now = datetime.datetime.now()
+            for tw, s in zip(time_windows, subjects):
+                tw.set_subjects(s)
+                tw.mod_time = now
+                tw.save()
+
+    class TimeWindow(Collection):
+        NAME = "TimeWindow"
+        SUBJECTS_CALL = "frazione-temporale/{}/voti/materie"
+
+        def __init__(self, parent, w, options, old_data=None, fetch=True):
+            self.parent = parent
+            self.id_ = w["id"]
+            self.name = w["nome"]
+            self.current = w["corrente"]
+            self.raw = w
+            self.options = options
+            self.subjects = []
+            self.index = Nuvola.Index(unique_by={"name": lambda s: s.name, "id": lambda s: s.id_})
+            # marks of all the subjects
+            self.aggregate = Nuvola.GradeAggregate()
+            if type(old_data) is dict:
+                self.__init_from_dict(old_data)
+                return
+            self.mod_time = datetime.datetime.fromtimestamp(0)
+            if fetch:
+                self.load()
+
+        def __init_from_dict(self, obj):
+            self.set_subjects([self.Subject(self, i["raw"], i["marks"]) for i in obj["subjects"]])
+            self.mod_time = datetime.datetime.fromtimestamp(obj["mod_time"])
+
+        def store_key(self):
+            return f"{self.NAME}:{self.id_}"
+
+        def dump_to_dict(self):
+            return {
+                "mod_time": self.mod_time.timestamp(),
+                "raw": self.raw,
+                "subjects": [{"raw": s.raw, "marks": [m.raw for m in s.marks]} for s in self.subjects]
+            }
+
+        def set_subjects(self, subjects):
+            # the aggregate of the window follows the changes of the subjects which replace the current ones
+            aggregate = self.aggregate.copy()
+            old = {i.id_: i for i in self.subjects}
+            for i in subjects:
+                previous = old.pop(i.id_, None)
+                if previous is not None and i.inherited:
+                    aggregate.apply(i.pending)
+                else:
+                    aggregate.merge(i.aggregate)
+                    if previous is not None:
+                        aggregate.merge(previous.aggregate, -1)
+                i.inherited, i.pending = False, {}
+            for i in old.values():
+                aggregate.merge(i.aggregate, -1)
+            self.index.build(subjects)
+            self.subjects, self.aggregate = subjects, aggregate
+            self.parent.grade_table = None
+
+        @property
+        def average(self):
+            """
+            Weighted average of the marks of all the subjects which count for the average, None without marks
+            """
+            return self.aggregate.average
+
+        def fetch_subjects(self):
+            return self.parent.get(self.SUBJECTS_CALL.format(self.id_))
+
+        def load(self):
+            Nuvola.SubjectLoader(self.parent, self.options.get("timeWindows")["subject_workers"]).load([self])
+
+        def get_subject_by_name(self, name):
+            self.update_if_expired()
+            return self.index.get("name", name)
+
+        def get_all_subjects(self):
+            self.update_if_expired()
+            for i in self.subjects:
+                yield i
+
+        def get_subject_by_id(self, id_):
+            self.update_if_expired()
+            return self.index.get("id", id_)
+
+        class Subject:
+            MARKS_CALL = "frazione-temporale/{}/voti/materia/{}"
+
+            def __init__(self, parent, s, old_data=None, fetch=True):
+                self.parent = parent
+                self.id_ = s["id"]
+                self.name = s["materia"]
+                self.type = s["tipo"]
+                self.raw = s
+                self.marks = []
+                self.aggregate = Nuvola.GradeAggregate()
+                # changes of the aggregate not applied to the window yet, while the subject isn't in the window
+                self.inherited, self.pending = False, {}
+                self.index = Nuvola.Index({"date": lambda m: m.date, "weight": lambda m: m.weight},
+                                          {"teacher": lambda m: m.teacher, "type": lambda m: m.type_,
+                                           "relevant": lambda m: bool(m.relevant)})
+                if type(old_data) is list:
+                    self.__init_from_dict(old_data)
+                    return
+                if fetch:
+                    self.load()
+
+            def __init_from_dict(self, obj):
+                o = self.parent.options
+                self.set_marks([self.Mark(i, self, o.get("keep_raw"), o.get("lazy_records")) for i in obj])
+
+            def inherit(self, previous):
+                """
+                Starts from the marks of the subject being replaced, so that the next set_marks only applies the
+                changes to the aggregates
+
+                :type previous: Nuvola.TimeWindow.Subject
+                """
+                self.marks = previous.marks
+                self.aggregate = previous.aggregate.copy()
+                self.inherited = True
+
+            def set_marks(self, marks):
+                changes = self.aggregate.diff(marks)
+                self.aggregate.apply(changes)
+                self.index.build(marks)
+                self.marks = marks
+                if self.parent.index.get("id", self.id_) is self:
+                    self.parent.aggregate.apply(changes)
+                else:
+                    for k, c in changes.items():
+                        self.pending[k] = self.pending.get(k, 0) + c
+                self.parent.parent.grade_table = None
+
+            @property
+            def average(self):
+                """
+                Weighted average of the marks which count for the average, None without marks
+                """
+                return self.aggregate.average
+
+            def fetch(self):
+                return self.parent.parent.get(self.MARKS_CALL.format(self.parent.id_, self.id_))[0]["voti"]
+
+            def load(self, m=None):
+                """
+                :param m: Marks already fetched, by default they are requested now
+                :type m: list
+                """
+                if m is None:
+                    m = self.fetch()
+                o = self.parent.options
+                self.set_marks([self.Mark(i, self, o.get("keep_raw"), o.get("lazy_records")) for i in m])
+
+            def get_all(self):
+                self.parent.update_if_expired()
+                for i in self.marks:
                     yield i
 
-        def get_by_id(self, id_):
-            self.check_and_update()
-            for i in self.data:
-                if i.id_ == id_:
-                    return i
+            def get_by_teacher(self, teacher):
+                self.parent.update_if_expired()
+                yield from self.index.group("teacher", teacher)
+
+            def get_by_date(self, date, interval=datetime.timedelta(days=0)):
+                if type(date) is not datetime.date:
+                    raise TypeError(date)
+                self.parent.update_if_expired()
+                yield from self.index.range("date", date, date + interval)
+
+            def get_by_weight(self, min_, max_=1):
+                self.parent.update_if_expired()
+                yield from self.index.range("weight", min_, max_)
+
+            def get_by_relevance(self):
+                self.parent.update_if_expired()
+                yield from self.index.group("relevant", True)
+
+            def get_by_type(self, type_):
+                self.parent.update_if_expired()
+                yield from self.index.group("type", type_)
+
+            class Mark:
+                __slots__ = ("parent", "subject", "subject_id", "date", "teacher", "type_", "_mark_string", "_mark",
+                             "relevant", "weight", "_description", "_name_objective", "_objectives", "__raw")
+                mark_string = LazyField(lambda m: m["valutazione"])
+                mark = LazyField(lambda m: float(m["valutazioneMatematica"]))
+                description = LazyField(lambda m: m["descrizione"])
+                name_objective = LazyField(lambda m: m["nomeObiettivo"])
+                objectives = LazyField(lambda m: m["obiettivi"])
+
+                def __init__(self, m, parent, keep_raw=True, lazy=False):
+                    """
+                    :param m: Mark as returned by the api
+                    :param parent: Subject of the mark
+                    :param keep_raw: Whether to keep m, otherwise raw is rebuilt from the fields when needed
+                    :param lazy: Whether to parse the fields which aren't indexed only when they are read, m is kept
+                    :type m: dict
+                    :type keep_raw: bool
+                    :type lazy: bool
+                    """
+                    self.parent = parent
+                    self.subject = self.parent.name
+                    self.subject_id = self.parent.id_
+                    self.date = datetime.datetime.fromisoformat(m["data"]).date()
+                    self.teacher = m["docente"]
+                    self.type_ = m["tipologia"]
+                    self.relevant = m["faMedia"]
+                    self.weight = int(m["peso"][:-1]) / 100
+                    self.__raw = m if keep_raw or lazy else None
+                    if lazy:
+                        return
+                    self._mark_string = m["valutazione"]
+                    self._mark = float(m["valutazioneMatematica"])
+                    self._description = m["descrizione"]
+                    self._name_objective = m["nomeObiettivo"]
+                    self._objectives = m["obiettivi"]
+
+                @property
+                def raw(self):
+                    if type(self.__raw) is memoryview:
+                        self.__raw = json.loads(bytes(self.__raw))
+                    if self.__raw is not None:
+                        return self.__raw
+                    return {
+                        "data": self.date.isoformat(),
+                        "docente": self.teacher,
+                        "tipologia": self.type_,
+                        "valutazione": self.mark_string,
+                        "valutazioneMatematica": self.mark,
+                        "faMedia": self.relevant,
+                        "peso": "{}%".format(round(self.weight * 100)),
+                        "descrizione": self.description,
+                        "nomeObiettivo": self.name_objective,
+                        "obiettivi": self.objectives
+                    }
+
+    class GradeAggregate:
+        """
+        Totals of the marks which count for the average: weighted sum, sum of the weights, count, min, max and date
+        of the last mark. They are updated by the changes between the marks of two refreshes, so reading them is
+        O(1); min, max and last date are searched again only when their mark is removed.
+        """
+        __slots__ = ("weighted_sum", "weight_sum", "count", "keys", "marks", "dates", "__min", "__max", "__last")
+
+        def __init__(self):
+            self.weighted_sum = 0.0
+            self.weight_sum = 0.0
+            self.count = 0
+            # counts by (mark, weight, date), by mark and by date
+            self.keys, self.marks, self.dates = Counter(), Counter(), Counter()
+            self.__min = self.__max = self.__last = None
+
+        def copy(self):
+            r = Nuvola.GradeAggregate()
+            r.weighted_sum, r.weight_sum, r.count = self.weighted_sum, self.weight_sum, self.count
+            r.keys, r.marks, r.dates = self.keys.copy(), self.marks.copy(), self.dates.copy()
+            r.__min, r.__max, r.__last = self.__min, self.__max, self.__last
+            return r
+
+        def diff(self, marks):
+            """
+            :param marks: Marks replacing the ones counted now
+            :type marks: list[Nuvola.TimeWindow.Subject.Mark]
+            :return: Changes of the counts, by (mark, weight, date)
+            :rtype: dict
+            """
+            new = Counter((m.mark, m.weight, m.date) for m in marks if m.relevant)
+            changes = {k: c - self.keys[k] for k, c in new.items() if c != self.keys[k]}
+            changes.update((k, -c) for k, c in self.keys.items() if k not in new)
+            return changes
+
+        def apply(self, changes):
+            """
+            :param changes: Changes of the counts, by (mark, weight, date), as returned by diff
+            :type changes: dict
+            """
+            for k, c in changes.items():
+                mark, weight, date = k
+                self.weighted_sum += mark * weight * c
+                self.weight_sum += weight * c
+                self.count += c
+                for counter, v in ((self.keys, k), (self.marks, mark), (self.dates, date)):
+                    counter[v] += c
+                    if counter[v] <= 0:
+                        del counter[v]
+                if c > 0:
+                    if self.__min is not None:
+                        self.__min = min(self.__min, mark)
+                    if self.__max is not None:
+                        self.__max = max(self.__max, mark)
+                    if self.__last is not None:
+                        self.__last = max(self.__last, date)
+                else:
+                    if mark not in self.marks:
+                        if mark == self.__min:
+                            self.__min = None
+                        if mark == self.__max:
+                            self.__max = None
+                    if date not in self.dates and date == self.__last:
+                        self.__last = None
+            if not self.count:
+                # no rounding errors left behind
+                self.weighted_sum = self.weight_sum = 0.0
+
+        def merge(self, other, sign=1):
+            """
+            Adds, or with sign -1 removes, the marks counted by other
+
+            :type other: Nuvola.GradeAggregate
+            """
+            self.apply({k: c * sign for k, c in other.keys.items()})
+
+        @property
+        def average(self):
+            return self.weighted_sum / self.weight_sum if self.weight_sum else None
+
+        @property
+        def min(self):
+            if self.__min is None and self.marks:
+                self.__min = min(self.marks)
+            return self.__min
+
+        @property
+        def max(self):
+            if self.__max is None and self.marks:
+                self.__max = max(self.marks)
+            return self.__max
+
+        @property
+        def last_date(self):
+            if self.__last is None and self.dates:
+                self.__last = max(self.dates)
+            return self.__last
+
+    class Grades:
+        """
+        Marks of every time window in columns: mark, weight, date ordinal, relevance, subject id, window id and the
+        group, index of the (window id, subject id) pair in groups. Columns are numpy arrays when numpy is installed,
+        arrays of the array module otherwise, and every operation covers all the subjects of all the windows in one
+        pass over the columns.
+        """
+        def __init__(self, time_windows):
+            """
+            :param time_windows: Time windows whose subjects have been loaded
+            :type time_windows: list[Nuvola.TimeWindow]
+            """
+            # (window id, subject id) of each group, subject names by id
+            self.groups = []
+            self.names = {}
+            mark, weight, date, relevant = array("d"), array("d"), array("q"), array("b")
+            subject, window, group = array("q"), array("q"), array("q")
+            for tw in time_windows:
+                for s in tw.subjects:
+                    g = len(self.groups)
+                    self.groups.append((tw.id_, s.id_))
+                    self.names[s.id_] = s.name
+                    for m in s.marks:
+                        mark.append(m.mark)
+                        weight.append(m.weight)
+                        date.append(m.date.toordinal())
+                        relevant.append(bool(m.relevant))
+                        subject.append(s.id_)
+                        window.append(tw.id_)
+                        group.append(g)
+            if numpy is not None:
+                mark, weight, date, subject, window, group = (numpy.frombuffer(i, i.typecode) for i in
+                                                              (mark, weight, date, subject, window, group))
+                relevant = numpy.frombuffer(relevant, numpy.bool_)
+            self.mark, self.weight, self.date, self.relevant = mark, weight, date, relevant
+            self.subject, self.window, self.group = subject, window, group
+
+        def __len__(self):
+            return len(self.mark)
+
+        def rows(self, window=None, relevant=True):
+            """
+            :param window: Id of the only window to be read, default: all
+            :param relevant: Whether to skip the marks which don't count for the average
+            :return: Indexes of the selected marks, a boolean mask with numpy
+            """
+            if numpy is not None:
+                mask = self.relevant.copy() if relevant else numpy.ones(len(self), numpy.bool_)
+                if window is not None:
+                    mask &= self.window == window
+                return mask
+            return [i for i in range(len(self)) if (not relevant or self.relevant[i]) and
+                    (window is None or self.window[i] == window)]
+
+        def sums(self, window=None, relevant=True):
+            """
+            :return: Weighted sum of the marks, sum of the weights and number of marks of each group
+            :rtype: (list, list, list)
+            """
+            rows = self.rows(window, relevant)
+            n = len(self.groups)
+            if numpy is not None:
+                g, w = self.group[rows], self.weight[rows]
+                return (numpy.bincount(g, self.mark[rows] * w, n), numpy.bincount(g, w, n),
+                        numpy.bincount(g, minlength=n))
+            weighted, weights, counts = [0.0] * n, [0.0] * n, [0] * n
+            for i in rows:
+                g, w = self.group[i], self.weight[i]
+                weighted[g] += self.mark[i] * w
+                weights[g] += w
+                counts[g] += 1
+            return weighted, weights, counts
+
+        def averages(self, window=None, relevant=True):
+            """
+            Weighted average of every subject of every window
+
+            :param window: Id of the only window to be averaged, default: all
+            :param relevant: Whether to skip the marks which don't count for the average
+            :return: Averages by (window id, subject id), None for the subjects without marks
+            :rtype: dict
+            """
+            weighted, weights, _ = self.sums(window, relevant)
+            return {k: float(weighted[g] / weights[g]) if weights[g] else None for g, k in enumerate(self.groups)
+                    if window is None or k[0] == window}
+
+        def window_averages(self, relevant=True):
+            """
+            :return: Average of the subject averages of each window, by window id, as in the report cards
+            :rtype: dict
+            """
+            r = {}
+            for (w, _), a in self.averages(relevant=relevant).items():
+                if a is not None:
+                    r.setdefault(w, []).append(a)
+            return {w: sum(a) / len(a) for w, a in r.items()}
+
+        def running_averages(self, window=None, relevant=True):
+            """
+            Weighted average of every subject after each of its marks, in date order
+
+            :param window: Id of the only window to be read, default: all
+            :param relevant: Whether to skip the marks which don't count for the average
+            :return: Lists of (date, average) by (window id, subject id)
+            :rtype: dict
+            """
+            rows = self.rows(window, relevant)
+            r = {}
+            if numpy is not None:
+                g, d, w = self.group[rows], self.date[rows], self.weight[rows]
+                order = numpy.lexsort((d, g))
+                g, d, w, mw = g[order], d[order], w[order], (self.mark[rows] * self.weight[rows])[order]
+                if not len(g):
+                    return r
+                # cumulative sums restarted at the first mark of each group
+                start = numpy.flatnonzero(numpy.r_[True, g[1:] != g[:-1]])
+                first = numpy.repeat(start, numpy.diff(numpy.r_[start, len(g)]))
+                weighted, weights = numpy.cumsum(mw), numpy.cumsum(w)
+                weighted -= weighted[first] - mw[first]
+                weights -= weights[first] - w[first]
+                with numpy.errstate(divide="ignore", invalid="ignore"):
+                    averages = weighted / weights
+                for a, b in zip(start, numpy.r_[start[1:], len(g)]):
+                    r[self.groups[g[a]]] = [(datetime.date.fromordinal(int(i)), float(j))
+                                            for i, j in zip(d[a:b], averages[a:b]) if not numpy.isnan(j)]
+                return r
+            sums = {}
+            for i in sorted(rows, key=lambda i_: (self.group[i_], self.date[i_])):
+                k = self.groups[self.group[i]]
+                weighted, weights = sums.get(k, (0.0, 0.0))
+                weighted, weights = weighted + self.mark[i] * self.weight[i], weights + self.weight[i]
+                sums[k] = weighted, weights
+                if weights:
+                    r.setdefault(k, []).append((datetime.date.fromordinal(self.date[i]), weighted / weights))
+            return r
+
+        def needed(self, target, weight=1.0, window=None):
+            """
+            Mark needed by every subject to reach target with its next mark
+
+            :param target: Average to be reached
+            :param weight: Weight of the next mark, greater than 0
+            :param window: Id of the only window to be projected, default: all
+            :type target: float
+            :type weight: float
+            :return: Marks by (window id, subject id), they may be out of the range of the marks
+            :rtype: dict
+            """
+            if not weight > 0:
+                raise ValueError(f"The weight of the next mark must be greater than 0: {weight}")
+            weighted, weights, _ = self.sums(window)
+            if numpy is not None:
+                needed = (target * (weights + weight) - weighted) / weight
+            else:
+                needed = [(target * (b + weight) - a) / weight for a, b in zip(weighted, weights)]
+            return {k: float(needed[g]) for g, k in enumerate(self.groups) if window is None or k[0] == window}
+
+    class TextIndex:
+        """
+        Inverted index of the text of homeworks, topics and events, ranked with BM25. Text is folded to lowercase
+        without accents ("perché" and "perche" are the same word) and the most common Italian words are skipped.
+
+        The documents of a collection are indexed by its first search, so that a warm store isn't read whole. After
+        that the refreshes of homeworks and topics update the index with the records stored and deleted by each
+        window of their scans, and a search brings it up to date with the collections refreshed all together: only
+        the records whose text changed are tokenized again, the others are only matched by their checksum, so an
+        index exported with dump_to_dict is not rebuilt by the import.
+        """
+        TYPES = ("homework", "topic", "event")
+        STOPWORDS = frozenset((
+            "a", "ad", "al", "alla", "alle", "agli", "ai", "all", "c", "che", "chi", "con", "da", "dal", "dalla",
+            "dei", "del", "della", "delle", "dell", "degli", "di", "e", "ed", "gli", "i", "il", "in", "l", "la", "le",
+            "lo", "ma", "ne", "nei", "nel", "nella", "nelle", "nell", "o", "per", "se", "si", "su", "sul", "sulla",
+            "tra", "fra", "un", "una", "uno"
+        ))
+        WORD = re.compile(r"\w+")
+        # BM25 parameters
+        K1 = 1.2
+        B = 0.75
+
+        def __init__(self, obj=None):
+            """
+            :param obj: Index exported by dump_to_dict
+            :type obj: dict
+            """
+            # term: {document: term frequency}
+            self.postings = {}
+            # document: [type, date ordinal, length, checksum, terms]
+            self.docs = {}
+            # document: record, found again by sync after an import
+            self.records = {}
+            # mod_time of each collection when it was last synced
+            self.synced = {}
+            self.total_length = 0
+            self.lock = threading.Lock()
+            if obj is not None:
+                # the index is updated in place, the imported object is left alone
+                self.postings = {t: dict(p) for t, p in obj["postings"].items()}
+                self.docs = {doc: list(d) for doc, d in obj["docs"].items()}
+                self.synced = {k: None for k in obj["synced"]}
+                self.total_length = sum(i[2] for i in self.docs.values())
+
+        @classmethod
+        def tokenize(cls, text):
+            """
+            :return: Words of text, lowercase and without accents
+            :rtype: list[str]
+            """
+            text = "".join(c for c in unicodedata.normalize("NFKD", text.lower()) if not unicodedata.combining(c))
+            return [i for i in cls.WORD.findall(text) if i not in cls.STOPWORDS]
+
+        @staticmethod
+        def document(type_, r):
+            """
+            :return: Id, date and text of a record
+            :rtype: (str, datetime.date, str)
+            """
+            if type_ == "homework":
+                key = r.id_
+                if key is None:
+                    key = "{:08x}".format(zlib.crc32(repr(Nuvola.Homeworks.key(r)).encode()))
+                return f"homework:{key}", r.date_assigned, r.description or ""
+            if type_ == "topic":
+                return f"topic:{r.id_}", r.date, "\n".join(filter(None, (r.name, r.long_description)))
+            return f"event:{r.id_event}", r.date_start.date(), "\n".join(filter(None, (r.name, r.description, r.notes)))
+
+        def add(self, doc, type_, date, text, record):
+            terms = self.tokenize(text)
+            counts = Counter(terms)
+            for t, c in counts.items():
+                self.postings.setdefault(t, {})[doc] = c
+            self.docs[doc] = [type_, date.toordinal(), len(terms), zlib.crc32(text.encode()), list(counts)]
+            self.records[doc] = record
+            self.total_length += len(terms)
+
+        def remove(self, doc):
+            _, _, length, _, terms = self.docs.pop(doc)
+            for t in terms:
+                p = self.postings[t]
+                del p[doc]
+                if not p:
+                    del self.postings[t]
+            self.records.pop(doc, None)
+            self.total_length -= length
+
+        def __upsert(self, type_, r):
+            doc, date, text = self.document(type_, r)
+            d = self.docs.get(doc)
+            if d is not None and d[3] == zlib.crc32(text.encode()):
+                self.records[doc] = r
+                d[1] = date.toordinal()
+                return doc
+            if d is not None:
+                self.remove(doc)
+            self.add(doc, type_, date, text, r)
+            return doc
+
+        def sync(self, type_, collection):
+            """
+            Updates the documents of a whole collection, unless they are already up to date with its last refresh
+
+            :param type_: Type of the records of the collection, as in TYPES
+            :type collection: Nuvola.Collection
+            """
+            mod_time = collection.mod_time.timestamp()
+            with self.lock:
+                if self.synced.get(type_) == mod_time:
+                    return
+                seen = {self.__upsert(type_, r) for r in collection.data}
+                for doc in [k for k, v in self.docs.items() if v[0] == type_ and k not in seen]:
+                    self.remove(doc)
+                self.synced[type_] = mod_time
+
+        def update(self, type_, removed=(), upserted=(), mod_time=None):
+            """
+            Updates the documents of the records changed by a window of a refresh
+
+            :param type_: Type of the records, as in TYPES
+            :param removed: Records deleted from the collection
+            :param upserted: Records added or replaced
+            :param mod_time: mod_time of the collection, when its refresh is over
+            :type mod_time: datetime.datetime
+            """
+            with self.lock:
+                # the collection is indexed whole by its next search
+                if self.synced.get(type_) is None:
+                    return
+                for r in removed:
+                    doc = self.document(type_, r)[0]
+                    if doc in self.docs:
+                        self.remove(doc)
+                for r in upserted:
+                    self.__upsert(type_, r)
+                if mod_time is not None:
+                    self.synced[type_] = mod_time.timestamp()
+
+        def search(self, query, limit=10, types=None, start=None, end=None):
+            """
+            :return: (score, type, record) tuples of the best documents, see Nuvola.search
+            :rtype: list
+            """
+            with self.lock:
+                n = len(self.docs)
+                if not n:
+                    return []
+                average = self.total_length / n or 1
+                lo = start.toordinal() if start is not None else None
+                hi = end.toordinal() if end is not None else None
+                scores = {}
+                for t in set(self.tokenize(query)):
+                    p = self.postings.get(t)
+                    if not p:
+                        continue
+                    idf = math.log(1 + (n - len(p) + 0.5) / (len(p) + 0.5))
+                    for doc, tf in p.items():
+                        type_, date, length = self.docs[doc][:3]
+                        if types is not None and type_ not in types or lo is not None and date < lo or \
+                                hi is not None and date > hi:
+                            continue
+                        scores[doc] = scores.get(doc, 0) + idf * tf * (self.K1 + 1) / (
+                            tf + self.K1 * (1 - self.B + self.B * length / average))
+                return [(score, self.docs[doc][0], self.records[doc])
+                        for doc, score in nlargest(limit, scores.items(), key=lambda i: i[1])]
 
-    class Event:
-        ATTACHMENT_LINK = "/api-studente/v1/alunno/{}/eventi-classe/allegato/{}"
+        def dump_to_dict(self):
+            # copies, the index keeps changing while the collections are refreshed
+            with self.lock:
+                return {
+                    "postings": {t: dict(p) for t, p in self.postings.items()},
+                    "docs": {doc: list(d) for doc, d in self.docs.items()},
+                    "synced": list(self.synced)
+                }
 
-        def __init__(self, e):
-            self.id_event = e["id"]
-            self.type = e["tipo"]
-            self.name = e["nome"]
-            self.description = e["descrizione"]
-            self.teacher = e["docente"]
-            self.notes = e["annotazioni"]
-            self.seen = e["visto"]
-            self.attachments = [Nuvola.File(i, self.__class__) for i in e["allegati"]]
-            self.video_link = e["linkVideo"]
-            self.background_color = e["coloreSfondo"]
-            self.text_color = e["coloreTesto"]
-            self.border_color = e["coloreBordo"]
-            self.id_notification = e["idNotifica"]
-            self.date_start = datetime.datetime.fromisoformat(
-                e["dataInizio"].replace("00:00:00", e["oraInizio"] + ":00"))
-            self.date_end = datetime.datetime.fromisoformat(
-                e["dataFine"].replace("00:00:00", e["oraFine"] + ":00"))
-            self.raw = e
+    class Irregularities(Collection):
+        """
+        Absences, delays and early exits. Their details need one request each, so they are fetched only when
+        needed, or all at once when prefetch_details is set, and kept until the irregularity changes.
+        """
+        NAME = "Irregularities"
+        CALL = "assenze"
+        DETAILS_CALL = "/api-studente/v1/assenza/{}"
 
-    class TimeWindow:
-        def __init__(self, parent, w, options, old_data=None):
+        def __init__(self, parent, options, old_data=None, fetch=True):
+            """
+            :param parent: Parent nuvola object
+            :param options: Options object
+            :param old_data: Data previously exported
+            :param fetch: Whether to load the irregularities now, when there is no data to import
+            :type parent: Nuvola
+            :type options: NuvolaOptions
+            :type old_data: dict
+            :type fetch: bool
+            """
             self.parent = parent
-            self.id_ = w["id"]
-            self.name = w["nome"]
-            self.current = w["corrente"]
-            self.raw = w
             self.options = options
+            self.data = []
+            self.index = Nuvola.Index({"date": lambda i: i.date},
+                                      {"type": lambda i: i.type, "justified": lambda i: bool(i.justified)},
+                                      {"id": lambda i: i.id})
+            self.details = {}
+            self.lock = threading.Lock()
             if type(old_data) is dict:
                 self.__init_from_dict(old_data)
                 return
             self.mod_time = datetime.datetime.fromtimestamp(0)
-            self.subjects = []
-            self.load()
+            if fetch:
+                self.load()
 
         def __init_from_dict(self, obj):
-            self.subjects = [self.Subject(self, i["raw"], i["marks"]) for i in obj["subjects"]]
+            for i in obj["data"]:
+                self.data.append(Nuvola.Irregularity(i, self))
+            self.index.build(self.data)
+            for i in obj["details"]:
+                self.details[i["id"]] = i["dettaglio"]
             self.mod_time = datetime.datetime.fromtimestamp(obj["mod_time"])
 
-        def load(self):
-            self.subjects = []
-            s = self.parent.get("frazione-temporale/{}/voti/materie".format(self.id_))
-            for i in s:
-                self.subjects.append(self.Subject(self, i))
+        def set(self, a):
+            """
+            :param a: Irregularities as returned by the api
+            :type a: list
+            """
+            old = {i.id: i.raw for i in self.data}
+            self.data = [Nuvola.Irregularity(i, self) for i in a]
+            self.index.build(self.data)
+            # cached details are kept for the irregularities which didn't change
+            with self.lock:
+                self.details = {i.id: self.details[i.id] for i in self.data
+                                if i.id in self.details and old.get(i.id) == i.raw}
             self.mod_time = datetime.datetime.now()
+            self.save()
 
-        def check_and_update(self, force=False):
-            if force or datetime.datetime.now() > self.mod_time + self.options.get("refresh_interval"):
-                self.parent.print(":: Fetch :: TimeWindow...", end="")
-                self.load()
-                self.parent.print(" OK")
-
-        def get_subject_by_name(self, name):
-            self.check_and_update()
-            for i in self.subjects:
-                if i.name == name:
-                    return i
-
-        def get_all_subjects(self):
-            self.check_and_update()
-            for i in self.subjects:
-                yield i
-
-        def get_subject_by_id(self, id_):
-            self.check_and_update()
-            for i in self.subjects:
-                if i.id_ == id_:
-                    return i
+        def load(self):
+            self.set(self.parent.get(self.CALL))
+            if self.options.get("irregularities")["prefetch_details"]:
+                self.fetch_details()
 
-        class Subject:
-            def __init__(self, parent, s, old_data=None):
-                self.parent = parent
-                self.id_ = s["id"]
-                self.name = s["materia"]
-                self.type = s["tipo"]
-                self.raw = s
-                if type(old_data) is list:
-                    self.__init_from_dict(old_data)
-                    return
-                self.marks = []
-                self.load()
+        def fetch_detail(self, id_):
+            d = self.parent.get_custom(self.DETAILS_CALL.format(id_))["dettaglio"]
+            with self.lock:
+                self.details[id_] = d
+            return d
 
-            def __init_from_dict(self, obj):
-                self.marks = [self.Mark(i, self) for i in obj]
+        def fetch_details(self, irregularities=None):
+            """
+            Fetches concurrently the details which aren't cached yet
 
-            def load(self):
-                self.marks = []
-                m = self.parent.parent.get(
-                    "frazione-temporale/{}/voti/materia/{}".format(self.parent.id_, self.id_))
-                for i in m[0]["voti"]:
-                    self.marks.append(self.Mark(i, self))
+            :param irregularities: Irregularities whose details are needed, default: all
+            :type irregularities: list[Nuvola.Irregularity]
+            """
+            missing = {i.id for i in (self.data if irregularities is None else irregularities)
+                       if i.id not in self.details}
+            Nuvola.map_concurrently(self.fetch_detail, missing, self.options.get("irregularities")["detail_workers"])
+            if missing:
+                self.save()
 
-            def get_all(self):
-                self.parent.check_and_update()
-                for i in self.marks:
-                    yield i
+        def get_details(self, id_):
+            d = self.details.get(id_)
+            self.parent.metrics.cache_access("irregularity_details", d is not None)
+            if d is None:
+                d = self.fetch_detail(id_)
+            return d
 
-            def get_by_teacher(self, teacher):
-                self.parent.check_and_update()
-                for i in self.marks:
-                    if i.teacher == teacher:
-                        yield i
+        def dump_to_dict(self):
+            with self.lock:
+                details = [{"id": k, "dettaglio": v} for k, v in self.details.items()]
+            return {
+                "mod_time": self.mod_time.timestamp(),
+                "data": [i.raw for i in self.data],
+                "details": details
+            }
 
-            def get_by_date(self, date, interval=datetime.timedelta(days=0)):
-                if type(date) is not datetime.date:
-                    raise TypeError(date)
-                self.parent.check_and_update()
-                for i in self.marks:
-                    if date <= i.date <= date + interval:
-                        yield i
+        def get_all(self):
+            self.update_if_expired()
+            for i in self.data:
+                yield i
 
-            def get_by_weight(self, min_, max_=1):
-                self.parent.check_and_update()
-                for i in self.marks:
-                    if min_ <= i.weight <= max_:
-                        yield i
+        def get_by_date(self, date, interval=datetime.timedelta(days=0)):
+            if type(date) is not datetime.date:
+                raise TypeError(date)
+            self.update_if_expired()
+            yield from self.index.range("date", date, date + interval)
 
-            def get_by_relevance(self):
-                self.parent.check_and_update()
-                for i in self.marks:
-                    if i.relevant:
-                        yield i
+        def get_by_type(self, type_):
+            """
+            :param type_: Nuvola.Irregularity.ABSENCE, DELAY or EXIT; DELAY and EXIT match delays with exit too
+            :type type_: int
+            """
+            self.update_if_expired()
+            for k in self.index.keys("type"):
+                if k == type_ or type_ and k & type_:
+                    yield from self.index.group("type", k)
 
-            def get_by_type(self, type_):
-                self.parent.check_and_update()
-                for i in self.marks:
-                    if i.type_ == type_:
-                        yield i
+        def get_by_justification(self, justified=True):
+            self.update_if_expired()
+            yield from self.index.group("justified", justified)
 
-            class Mark:
-                def __init__(self, m, parent):
-                    self.parent = parent
-                    self.subject = self.parent.name
-                    self.subject_id = self.parent.id_
-                    self.date = datetime.datetime.fromisoformat(m["data"]).date()
-                    self.teacher = m["docente"]
-                    self.type_ = m["tipologia"]
-                    self.mark_string = m["valutazione"]
-                    self.mark = float(m["valutazioneMatematica"])
-                    self.relevant = m["faMedia"]
-                    self.weight = int(m["peso"][:-1]) / 100
-                    self.description = m["descrizione"]
-                    self.name_objective = m["nomeObiettivo"]
-                    self.objectives = m["obiettivi"]
-                    self.raw = m
+        def get_by_id(self, id_):
+            self.update_if_expired()
+            return self.index.get("id", id_)
 
     class Irregularity:
         ABSENCE = 0
         DELAY = 1
         EXIT = 2
+        __slots__ = ("parent", "id", "type", "denomination", "shift", "lesson", "date", "justified", "raw")
 
         def __init__(self, a, parent):
+            """
+            :param a: Irregularity as returned by the api
+            :param parent: Collection which fetches and caches the details
+            :type parent: Nuvola.Irregularities
+            """
             self.parent = parent
             self.id = a["id"]
             self.type = {
@@ -733,115 +3548,219 @@ class Nuvola:
                 self.lesson = a["ora"]["numeroOra"]
             self.date = datetime.datetime.fromisoformat(a["data"]).date()
             self.justified = a["giustificata"]
-            details = self.__get_details()
-            self.details = details
-            self.shift = details["turno"]
-            self.timeEnter = details["orarioIngresso"]
-            if not self.timeEnter:
-                pass
             self.raw = a
 
-        def __get_details(self):
-            return self.parent.get_custom("/api-studente/v1/assenza/" + str(self.id))["dettaglio"]
+        @property
+        def details(self):
+            """
+            Details of the irregularity. With Nuvola they are fetched on first access and then cached; with
+            AsyncNuvola they are never fetched on access and are None until fetch_details() has been awaited
+            """
+            return self.parent.get_details(self.id)
+
+        @property
+        def timeEnter(self):
+            """
+            Entrance time, read from the details: with Nuvola they are fetched when missing, with AsyncNuvola it's
+            None until fetch_details() has been awaited
+            """
+            details = self.details
+            return None if details is None else details["orarioIngresso"]
+
+    class Topics(Collection):
+        NAME = "Topics"
+        TEXT_TYPE = "topic"
+        CALL = "argomento-lezione/elenco/{}/{}"
 
-    class Topics:
-        def __init__(self, parent, options, old_data=None):
+        def __init__(self, parent, options, old_data=None, fetch=True):
             self.parent = parent
             self.options = options
-            self.data = []
+            if self.parent.db is None:
+                self.index = Nuvola.Index({"date": lambda t: t.date},
+                                          {"teacher": lambda t: t.teacher, "subject": lambda t: t.subject,
+                                           "type": lambda t: t.type})
+                self.store = Nuvola.Store(lambda t: t.id_, "date", self.index)
+            else:
+                self.index = self.store = self.parent.db.table(
+                    "topics", lambda t: t.id_,
+                    {"date": lambda t: t.date, "teacher": lambda t: t.teacher, "subject": lambda t: t.subject,
+                     "type": lambda t: t.type},
+                    lambda t: {"lesson": t.raw, "class": t.class_, "class_id": t.class_id}, self.decode, "date")
+            self.scan_requests = 0
+            self.scanned_until, self.refresh_until = None, None
             if type(old_data) is dict:
                 self.__init_from_dict(old_data)
                 return
-            self.mod_time = datetime.datetime.fromtimestamp(0)
-            self.load()
+            if isinstance(old_data, Nuvola.Snapshot.Block):
+                self.__init_from_snapshot(old_data)
+                return
+            if not self.restore() and fetch:
+                self.load()
 
         def __init_from_dict(self, obj):
+            keep_raw, lazy = self.options.get("keep_raw"), self.options.get("lazy_records")
+            data = []
             for i in obj["data"]:
-                self.data.append(Nuvola.Topic(i["lesson"], i["lesson"]["argomenti"], i["class"], i["class_id"]))
+                hour = Nuvola.LessonHour(i["lesson"], i["class"], i["class_id"], keep_raw)
+                # older exports have one lesson hour for each topic, with the topic in place of the list
+                topics = i["lesson"]["argomenti"]
+                for j in [topics] if type(topics) is dict else topics:
+                    data.append(Nuvola.Topic(hour, j, keep_raw, lazy))
+            self.store.build(data)
             self.mod_time = datetime.datetime.fromtimestamp(obj["mod_time"])
+            self.save()
 
-        def load(self):
-            if self.data:
-                expired = list(self.get_by_date(
-                    datetime.date.today() - self.options.get("topics")["backwards_refresh_date"],
-                    self.options.get("topics")["backwards_refresh_date"], True))
-                for i in range(len(expired)):
-                    self.data.remove(expired[i])
+        def __init_from_snapshot(self, block):
+            self.store.build(block.records())
+            self.mod_time = block.mod_time
+            self.save()
+
+        @property
+        def data(self):
+            """
+            Topics, as a tuple: the collection itself is kept in store, so data is a copy which can't be changed in
+            place. Records are replaced by assigning to data, or through store.
+            """
+            return tuple(self.store)
+
+        @data.setter
+        def data(self, topics):
+            self.store.build(topics)
+
+        def decode(self, t):
+            """
+            :param t: Topic saved in the store, with its lesson hour
+            :type t: dict
+            :rtype: Nuvola.Topic
+            """
+            keep_raw = self.options.get("keep_raw")
+            return Nuvola.Topic(Nuvola.LessonHour(t["lesson"], t["class"], t["class_id"], keep_raw),
+                                t["lesson"]["argomenti"], keep_raw, self.options.get("lazy_records"))
+
+        def save(self):
+            # the records are written to the store while they are added
+            if self.parent.db is not None:
+                self.parent.db.set_mod_time(self.store_key(), self.mod_time)
+
+        def prepare_load(self):
+            """
+            Sets the range of dates to be refreshed
+
+            :return: Start date of the scan
+            :rtype: datetime.date
+            """
+            if len(self.store):
                 date_s = datetime.date.today() + datetime.timedelta(days=1) - self.options.get(
                     "topics")["backwards_refresh_date"]
+                self.refresh_until = datetime.date.today()
             else:
                 date_s = self.options.get("start_date") + datetime.timedelta(days=1)
-            date_e = date_s + datetime.timedelta(days=15)
-            empty_count = 0
+                self.refresh_until = None
+            self.scanned_until = None
+            return date_s
 
-            while True:
-                # for each iteration we ask nuvola homeworks in a period of time of 15 days
-                c = self.parent.get("argomento-lezione/elenco/{}/{}".format(
-                    date_s.strftime("%d-%m-%Y"), date_e.strftime("%d-%m-%Y")))
-                emp = True
-                for i in c:
-                    for j in i["ore"]:
-                        if j["argomenti"]:
-                            emp = False
-                            if len(j["argomenti"]) == 1:
-                                self.data.append(Nuvola.Topic(j, j["argomenti"][0], i["classe"], i["classeId"]))
-                            else:
-                                for k in range(len(j["argomenti"])):
-                                    self.data.append(Nuvola.Topic(j, j["argomenti"][k], i["classe"], i["classeId"]))
-                if emp:
-                    empty_count += 1
-                if empty_count >= self.options.get("topics")["max_empty_days"] / 15:
-                    break
-                date_s = date_e + datetime.timedelta(days=1)
-                date_e += datetime.timedelta(days=15)
+        def add(self, c, window):
+            """
+            :param c: Lessons of a window of the scan
+            :param window: Start and end date of the window
+            :type c: list
+            :type window: (datetime.date, datetime.date)
+            """
+            keep_raw, lazy = self.options.get("keep_raw"), self.options.get("lazy_records")
+            topics = []
+            for i in c:
+                for j in i["ore"]:
+                    if not j["argomenti"]:
+                        continue
+                    hour = Nuvola.LessonHour(j, i["classe"], i["classeId"], keep_raw)
+                    topics += [Nuvola.Topic(hour, k, keep_raw, lazy) for k in j["argomenti"]]
+            removed = self.store.replace_window(window[0], window[1], topics)
+            self.parent.text_index.update(self.TEXT_TYPE, removed, topics)
+            self.scanned_until = window[1]
+
+        def end_load(self, scan):
+            """
+            Deletes the topics of the refreshed range which are past the last window of the scan
+            """
+            if self.refresh_until is not None and self.scanned_until is not None and \
+                    self.scanned_until < self.refresh_until:
+                removed = self.store.delete_range(self.scanned_until + datetime.timedelta(days=1), self.refresh_until)
+            else:
+                removed = []
+            # requests sent by the last scan, to compare the scan strategies
+            self.scan_requests = scan.requests
             self.mod_time = datetime.datetime.now()
+            self.save()
+            self.parent.text_index.update(self.TEXT_TYPE, removed, mod_time=self.mod_time)
 
-        def check_and_update(self, force=False):
-            if force or datetime.datetime.now() > self.mod_time + self.options.get("refresh_interval"):
-                self.parent.print(":: Fetch :: Topics...", end="")
-                self.load()
-                self.parent.print(" OK")
+        @staticmethod
+        def is_empty(c):
+            return not any(j["argomenti"] for i in c for j in i["ore"])
+
+        @staticmethod
+        def count(c):
+            return sum(len(j["argomenti"]) for i in c for j in i["ore"])
+
+        def new_scan(self):
+            # we ask nuvola topics in periods of time of 15 days, or adaptive ones, empty windows are counted without
+            # being reset by the ones with topics
+            o = self.options.get("topics")
+            if o["adaptive_scan"]:
+                return self.parent.AdaptiveWindowScan(self.parent, self.CALL, self.prepare_load(), o["max_empty_days"],
+                                                      self.is_empty, False, count=self.count)
+            return self.parent.WindowScan(self.parent, self.CALL, self.prepare_load(), o["max_empty_days"],
+                                          self.is_empty, False, o["scan_workers"])
+
+        def load(self):
+            scan = self.new_scan()
+            for w, c in scan.run():
+                self.add(c, w)
+            self.end_load(scan)
 
         def get_all(self):
-            self.check_and_update()
-            for i in self.data:
+            self.update_if_expired()
+            for i in self.store:
                 yield i
 
         def get_by_date(self, date, interval=datetime.timedelta(days=0), skip_check=False):
             if type(date) is not datetime.date:
                 raise TypeError(date)
             if not skip_check:
-                self.check_and_update()
-            for i in self.data:
-                if date <= i.date <= date + interval:
-                    yield i
+                self.update_if_expired()
+            yield from self.index.range("date", date, date + interval)
 
         def get_by_teacher(self, teacher):
-            self.check_and_update()
-            for i in self.data:
-                if i.teacher == teacher:
-                    yield i
+            self.update_if_expired()
+            yield from self.index.group("teacher", teacher)
 
         def get_by_subject(self, subject, search=False):
-            self.check_and_update()
-            for i in self.data:
-                if i.subject == subject or search and subject in i.subject:
-                    yield i
+            self.update_if_expired()
+            # a search only scans the distinct subjects
+            for k in self.index.keys("subject") if search else [subject]:
+                if k == subject or search and subject in k:
+                    yield from self.index.group("subject", k)
 
         def get_by_type(self, type_):
-            self.check_and_update()
-            for i in self.data:
-                if not i.type == type_:
-                    yield i
+            self.update_if_expired()
+            yield from self.index.group("type", type_)
 
         def get_by_id(self, id_):
-            self.check_and_update()
-            for i in self.data:
-                if i.id_ == id_:
-                    return i
+            self.update_if_expired()
+            return self.store.get(id_)
 
-    class Topic:
-        def __init__(self, t, a, class_, class_id):
+    class LessonHour:
+        """
+        Lesson hour of a class, shared by the topics of the hour
+        """
+        __slots__ = ("class_", "class_id", "lesson", "time_start", "time_end", "date", "__raw")
+
+        def __init__(self, t, class_, class_id, keep_raw=True):
+            """
+            :param t: Lesson hour as returned by the api, its topics are ignored
+            :param keep_raw: Whether to keep the fields of t, otherwise raw is rebuilt from the fields when needed
+            :type t: dict
+            :type keep_raw: bool
+            """
             self.class_ = class_
             self.class_id = class_id
 
@@ -851,22 +3770,118 @@ class Nuvola:
             self.time_end = datetime.datetime.fromisoformat(
                 t["giorno"].replace("00:00:00", t["fineOra"] + ":00")).time()
             self.date = datetime.datetime.fromisoformat(t["giorno"]).date()
+            self.__raw = {k: v for k, v in t.items() if k != "argomenti"} if keep_raw else None
+
+        @property
+        def raw(self):
+            """
+            Lesson hour without its topics
+            """
+            if type(self.__raw) is memoryview:
+                self.__raw = json.loads(bytes(self.__raw))
+            if self.__raw is not None:
+                return self.__raw
+            return {
+                "numeroOra": self.lesson,
+                "giorno": self.date.isoformat() + "T00:00:00",
+                "inizioOra": self.time_start.strftime("%H:%M"),
+                "fineOra": self.time_end.strftime("%H:%M")
+            }
+
+    class Topic:
+        ATTACHMENT_LINK = "/api-studente/v1/alunno/{}/argomento-lezione/allegato/{}"
+        __slots__ = ("hour", "id_", "type", "subject", "_name", "_long_description", "_co_presence", "teacher",
+                     "_notes", "_attachments", "_youtube_link", "__raw")
+        name = LazyField(lambda a: a["nomeArgomento"], "raw_topic")
+        long_description = LazyField(lambda a: a["descrizioneEstesa"], "raw_topic")
+        co_presence = LazyField(lambda a: a["compresenza"], "raw_topic")
+        notes = LazyField(lambda a: a["annotazioni"], "raw_topic")
+        attachments = LazyField(lambda a: [Nuvola.File(i, Nuvola.Topic) for i in a["allegati"]], "raw_topic")
+        youtube_link = LazyField(lambda a: a["video_youtube"], "raw_topic")
+
+        def __init__(self, hour, a, keep_raw=True, lazy=False):
+            """
+            :param hour: Lesson hour of the topic, shared with the other topics of the hour
+            :param a: Topic as returned by the api
+            :param keep_raw: Whether to keep a, otherwise raw is rebuilt from the fields when needed
+            :param lazy: Whether to parse the fields which aren't indexed only when they are read, a is kept
+            :type hour: Nuvola.LessonHour
+            :type a: dict
+            :type keep_raw: bool
+            :type lazy: bool
+            """
+            self.hour = hour
 
             self.id_ = a["id"]
             self.type = a["tipo"]
             self.subject = a["materia"]
-            self.name = a["nomeArgomento"]
-            self.long_description = a["descrizioneEstesa"]
-            self.co_presence = a["compresenza"]
             self.teacher = a["docente"]
-            self.notes = a["annotazioni"]
-            self.attachments = [Nuvola.File(i, self.__class__) for i in a["allegati"]]
-            self.youtube_link = a["video_youtube"]
-            t_r = deepcopy(t)
-            t_r["argomenti"] = deepcopy(a)
-            self.raw = t_r
+            self.__raw = a if keep_raw or lazy else None
+            if lazy:
+                return
+            self._name = a["nomeArgomento"]
+            self._long_description = a["descrizioneEstesa"]
+            self._co_presence = a["compresenza"]
+            self._notes = a["annotazioni"]
+            self._attachments = [Nuvola.File(i, Nuvola.Topic) for i in a["allegati"]]
+            self._youtube_link = a["video_youtube"]
+
+        @property
+        def class_(self):
+            return self.hour.class_
+
+        @property
+        def class_id(self):
+            return self.hour.class_id
+
+        @property
+        def lesson(self):
+            return self.hour.lesson
+
+        @property
+        def time_start(self):
+            return self.hour.time_start
+
+        @property
+        def time_end(self):
+            return self.hour.time_end
+
+        @property
+        def date(self):
+            return self.hour.date
+
+        @property
+        def raw_topic(self):
+            """
+            Topic without its lesson hour
+            """
+            if type(self.__raw) is memoryview:
+                self.__raw = json.loads(bytes(self.__raw))
+            if self.__raw is not None:
+                return self.__raw
+            return {
+                "id": self.id_,
+                "tipo": self.type,
+                "materia": self.subject,
+                "nomeArgomento": self.name,
+                "descrizioneEstesa": self.long_description,
+                "compresenza": self.co_presence,
+                "docente": self.teacher,
+                "annotazioni": self.notes,
+                "allegati": [i.raw for i in self.attachments],
+                "video_youtube": self.youtube_link
+            }
+
+        @property
+        def raw(self):
+            """
+            Lesson hour with this topic only, built on access
+            """
+            return dict(self.hour.raw, argomenti=self.raw_topic)
 
     class File:
+        __slots__ = ("parent", "id_", "name", "mime_type")
+
         def __init__(self, f, parent, old_data=None):
             if type(old_data) is dict:
                 self.__init_from_dict(old_data)
@@ -880,62 +3895,415 @@ class Nuvola:
             for i in obj:
                 self.__setattr__(i, obj[i])
 
+        @property
+        def raw(self):
+            return {
+                "id": self.id_,
+                "nome": self.name,
+                "mimeType": self.mime_type
+            }
+
+    class Snapshot:
+        """
+        Binary export of the collections. The fields of the records are saved already parsed (dates as ordinals,
+        times as seconds, marks as floats, ...) in one block per column, so that an import parses no dates and no
+        json, and the api payloads are decoded only when the raw of a record is read. Snapshot files are opened
+        through mmap and each collection is decoded only when it's imported, which, with the lazy option, happens
+        when the collection is first accessed.
+
+        Files are replaced, never rewritten in place, so a snapshot being written doesn't change the ones already
+        mapped. close() decodes the payloads still kept in the map, then unmaps it: collections which haven't been
+        imported yet can't be imported after it.
+
+        Layout: MAGIC, format version and header length (uint32), json header, columns aligned to 8 bytes, whose
+        offsets are relative to the end of the aligned header.
+        """
+        MAGIC = b"NUVOLASN"
+        FORMAT = 1
+        EPOCH = datetime.datetime(1970, 1, 1)
+        # utc offset of naive datetimes
+        NAIVE = -(1 << 62)
+        # column kinds: i int, f float, d date, h time, t datetime, s string, j json, r payloads decoded on access
+        NUMERIC = {"i": "q", "f": "d", "d": "q", "h": "q", "t": "q"}
+        COLUMNS = {
+            "homeworks": (("id_", "j"), ("teacher", "s"), ("subject", "s"), ("attachments", "j"), ("class_", "s"),
+                          ("class_id", "j"), ("date_assigned", "d"), ("date_expired", "d"), ("description", "s")),
+            "events": (("id_event", "j"), ("type", "s"), ("name", "s"), ("description", "s"), ("teacher", "s"),
+                       ("notes", "s"), ("seen", "j"), ("attachments", "j"), ("video_link", "s"),
+                       ("background_color", "s"), ("text_color", "s"), ("border_color", "s"),
+                       ("id_notification", "j"), ("date_start", "t"), ("date_end", "t")),
+            "hours": (("class_", "s"), ("class_id", "j"), ("lesson", "j"), ("time_start", "h"), ("time_end", "h"),
+                      ("date", "d")),
+            "topics": (("hour", "i"), ("id_", "j"), ("type", "s"), ("subject", "s"), ("name", "s"),
+                       ("long_description", "s"), ("co_presence", "j"), ("teacher", "s"), ("notes", "s"),
+                       ("attachments", "j"), ("youtube_link", "s")),
+            "marks": (("time_window", "i"), ("subject", "i"), ("date", "d"), ("teacher", "s"), ("type_", "s"),
+                      ("mark_string", "s"), ("mark", "f"), ("relevant", "j"), ("weight", "f"),
+                      ("description", "s"), ("name_objective", "s"), ("objectives", "j"))
+        }
+
+        def __init__(self, buffer):
+            """
+            :param buffer: Content of a snapshot file
+            :type buffer: bytes | mmap.mmap
+            """
+            self.map = buffer if isinstance(buffer, mmap.mmap) else None
+            self.buffer = memoryview(buffer)
+            # (class, records) built with payloads which are still memoryviews of buffer
+            self.mapped = []
+            if bytes(self.buffer[:len(self.MAGIC)]) != self.MAGIC:
+                raise Nuvola.UnsupportedSnapshotException("Not a nuvola snapshot")
+            format_, length = struct.unpack_from("<II", self.buffer, len(self.MAGIC))
+            if format_ != self.FORMAT:
+                raise Nuvola.UnsupportedSnapshotException(f"Unsupported snapshot format: {format_}")
+            start = len(self.MAGIC) + 8
+            self.header = json.loads(bytes(self.buffer[start:start + length]))
+            self.base = start + length + (-(start + length) % 8)
+            self.version = self.header["version"]
+            self.swap = self.header["byteorder"] != sys.byteorder
+
+        @classmethod
+        def open(cls, path):
+            """
+            Maps a snapshot file in memory, its columns are read only when they are imported
+
+            :type path: str
+            :rtype: Nuvola.Snapshot
+            """
+            with open(path, "rb") as f:
+                return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+        def close(self):
+            """
+            Decodes the payloads of the imported records which are still in the map, and unmaps the file
+            """
+            for cls, records in self.mapped:
+                name = f"_{cls.__name__}__raw"
+                for r in records:
+                    v = getattr(r, name)
+                    if type(v) is memoryview:
+                        setattr(r, name, json.loads(bytes(v)))
+                        v.release()
+            self.mapped = []
+            self.buffer.release()
+            if self.map is not None:
+                self.map.close()
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *_):
+            self.close()
+
+        def blocks(self):
+            """
+            Collections of the snapshot, in the format accepted as old_data
+
+            :rtype: dict
+            """
+            return {
+                "homeworks": self.Block(self, "homeworks"),
+                "events": self.Block(self, "events"),
+                "topics": self.Block(self, "topics"),
+                "timeWindows": self.Block(self, "timeWindows"),
+                "irregularities": self.header["irregularities"],
+                "version": self.version
+            }
+
+        def numbers(self, kind, offset, length):
+            a = array(self.NUMERIC[kind])
+            a.frombytes(self.buffer[self.base + offset:self.base + offset + length])
+            if self.swap:
+                a.byteswap()
+            return a
+
+        def column(self, c):
+            """
+            Decodes a column of the header, payloads are left as memoryviews
+
+            :rtype: list
+            """
+            kind = c[0]
+            if kind == "d":
+                return [datetime.date.fromordinal(i) for i in self.numbers(kind, c[1], c[2])]
+            if kind == "h":
+                return [datetime.time(i // 3600, i // 60 % 60, i % 60) for i in self.numbers(kind, c[1], c[2])]
+            if kind == "t":
+                return [self.EPOCH + datetime.timedelta(microseconds=i) if o == self.NAIVE else
+                        (self.EPOCH + datetime.timedelta(microseconds=i)).replace(
+                            tzinfo=datetime.timezone(datetime.timedelta(seconds=o)))
+                        for i, o in zip(self.numbers(kind, c[1], c[2]), self.numbers(kind, c[3], c[4]))]
+            if kind in self.NUMERIC:
+                return self.numbers(kind, c[1], c[2]).tolist()
+            if kind == "r":
+                offsets = self.numbers("i", c[1], c[2])
+                blob = self.buffer[self.base + c[3]:self.base + c[3] + c[4]]
+                return [blob[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
+            # strings and json values of a column are one json array, decoded by a single call
+            return json.loads(bytes(self.buffer[self.base + c[1]:self.base + c[1] + c[2]]))
+
+        def table(self, name):
+            """
+            :return: Decoded columns of a table, by field, with the payloads in "raw"
+            :rtype: dict
+            """
+            t = self.header["tables"][name]
+            columns = {k: self.column(v) for k, v in t["columns"].items()}
+            columns["raw"] = self.column(t["raw"]) if "raw" in t else [None] * t["count"]
+            return columns
+
+        def build(self, cls, fields, columns):
+            """
+            Creates records from decoded columns, without parsing them again through __init__
+
+            :param cls: Slotted record class, whose payload is kept in __raw
+            :param fields: Fields to be set from the columns of the same name
+            :rtype: list
+            """
+            names = list(fields) + [f"_{cls.__name__}__raw"]
+            records = []
+            for row in zip(*(columns[i] for i in fields), columns["raw"]):
+                r = object.__new__(cls)
+                for n, v in zip(names, row):
+                    setattr(r, n, v)
+                records.append(r)
+            if any(type(i) is memoryview for i in columns["raw"]):
+                self.mapped.append((cls, records))
+            return records
+
+        class Block:
+            """
+            Collection of a snapshot, decoded when it's imported
+            """
+            def __init__(self, snapshot, name):
+                """
+                :type snapshot: Nuvola.Snapshot
+                :type name: str
+                """
+                self.snapshot = snapshot
+                self.name = name
+                self.mod_time = datetime.datetime.fromtimestamp(snapshot.header["mod_times"].get(name, 0))
+
+            def table(self, name, cls):
+                s = self.snapshot
+                c = s.table(name)
+                if "attachments" in c:
+                    c["attachments"] = [[Nuvola.File(i, cls) for i in a] for a in c["attachments"]]
+                return c
+
+            def fields(self, name):
+                return [i for i, _ in self.snapshot.COLUMNS[name]]
+
+            def records(self):
+                """
+                :return: Homeworks, Events or Topics of the block
+                :rtype: list
+                """
+                build = self.snapshot.build
+                if self.name == "homeworks":
+                    return build(Nuvola.Homework, self.fields("homeworks"), self.table("homeworks", Nuvola.Homework))
+                if self.name == "events":
+                    return build(Nuvola.Event, self.fields("events"), self.table("events", Nuvola.Event))
+                if self.name == "topics":
+                    hours = build(Nuvola.LessonHour, self.fields("hours"), self.table("hours", Nuvola.LessonHour))
+                    c = self.table("topics", Nuvola.Topic)
+                    c["hour"] = [hours[i] for i in c["hour"]]
+                    return build(Nuvola.Topic, self.fields("topics"), c)
+                raise ValueError(self.name)
+
+            def time_windows(self, parent):
+                """
+                :param parent: Nuvola object importing the snapshot
+                :type parent: Nuvola
+                :rtype: list[Nuvola.TimeWindow]
+                """
+                time_windows = [parent.TimeWindow(parent, i["raw"], parent.options, {
+                    "mod_time": i["mod_time"],
+                    "subjects": [{"raw": j, "marks": []} for j in i["subjects"]]
+                }) for i in self.snapshot.header["timeWindows"]]
+                c = self.table("marks", None)
+                c["parent"] = [time_windows[tw].subjects[s] for tw, s in zip(c["time_window"], c["subject"])]
+                c["subject"] = [i.name for i in c["parent"]]
+                c["subject_id"] = [i.id_ for i in c["parent"]]
+                marks = {}
+                for m in self.snapshot.build(Nuvola.TimeWindow.Subject.Mark,
+                                             ["parent", "subject", "subject_id"] + self.fields("marks")[2:], c):
+                    marks.setdefault(id(m.parent), []).append(m)
+                for tw in time_windows:
+                    for s in tw.subjects:
+                        s.set_marks(marks.get(id(s), []))
+                return time_windows
+
+        @classmethod
+        def write(cls, nuvola, path):
+            """
+            Writes the collections currently loaded, without refreshing them
+
+            :param nuvola: Nuvola object to be exported
+            :param path: Path of the snapshot file
+            :type nuvola: Nuvola
+            :type path: str
+            """
+            topics = list(nuvola.topics.data)
+            hours = {}
+            for t in topics:
+                hours.setdefault(id(t.hour), (len(hours), t.hour))
+            subjects = {id(s): (i, j) for i, tw in enumerate(nuvola.time_windows) for j, s in enumerate(tw.subjects)}
+            # table: (records, payload of a record)
+            tables = {
+                "homeworks": (list(nuvola.homeworks.data), lambda h: h.raw),
+                "events": (list(nuvola.events.data), lambda e: e.raw),
+                "hours": ([h for _, h in hours.values()], lambda h: h.raw),
+                "topics": (topics, lambda t: t.raw_topic),
+                "marks": ([m for tw in nuvola.time_windows for s in tw.subjects for m in s.marks], lambda m: m.raw)
+            }
+            # fields which aren't saved as they are
+            attachments = lambda r: [a.raw for a in r.attachments]
+            getters = {
+                ("homeworks", "attachments"): attachments,
+                ("events", "attachments"): attachments,
+                ("topics", "attachments"): attachments,
+                ("topics", "hour"): lambda t: hours[id(t.hour)][0],
+                ("marks", "time_window"): lambda m: subjects[id(m.parent)][0],
+                ("marks", "subject"): lambda m: subjects[id(m.parent)][1]
+            }
+            header = {
+                "version": VERSION,
+                "byteorder": sys.byteorder,
+                "mod_times": {
+                    "homeworks": nuvola.homeworks.mod_time.timestamp(),
+                    "events": nuvola.events.mod_time.timestamp(),
+                    "topics": nuvola.topics.mod_time.timestamp()
+                },
+                "timeWindows": [{"mod_time": tw.mod_time.timestamp(), "raw": tw.raw,
+                                 "subjects": [s.raw for s in tw.subjects]} for tw in nuvola.time_windows],
+                "irregularities": nuvola.irregularities.dump_to_dict(),
+                "tables": {}
+            }
+            body = bytearray()
+
+            def put(data):
+                offset = len(body)
+                body.extend(data)
+                body.extend(b"\0" * (-len(body) % 8))
+                return [offset, len(data)]
+
+            def put_numbers(kind, values):
+                return put(array(cls.NUMERIC[kind], values).tobytes())
+
+            def put_blobs(values):
+                offsets, blob = [0], bytearray()
+                for v in values:
+                    blob.extend(v)
+                    offsets.append(len(blob))
+                return put_numbers("i", offsets) + put(blob)
+
+            for name, (records, raw) in tables.items():
+                columns = {}
+                for field, kind in cls.COLUMNS[name]:
+                    get = getters.get((name, field), lambda r, f=field: getattr(r, f))
+                    values = [get(r) for r in records]
+                    if kind in ("s", "j"):
+                        columns[field] = [kind] + put(json.dumps(values).encode())
+                    elif kind == "d":
+                        columns[field] = ["d"] + put_numbers("d", [v.toordinal() for v in values])
+                    elif kind == "h":
+                        columns[field] = ["h"] + put_numbers("h", [v.hour * 3600 + v.minute * 60 + v.second
+                                                                   for v in values])
+                    elif kind == "t":
+                        columns[field] = ["t"] + put_numbers("t", [
+                            (v.replace(tzinfo=None) - cls.EPOCH) // datetime.timedelta(microseconds=1)
+                            for v in values]) + put_numbers("t", [
+                                cls.NAIVE if v.utcoffset() is None else int(v.utcoffset().total_seconds())
+                                for v in values])
+                    else:
+                        columns[field] = [kind] + put_numbers(kind, values)
+                header["tables"][name] = {"count": len(records), "columns": columns}
+                if nuvola.options.get("keep_raw"):
+                    header["tables"][name]["raw"] = ["r"] + put_blobs(json.dumps(raw(r)).encode() for r in records)
+
+            h = json.dumps(header).encode()
+            # the file is written to a temporary one which replaces it, the old file stays valid for the processes
+            # which have it mapped
+            fd, tmp = mkstemp(dir=os.path.dirname(path) or ".", prefix=f".{os.path.basename(path)}.")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(cls.MAGIC)
+                    f.write(struct.pack("<II", cls.FORMAT, len(h)))
+                    f.write(h)
+                    f.write(b"\0" * (-(len(cls.MAGIC) + 8 + len(h)) % 8))
+                    f.write(body)
+                os.replace(tmp, path)
+            except BaseException:
+                os.unlink(tmp)
+                raise
+
     def dump_to_dict(self, update_first=False):
         self.homeworks.check_and_update(update_first)
         self.events.check_and_update(update_first)
         for i in self.get_time_windows():
             i.check_and_update(update_first)
         self.topics.check_and_update(update_first)
+        self.irregularities.check_and_update(update_first)
+        return self.export()
+
+    def dump_to_snapshot(self, path, update_first=False):
+        """
+        Writes a binary snapshot, which can be imported with Nuvola(options, Nuvola.Snapshot.open(path))
+
+        :param path: Path of the snapshot file
+        :param update_first: Whether to refresh every collection before
+        :type path: str
+        :type update_first: bool
+        """
+        self.check_and_update_all(update_first)
+        self.Snapshot.write(self, path)
+
+    def export(self):
+        """
+        Exports the data currently loaded, without refreshing it
 
+        :rtype: dict
+        """
         output = {
             "homeworks": {
                 "mod_time": self.homeworks.mod_time.timestamp(),
                 "data": []
             },
-            "events": {
-                "mod_time": self.events.mod_time.timestamp(),
-                "data": []
-            },
+            "events": self.events.dump_to_dict(),
             "topics": {
                 "mod_time": self.topics.mod_time.timestamp(),
                 "data": []
             },
             "timeWindows": [],
+            "irregularities": self.irregularities.dump_to_dict(),
             "version": VERSION
         }
 
         # homeworks
-        for h in self.homeworks.get_all():
+        for h in self.homeworks.data:
             output["homeworks"]["data"].append(h.raw)
 
-        # events
-        for e in self.events.get_all():
-            output["events"]["data"].append(e.raw)
-
         # timeWindow
         for tw in self.time_windows:
-            t_tw = {
-                "mod_time": tw.mod_time.timestamp(),
-                "raw": tw.raw,
-                "subjects": []
-            }
-            for s in tw.get_all_subjects():
-                t_s = {
-                    "raw": s.raw,
-                    "marks": []
+            output["timeWindows"].append(tw.dump_to_dict())
+
+        # topics, each lesson hour is dumped once with the list of its topics
+        hours = {}
+        for t in self.topics.data:
+            h = hours.get(id(t.hour))
+            if h is None:
+                h = hours[id(t.hour)] = {
+                    "lesson": dict(t.hour.raw, argomenti=[]),
+                    "class": t.class_,
+                    "class_id": t.class_id
                 }
-                for m in s.marks:
-                    t_s["marks"].append(m.raw)
-                t_tw["subjects"].append(t_s)
-            output["timeWindows"].append(t_tw)
-
-        # topics
-        for t in self.topics.get_all():
-            output["topics"]["data"].append({
-                "lesson": t.raw,
-                "class": t.class_,
-                "class_id": t.class_id
-            })
+                output["topics"]["data"].append(h)
+            h["lesson"]["argomenti"].append(t.raw_topic)
+
+        # the text index is exported only when it has been built, so that it's not built again by the import
+        if self.text_index.synced:
+            output["textIndex"] = self.text_index.dump_to_dict()
         return output
 
     class IncompatibleTimeWindowException(Exception):
@@ -949,3 +4317,6 @@ class Nuvola:
 
     class AmbiguousIDException(Exception):
         pass
+
+    class UnsupportedSnapshotException(Exception):
+        pass
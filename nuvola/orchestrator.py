@@ -0,0 +1,218 @@
+import datetime
+import heapq
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from .nuvola import Nuvola, NuvolaOptions
+
+
+class NuvolaOrchestrator:
+    """
+    Keeps many accounts in sync from one scheduler.
+
+    Every account is refreshed once per interval, in its own slot: slots are spread evenly over the interval, so
+    that the refreshes of the accounts don't all happen at the same time. A refresh updates the collections loaded
+    before its slot, the ones refreshed by the getters since then are skipped. Refreshes are run by a bounded pool
+    of workers and every account sends its requests through the same pooled session, which keeps no cookies.
+
+    Usage:
+        orchestrator = NuvolaOrchestrator(workers=8)
+        orchestrator.add("student", options)
+        orchestrator.start()
+        homeworks = orchestrator.get("student").homeworks
+    """
+    def __init__(self, interval=datetime.timedelta(hours=6), workers=8, connection=None):
+        """
+        :param interval: Time between two refreshes of the same account
+        :param workers: Maximum number of accounts refreshed at the same time
+        :param connection: Options of the shared session, as the "connection" group of NuvolaOptions; by default
+            the pool holds one connection for each worker
+        :type interval: datetime.timedelta
+        :type workers: int
+        :type connection: dict
+        """
+        self.interval = interval
+        self.workers = workers
+        c = dict(NuvolaOptions().get("connection"))
+        c["pool_size"] = workers
+        c.update(connection or {})
+        self.session = Nuvola.Connection.make_session(c)
+        self.executor = ThreadPoolExecutor(workers)
+        self.accounts = {}
+        # (due, sequence, name), the sequence breaks ties
+        self.queue = []
+        self.sequence = 0
+        self.condition = threading.Condition()
+        self.thread = None
+        self.running = False
+        self.anchor = datetime.datetime.now()
+
+    class Account:
+        def __init__(self, name, options, old_data=None):
+            self.name = name
+            self.options = options
+            self.old_data = old_data
+            self.nuvola = None
+            self.ready = threading.Event()
+            self.slot = datetime.timedelta(0)
+            self.due = None
+            self.last_sync = None
+            self.last_delay = None
+            self.running = False
+            self.errors = 0
+            self.last_error = None
+
+    def add(self, name, options, old_data=None):
+        """
+        Adds an account, which is loaded by the workers as soon as possible
+
+        :param name: Name of the account in the orchestrator
+        :param options: Options of the account
+        :param old_data: Data previously exported by the account
+        :type name: str
+        :type options: NuvolaOptions
+        """
+        with self.condition:
+            if name in self.accounts:
+                raise KeyError(f"Account \"{name}\" already added")
+            a = self.Account(name, options, old_data)
+            self.accounts[name] = a
+            self.__spread()
+            self.__schedule(a, datetime.datetime.now())
+
+    def remove(self, name):
+        """
+        Removes an account and closes its connection, after its running refresh, if any
+        """
+        with self.condition:
+            a = self.accounts.pop(name)
+            self.__spread()
+            while a.running:
+                self.condition.wait()
+        if a.nuvola is not None:
+            a.nuvola.close()
+
+    def __spread(self):
+        # slots are assigned in insertion order, evenly spaced over the interval, and the accounts already loaded
+        # are moved to their new slot
+        now = datetime.datetime.now()
+        for i, a in enumerate(self.accounts.values()):
+            a.slot = self.interval * i / len(self.accounts)
+            if a.nuvola is not None and not a.running:
+                self.__schedule(a, self.__next_due(a, now))
+
+    def __next_due(self, a, after):
+        """
+        First time after `after` which falls in the slot of the account
+        """
+        periods = (after - self.anchor - a.slot) // self.interval + 1
+        return self.anchor + a.slot + self.interval * max(periods, 0)
+
+    def __schedule(self, a, due):
+        a.due = due
+        self.sequence += 1
+        heapq.heappush(self.queue, (due, self.sequence, a.name))
+        self.condition.notify()
+
+    def start(self):
+        """
+        Starts the scheduler thread
+        """
+        with self.condition:
+            if self.running:
+                return
+            self.running = True
+        self.thread = threading.Thread(target=self.__run, name="nuvola-orchestrator", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stops the scheduler, waits for the running refreshes and closes every account
+        """
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        if self.thread is not None:
+            self.thread.join()
+        self.executor.shutdown(wait=True)
+        for a in self.accounts.values():
+            if a.nuvola is not None:
+                a.nuvola.close()
+        self.session.close()
+
+    def __run(self):
+        while True:
+            with self.condition:
+                while self.running:
+                    now = datetime.datetime.now()
+                    if self.queue and self.queue[0][0] <= now:
+                        break
+                    timeout = (self.queue[0][0] - now).total_seconds() if self.queue else None
+                    self.condition.wait(timeout)
+                if not self.running:
+                    return
+                due, _, name = heapq.heappop(self.queue)
+                a = self.accounts.get(name)
+                # entries of removed or rescheduled accounts are skipped
+                if a is None or a.due != due or a.running:
+                    continue
+                a.running = True
+            self.executor.submit(self.__sync, a)
+
+    def __sync(self, a):
+        start = datetime.datetime.now()
+        try:
+            if a.nuvola is None:
+                a.nuvola = Nuvola(a.options, a.old_data, self.session)
+                a.old_data = None
+                a.ready.set()
+            else:
+                # interactive reads of the account go first, the collections the getters already refreshed since
+                # the slot came due are skipped
+                a.nuvola.conn.set_priority(a.nuvola.conn.BACKGROUND)
+                a.nuvola.check_and_update_all(before=a.due)
+            n = a.nuvola
+            # the oldest data of the account, not the time this refresh ran
+            a.last_sync = min(i.mod_time for i in (n.homeworks, n.events, n.topics, n.irregularities, *n.time_windows))
+        except Exception as e:
+            a.errors += 1
+            a.last_error = e
+        finally:
+            a.last_delay = start - a.due
+            with self.condition:
+                a.running = False
+                if self.accounts.get(a.name) is a:
+                    self.__schedule(a, self.__next_due(a, datetime.datetime.now()))
+                # remove() may be waiting for the refresh
+                self.condition.notify_all()
+
+    def get(self, name, timeout=None):
+        """
+        Waits until the account has been loaded
+
+        :param name: Name of the account
+        :param timeout: Seconds to wait, by default there is no limit
+        :rtype: Nuvola
+        """
+        a = self.accounts[name]
+        if not a.ready.wait(timeout):
+            raise TimeoutError(f"Account \"{name}\" not loaded yet")
+        return a.nuvola
+
+    def sync_lag(self):
+        """
+        Per account sync status: "last_sync" is when the oldest collection of the account was loaded and "lag" the
+        time since then (None before the account is loaded), "delay" is how late the last refresh started after its
+        slot, because every worker was busy.
+
+        :rtype: dict
+        """
+        now = datetime.datetime.now()
+        with self.condition:
+            return {a.name: {
+                "last_sync": a.last_sync,
+                "lag": None if a.last_sync is None else now - a.last_sync,
+                "delay": a.last_delay,
+                "next_sync": a.due,
+                "errors": a.errors,
+                "last_error": a.last_error
+            } for a in self.accounts.values()}
@@ -1,6 +1,6 @@
 import setuptools
 
-VERSION = "1.4"
+VERSION = "1.5"
 
 with open("README.md") as f:
     LONGDESCRIPTION = f.read()
@@ -23,7 +23,12 @@ setuptools.setup(
     install_requires=[
         "bs4",
         "requests",
+        "urllib3",
         "datetime",
         "simplejson"
-    ]
+    ],
+    extras_require={
+        "async": ["httpx"],
+        "analytics": ["numpy"]
+    }
 )
@@ -0,0 +1,34 @@
+"""
+Fixtures of the tests: a MockNuvola serving a register which spans today, and the options of a Nuvola using it.
+"""
+import datetime
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+from mock_server import MockNuvola  # noqa: E402
+from synthetic import SchoolYears  # noqa: E402
+from nuvola import NuvolaOptions  # noqa: E402
+
+
+@pytest.fixture
+def server():
+    # the register started a few months ago, so that the refreshes find records in the days they scan again
+    data = SchoolYears(subjects=4, marks_per_subject=5, start=datetime.date.today() - datetime.timedelta(days=90))
+    with MockNuvola(data) as s:
+        yield s
+
+
+@pytest.fixture
+def options(server):
+    o = NuvolaOptions()
+    o.set("base_url", server.url)
+    o.set("use_token_files", False)
+    o.set("student_id", 1)
+    o.set("start_date", server.data.start - datetime.timedelta(days=1))
+    return o
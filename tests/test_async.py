@@ -0,0 +1,53 @@
+import asyncio
+
+import requests
+
+from nuvola import AsyncNuvola
+
+
+class Client:
+    """
+    Async client sending the requests with requests in the executor, the first `throttled` ones are answered 429
+    """
+    class Throttled:
+        status_code = 429
+        headers = {"Retry-After": "0.01"}
+        text = ""
+
+    def __init__(self):
+        self.session = requests.Session()
+        self.throttled = 0
+
+    async def get(self, url, headers):
+        if self.throttled:
+            self.throttled -= 1
+            return self.Throttled()
+        return await asyncio.get_running_loop().run_in_executor(
+            None, lambda: self.session.get(url, headers=headers))
+
+
+def test_rate_limiter_and_backoff(server, options):
+    options.set("rate_limit", {"max_concurrency": 1})
+
+    async def main():
+        client = Client()
+        n = await AsyncNuvola.create(options, client=client)
+        events = []
+        n.metrics.add_hook(lambda e: events.append(e))
+        limiter = n.conn.limiter(server.url)
+        # the only slot is taken while the requests line up, background requests first
+        await limiter.acquire(n.conn.INTERACTIVE)
+        tasks = [asyncio.ensure_future(n.get("eventi-classe", n.conn.BACKGROUND)) for _ in range(3)]
+        tasks += [asyncio.ensure_future(n.get("assenze")) for _ in range(3)]
+        while len(limiter.waiting) < len(tasks):
+            await asyncio.sleep(0.001)
+        await limiter.release()
+        await asyncio.gather(*tasks)
+        assert ["assenze" in e["endpoint"] for e in events if e["type"] == "request"] == [True] * 3 + [False] * 3
+        events.clear()
+        client.throttled = 2
+        await n.get("assenze")
+        assert [e["type"] for e in events if e["type"] in ("request", "retry")] == ["retry", "retry", "request"]
+        await n.close()
+
+    asyncio.run(main())
@@ -0,0 +1,57 @@
+import datetime
+import threading
+import time
+
+from nuvola import Nuvola
+
+
+def test_rate_limiter_priority(server, options):
+    options.set("lazy", True)
+    options.set("rate_limit", {"max_concurrency": 1})
+    n = Nuvola(options)
+    order = []
+    n.metrics.add_hook(lambda e: e["type"] == "request" and order.append(e["endpoint"]))
+    limiter = n.conn.limiter(server.url)
+    # the only slot is taken while the requests line up
+    limiter.acquire(n.conn.INTERACTIVE)
+    url = f"{server.url}/api-studente/v1/alunno/1/"
+    threads = [threading.Thread(target=n.conn.get_data, args=(url + "eventi-classe", n.conn.BACKGROUND))
+               for _ in range(3)]
+    threads += [threading.Thread(target=n.conn.get_data, args=(url + "assenze", n.conn.INTERACTIVE))
+                for _ in range(3)]
+    for t in threads:
+        t.start()
+        # in order of arrival: background requests first
+        while len(limiter.waiting) < threads.index(t) + 1:
+            time.sleep(0.001)
+    limiter.release()
+    for t in threads:
+        t.join()
+    assert ["assenze" in i for i in order] == [True] * 3 + [False] * 3
+    n.close()
+
+
+def test_single_flight_token_refresh(server, options):
+    options.set("lazy", True)
+    # the tokens of the mock live less than the margin
+    options.set("connection", {"token_refresh_margin": server.TOKEN_LIFETIME * 2})
+    n = Nuvola(options)
+    # as if the token was read from the token files, so that it's refreshed by the next request
+    n.conn.u_token_time = None
+    refreshes = n.metrics.token_refreshes
+    barrier = threading.Barrier(8)
+    url = f"{server.url}/api-studente/v1/alunno/1/eventi-classe"
+
+    def get():
+        barrier.wait()
+        n.conn.get_data(url)
+        n.conn.get_data(url)
+
+    threads = [threading.Thread(target=get) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert n.metrics.token_refreshes - refreshes == 1
+    assert n.conn.token_expiry(n.conn.u_token) > datetime.datetime.now()
+    n.close()
@@ -0,0 +1,34 @@
+import json
+import os
+
+from nuvola import Nuvola
+
+
+def scans(server):
+    return {k: v for k, v in server.requests.items() if "elenco" in k or "voti" in k or "eventi" in k}
+
+
+def test_dict_round_trip(server, options):
+    n = Nuvola(options)
+    exported = json.loads(json.dumps(n.dump_to_dict()))
+    requests = scans(server)
+    m = Nuvola(options, exported)
+    # nothing is fetched again
+    assert scans(server) == requests
+    assert json.loads(json.dumps(m.dump_to_dict())) == exported
+    n.close()
+    m.close()
+
+
+def test_snapshot_round_trip(server, options, tmp_path):
+    path = os.path.join(tmp_path, "register.nvs")
+    n = Nuvola(options)
+    n.dump_to_snapshot(path)
+    requests = scans(server)
+    snapshot = Nuvola.Snapshot.open(path)
+    m = Nuvola(options, snapshot)
+    assert scans(server) == requests
+    assert json.loads(json.dumps(m.dump_to_dict())) == json.loads(json.dumps(n.dump_to_dict()))
+    snapshot.close()
+    n.close()
+    m.close()
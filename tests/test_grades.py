@@ -0,0 +1,68 @@
+import pytest
+
+from nuvola import Nuvola
+
+
+def brute_force(marks):
+    marks = [m for m in marks if m.relevant]
+    weight = sum(m.weight for m in marks)
+    return {
+        "average": pytest.approx(sum(m.mark * m.weight for m in marks) / weight) if weight else None,
+        "count": len(marks),
+        "min": min((m.mark for m in marks), default=None),
+        "max": max((m.mark for m in marks), default=None),
+        "last_date": max((m.date for m in marks), default=None)
+    }
+
+
+def totals(aggregate):
+    return {i: getattr(aggregate, i) for i in ("average", "count", "min", "max", "last_date")}
+
+
+def check(n):
+    for tw in n.get_time_windows():
+        for s in tw.subjects:
+            assert totals(s.aggregate) == brute_force(list(s.get_all()))
+        assert totals(tw.aggregate) == brute_force([m for s in tw.subjects for m in s.get_all()])
+
+
+def change_marks(data):
+    """
+    Edits, excludes, deletes and adds marks, empties a subject and adds a new one
+    """
+    student = data.student(1)
+    marks = student["marks"]
+    first = marks[1, 0]
+    first[0]["valutazioneMatematica"] = "2"
+    first[1]["faMedia"] = not first[1]["faMedia"]
+    del first[2]
+    first.append(dict(first[3], id=10 ** 6, valutazioneMatematica="10", peso="50%"))
+    marks[1, 1] = []
+    marks[1, len(student["subjects"])] = [dict(first[3], id=10 ** 6 + 1, valutazioneMatematica="3")]
+    student["subjects"].append("MATERIA NUOVA")
+    for s in range(len(student["subjects"])):
+        marks[3, s] = marks[1, s] + marks.get((2, s), [])
+
+
+def test_aggregates_match_brute_force(server, options):
+    n = Nuvola(options)
+    check(n)
+    change_marks(server.data)
+    n.check_and_update_all(force=True)
+    check(n)
+    assert any(m.mark == 3 for s in next(n.get_time_windows()).subjects for m in s.get_all())
+    n.close()
+
+
+def test_needed(options):
+    n = Nuvola(options)
+    needed = n.get_grades().needed(7, 0.5)
+    for tw in n.get_time_windows():
+        for s in tw.subjects:
+            marks = [m for m in s.get_all() if m.relevant]
+            x = needed[tw.id_, s.id_]
+            average = (sum(m.mark * m.weight for m in marks) + x * 0.5) / (sum(m.weight for m in marks) + 0.5)
+            assert average == pytest.approx(7)
+    with pytest.raises(ValueError):
+        n.get_grades().needed(7, 0)
+    n.close()
@@ -0,0 +1,53 @@
+import datetime
+import json
+
+import pytest
+
+from nuvola import Nuvola
+
+SCANS = {
+    "fixed": {},
+    "parallel": {"scan_workers": 4},
+    "adaptive": {"adaptive_scan": True}
+}
+
+
+def dump(n):
+    """
+    Homeworks and topics of n, in a canonical order
+    """
+    d = n.dump_to_dict()
+    homeworks = sorted(json.dumps(i, sort_keys=True) for i in d["homeworks"]["data"])
+    topics = sorted(json.dumps(t, sort_keys=True) for h in d["topics"]["data"] for t in h["lesson"]["argomenti"])
+    return homeworks, topics
+
+
+def change_register(data):
+    """
+    Edits, deletes and adds homeworks and topics in the days scanned again by a refresh
+    """
+    today = datetime.date.today()
+    student = data.student(1)
+    homeworks = student["homeworks"]
+    future = [h for h in homeworks if datetime.date.fromisoformat(h["dataConsegna"][:10]) > today]
+    future[0]["descrizioneCompito"] = ["Esercizi cambiati"]
+    homeworks.remove(future[1])
+    homeworks.append(dict(future[2], id=10 ** 6, descrizioneCompito=["Esercizi aggiunti"],
+                          dataConsegna=data.date(today + datetime.timedelta(days=3))))
+    hours = student["topics"][max(d for d in student["topics"] if d <= today)]
+    hours[0]["argomenti"][0]["nomeArgomento"] = "Argomento cambiato"
+    hours[1]["argomenti"] = []
+
+
+@pytest.mark.parametrize("scan", SCANS)
+def test_refresh_equals_cold_load(server, options, scan):
+    options.set("homeworks", SCANS[scan])
+    options.set("topics", SCANS[scan])
+    n = Nuvola(options)
+    change_register(server.data)
+    n.check_and_update_all(force=True)
+    cold = Nuvola(options)
+    assert dump(n) == dump(cold)
+    assert any(h.description == "Esercizi aggiunti" for h in n.homeworks.get_all())
+    n.close()
+    cold.close()
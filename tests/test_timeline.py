@@ -0,0 +1,26 @@
+import pytest
+
+from nuvola import Nuvola
+
+
+@pytest.fixture
+def nuvola(options):
+    n = Nuvola(options)
+    yield n
+    n.close()
+
+
+@pytest.mark.parametrize("types", [None, ["homework", "mark"]])
+@pytest.mark.parametrize("limit", [1, 7, 50])
+def test_pages_match_the_stream(server, nuvola, types, limit):
+    start, end = server.data.start, server.data.end
+    stream = list(nuvola.get_timeline(start, end, types))
+    pages, cursor = [], None
+    while True:
+        page, cursor = nuvola.get_timeline_page(start, end, limit, cursor, types)
+        assert len(page) <= limit
+        pages += page
+        if cursor is None:
+            break
+    assert stream
+    assert [(d, t, id(r)) for d, t, r in pages] == [(d, t, id(r)) for d, t, r in stream]